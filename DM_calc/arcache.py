@@ -0,0 +1,280 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'profiling'))
+import stagereport
+
+# Dispersion constant in MHz^2 pc^-1 cm^3 s
+K_DM = 4.148808e3
+
+CACHE_DIRNAME = '.arcache'
+CACHE_VERSION = 2
+
+
+def file_hash(fname, blocksize=1 << 20):
+    """SHA-1 of a file's contents."""
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _cache_root(fname, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(fname)), CACHE_DIRNAME)
+    return cache_dir
+
+
+def _read_index(index_path):
+    """Archive path -> {hash, stamp} index of a cache; empty if missing or unreadable."""
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return index if isinstance(index, dict) else {}
+
+
+def _update_index(root, path, entry):
+    """Add ``entry`` for ``path`` to the index of ``root``.
+
+    The index is re-read and merged under an exclusive lock and replaced
+    through a temporary file of this writer, so concurrent workers never
+    drop each other's entries or read a partial file.
+    """
+    os.makedirs(root, exist_ok=True)
+    index_path = os.path.join(root, 'index.json')
+    with open(index_path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        index = _read_index(index_path)
+        index[path] = entry
+        fd, tmp = tempfile.mkstemp(dir=root, prefix='index.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp, index_path)
+
+
+def _entry_version(entry_dir):
+    """``CACHE_VERSION`` of a cache entry, None if it is missing or unreadable."""
+    try:
+        with open(os.path.join(entry_dir, 'meta.json')) as f:
+            return json.load(f).get('version')
+    except (OSError, ValueError):
+        return None
+
+
+def _write_entry(root, key, data, weights, f_channels, meta, replace=False):
+    """Write a cache entry into a temporary directory and rename it into place.
+
+    A current entry is only replaced with ``replace`` (a forced refresh):
+    if another worker published one first, this writer's copy is dropped.
+    Otherwise only a stale entry (older ``CACHE_VERSION``) is moved aside
+    and removed, so readers of a current entry never lose it
+    (``load_cached`` retries the rare reader of a replaced one).
+    """
+    os.makedirs(root, exist_ok=True)
+    entry_dir = os.path.join(root, key)
+    tmp_dir = tempfile.mkdtemp(dir=root, prefix=key + '.', suffix='.tmp')
+    np.save(os.path.join(tmp_dir, 'data.npy'), data)
+    np.save(os.path.join(tmp_dir, 'weights.npy'), weights)
+    np.save(os.path.join(tmp_dir, 'freqs.npy'), f_channels)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    stale = None
+    if os.path.exists(entry_dir):
+        if not replace and _entry_version(entry_dir) == CACHE_VERSION:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return entry_dir
+        stale = tmp_dir[:-len('.tmp')] + '.old'
+        try:
+            os.rename(entry_dir, stale)
+        except FileNotFoundError:
+            stale = None
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # another worker published the same archive first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if stale is not None:
+        shutil.rmtree(stale, ignore_errors=True)
+    return entry_dir
+
+
+def _open_entry(entry_dir):
+    """Meta dict, memory-mapped data and weights, and frequencies of a cache entry."""
+    with open(os.path.join(entry_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    data = np.load(os.path.join(entry_dir, 'data.npy'), mmap_mode='r')
+    weights = np.load(os.path.join(entry_dir, 'weights.npy'), mmap_mode='r')
+    f_channels = np.load(os.path.join(entry_dir, 'freqs.npy'))
+    return meta, data, weights, f_channels
+
+
+def _read_psrchive(fname):
+    """Read the pscrunched, tscrunched, un-dedispersed waterfall with PSRCHIVE."""
+    import psrchive
+
+    archive = psrchive.Archive_load(fname)
+    archive.pscrunch()
+    # un-dedisperse
+    archive.set_dispersion_measure(0.)
+    archive.dedisperse()
+    archive.set_dedispersed(False)
+    archive.tscrunch()
+
+    weights = archive.get_weights().squeeze()
+    data = archive.get_data().squeeze()
+    integration = archive.get_first_Integration()
+    try:
+        f_channels = np.asarray(archive.get_frequencies(), dtype=float).ravel()
+    except AttributeError:
+        f_channels = np.array([integration.get_centre_frequency(i) for i in range(archive.get_nchan())])
+    try:
+        mjd = integration.get_epoch().in_days()
+    except AttributeError:
+        mjd = float('nan')
+    meta = {
+        'mjd': mjd,
+        't_res': integration.get_duration() / archive.get_nbin(),
+        'f_ref': archive.get_centre_frequency(),
+        'nbin': archive.get_nbin(),
+        'nchan': archive.get_nchan(),
+        'source': os.path.abspath(fname),
+    }
+
+    if archive.get_bandwidth() < 0:
+        data = np.flipud(data)
+        weights = weights[::-1]
+        f_channels = f_channels[::-1]
+
+    return np.ascontiguousarray(data, dtype=np.float32), np.ascontiguousarray(weights, dtype=np.float32), \
+        np.ascontiguousarray(f_channels), meta
+
+
+def load_cached(fname, cache_dir=None, refresh=False):
+    """Un-dedispersed waterfall of an archive, cached as memory-mappable .npy.
+
+    The first call reads the archive with PSRCHIVE and stores the data,
+    weights and channel frequencies (ascending) under
+    ``<cache_dir>/<sha1 of the archive>/``; later calls memory-map them.
+    A small ``index.json`` maps (path, size, mtime) to the hash so unchanged
+    archives are not re-hashed. Entries and the index are written
+    atomically, so ``ProcessPoolExecutor`` workers can share one cache.
+
+    Returns
+    -------
+    data : array_like, shape (nchan, nbin)
+        Un-dedispersed, total-intensity waterfall.
+    weights : array_like, shape (nchan,)
+        Channel weights.
+    f_channels : array_like
+        Centre frequencies, in MHz (ascending).
+    meta : dict
+        ``mjd`` (epoch of the first integration), ``t_res`` (s), ``f_ref``
+        (MHz, PSRCHIVE's dedispersion reference), ``nbin``, ``nchan`` and
+        ``cached`` (False when PSRCHIVE had to read the archive). The
+        ``archive_cache_hits``/``psrchive_reads`` counters only reach a
+        stage report in the calling process; pool workers return ``cached``
+        for the parent to count.
+    """
+    root = _cache_root(fname, cache_dir)
+    st = os.stat(fname)
+    stamp = [st.st_size, st.st_mtime]
+
+    entry = _read_index(os.path.join(root, 'index.json')).get(os.path.abspath(fname))
+    key = entry['hash'] if entry is not None and entry['stamp'] == stamp else file_hash(fname)
+    entry_dir = os.path.join(root, key)
+
+    cached = not refresh and _entry_version(entry_dir) == CACHE_VERSION
+    if cached:
+        stagereport.count('archive_cache_hits')
+    else:
+        stagereport.count('psrchive_reads')
+        with stagereport.stage('psrchive'):
+            data, weights, f_channels, meta = _read_psrchive(fname)
+        meta['version'] = CACHE_VERSION
+        _write_entry(root, key, data, weights, f_channels, meta, replace=refresh)
+
+    if entry is None or entry['hash'] != key or entry['stamp'] != stamp:
+        _update_index(root, os.path.abspath(fname), {'hash': key, 'stamp': stamp})
+
+    try:
+        meta, data, weights, f_channels = _open_entry(entry_dir)
+    except FileNotFoundError:
+        # the entry was being replaced by another worker: read the new one
+        meta, data, weights, f_channels = _open_entry(entry_dir)
+    meta['cached'] = cached
+    return data, weights, f_channels, meta
+
+
+def dm_delays(f_channels, dm, f_ref):
+    """Dispersion delay of every channel relative to ``f_ref``, in s."""
+    f_channels = np.asarray(f_channels, dtype=float)
+    return K_DM * np.asarray(dm, dtype=float)[..., None] * (f_channels**-2 - float(f_ref)**-2)
+
+
+def dedisperse(data, f_channels, dm, t_res, f_ref, method='fourier'):
+    """Dedisperse a waterfall to ``dm`` by rotating every channel.
+
+    Parameters
+    ----------
+    data : array_like, shape (nchan, nbin)
+        Un-dedispersed waterfall.
+    dm : float
+        Dispersion measure, in pc cm^-3.
+    t_res : float
+        Sampling time, in s.
+    f_ref : float
+        Reference frequency that is not shifted, in MHz.
+    method : str
+        'fourier' for fractional-bin phase rotations (as PSRCHIVE does),
+        'int' for whole-bin circular shifts.
+
+    Returns
+    -------
+    waterfall : array, shape (nchan, nbin)
+    """
+    data = np.asarray(data)
+    nchan, nbin = data.shape
+    shifts = dm_delays(f_channels, dm, f_ref) / t_res
+
+    if method == 'int':
+        idx = (np.arange(nbin)[None, :] + np.round(shifts).astype(np.int64)[:, None]) % nbin
+        return data[np.arange(nchan)[:, None], idx]
+
+    spec = np.fft.rfft(data, axis=1)
+    k = np.arange(spec.shape[1])
+    spec *= np.exp(2j * np.pi * shifts[:, None] * k[None, :] / nbin)
+    return np.fft.irfft(spec, n=nbin, axis=1).astype(data.dtype, copy=False)
+
+
+def load_waterfall(fname, dm, cache_dir=None, method='fourier', with_meta=False):
+    """Drop-in replacement for the scripts' ``_load_psrchive``.
+
+    With ``with_meta`` the ``load_cached`` meta dict is returned as well.
+
+    Returns
+    -------
+    waterfall : masked array
+        Burst dynamic spectrum dedispersed to ``dm``, zero-weight channels
+        masked.
+    f_channels : array_like
+        Center frequencies, in MHz.
+    t_res : float
+        Sampling time, in s.
+    """
+    data, weights, f_channels, meta = load_cached(fname, cache_dir)
+    waterfall = np.ma.masked_array(dedisperse(data, f_channels, dm, meta['t_res'], meta['f_ref'], method))
+    waterfall[np.asarray(weights) == 0] = np.ma.masked
+    if with_meta:
+        return waterfall, f_channels, meta['t_res'], meta
+    return waterfall, f_channels, meta['t_res']
@@ -0,0 +1,250 @@
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+JB_CSV = os.path.join(REPO_DIR, 'data', 'Crab_post2011.csv')
+
+sys.path.insert(0, os.path.join(REPO_DIR, 'plots'))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pulses (
+    archive TEXT PRIMARY KEY,
+    obs TEXT NOT NULL,
+    mjd REAL NOT NULL,
+    dm REAL NOT NULL,
+    dm_err REAL,
+    peak REAL,
+    nharm INTEGER
+);
+CREATE INDEX IF NOT EXISTS pulses_mjd ON pulses (mjd);
+CREATE INDEX IF NOT EXISTS pulses_obs ON pulses (obs, mjd);
+CREATE TABLE IF NOT EXISTS jb (
+    mjd REAL PRIMARY KEY,
+    dm REAL NOT NULL,
+    dmdot REAL
+);
+'''
+
+# Structured rows returned by the queries
+PULSE_DTYPE = np.dtype([('archive', 'U512'), ('obs', 'U512'), ('mjd', 'f8'), ('dm', 'f8'),
+                        ('dm_err', 'f8'), ('peak', 'f8'), ('nharm', 'i4')])
+NIGHT_DTYPE = np.dtype([('night', 'i8'), ('mjd', 'f8'), ('n', 'i8'), ('dm_median', 'f8'),
+                        ('dm_mad', 'f8'), ('dm_wmean', 'f8'), ('dm_wmean_err', 'f8'), ('jb_dm', 'f8'),
+                        ('sun_sep', 'f8'), ('near_sun', '?')])
+
+
+def fetch_args():
+    '''
+    Fetches the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description='Ingest and query the DM(t) time-series database.')
+    parser.add_argument('-d', '--database', type=str, help='SQLite database (default = dm_timeseries.sqlite)', default='dm_timeseries.sqlite')
+    parser.add_argument('-i', '--input', type=str, nargs='+', help='dmsearch.py CSV result(s) to ingest', required=False)
+    parser.add_argument('--jb', type=str, nargs='*', help='Jodrell Bank ephemeris CSV/txt to ingest (default = data/Crab_post2011.csv)', required=False)
+    parser.add_argument('--start', type=float, help='Start MJD of the summary', required=False)
+    parser.add_argument('--end', type=float, help='End MJD of the summary', required=False)
+    parser.add_argument('--sun-limit', type=float, help='Reject nights within this many degrees of the Sun', required=False)
+    parser.add_argument('--keep-near-sun', action='store_true', help='Keep the nights within --sun-limit, flagged in the near_sun column')
+    parser.add_argument('-o', '--output', type=str, help='Write the nightly summary to this CSV file', required=False)
+
+    return parser.parse_args()
+
+
+def connect(fname):
+    """Open (and if needed create) the DM database."""
+    conn = sqlite3.connect(fname)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def obs_key(archive):
+    """Observation an archive belongs to: the directory it was written to."""
+    return os.path.dirname(os.path.abspath(archive))
+
+
+def ingest_results(conn, results):
+    """Add per-pulse DMs, replacing earlier measurements of the same archive.
+
+    Parameters
+    ----------
+    results : structured array or iterable of dict
+        Rows with ``archive``, ``mjd``, ``dm``, ``dm_err``, ``peak`` and
+        ``nharm``, as returned by ``dmsearch.search_archives``.
+
+    Returns
+    -------
+    n : int
+        Number of rows written.
+    """
+    rows = [(str(r['archive']), obs_key(str(r['archive'])), float(r['mjd']), float(r['dm']),
+             float(r['dm_err']), float(r['peak']), int(r['nharm'])) for r in results]
+    rows = [r for r in rows if np.isfinite(r[2]) and np.isfinite(r[3])]
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO pulses VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    return len(rows)
+
+
+def read_results_csv(fname):
+    """Read a CSV written by ``dmsearch.write_results``."""
+    with open(fname, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def read_jb(fname):
+    """Jodrell Bank DMs as (mjd, dm, dmdot) arrays.
+
+    Reads either the monthly ephemeris CSV (``MJD``, ``DM_pc_cm-3`` and
+    ``DMDot_pc_cm-3_yr-1`` columns) or a two-column ``YYYY-MM-DD DM`` text
+    file such as ``plots/JB-dms.txt``; the latter has no DMDot (NaN).
+    """
+    if fname.endswith('.csv'):
+        with open(fname, newline='') as f:
+            rows = list(csv.DictReader(f))
+        mjd = np.array([float(r['MJD']) for r in rows])
+        dm = np.array([float(r['DM_pc_cm-3']) for r in rows])
+        dmdot = np.array([float(r['DMDot_pc_cm-3_yr-1']) for r in rows])
+    else:
+        data = np.genfromtxt(fname, dtype=str, ndmin=2)
+        dates = np.array(data[:, 0], dtype='datetime64[D]')
+        mjd = (dates - np.datetime64('1858-11-17', 'D')).astype(float)
+        dm = data[:, 1].astype(float)
+        dmdot = np.full(mjd.size, np.nan)
+    return mjd, dm, dmdot
+
+
+def ingest_jb(conn, fname=JB_CSV):
+    """Add (or update) Jodrell Bank reference DMs."""
+    mjd, dm, dmdot = read_jb(fname)
+    rows = [(m, d, None if np.isnan(dd) else dd) for m, d, dd in zip(mjd.tolist(), dm.tolist(), dmdot.tolist())]
+    with conn:
+        conn.executemany('INSERT INTO jb VALUES (?, ?, ?) ON CONFLICT(mjd) DO UPDATE SET '
+                         'dm = excluded.dm, dmdot = COALESCE(excluded.dmdot, jb.dmdot)', rows)
+    return len(rows)
+
+
+def query_range(conn, start=None, end=None, obs=None):
+    """Per-pulse DMs with start <= MJD < end, ordered by MJD.
+
+    ``obs`` restricts the query to the archives of one output directory.
+    """
+    clauses, params = [], []
+    if start is not None:
+        clauses.append('mjd >= ?'); params.append(start)
+    if end is not None:
+        clauses.append('mjd < ?'); params.append(end)
+    if obs is not None:
+        clauses.append('obs = ?'); params.append(os.path.abspath(obs))
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+    rows = conn.execute(f'SELECT archive, obs, mjd, dm, dm_err, peak, nharm FROM pulses{where} ORDER BY mjd',
+                        params).fetchall()
+    # SQLite stores NaN as NULL
+    rows = [tuple(np.nan if v is None else v for v in row) for row in rows]
+    return np.array(rows, dtype=PULSE_DTYPE) if rows else np.empty(0, dtype=PULSE_DTYPE)
+
+
+def jb_dm(conn, mjd):
+    """Jodrell Bank reference DM at any MJD.
+
+    Each ephemeris entry is extrapolated with its DMDot (pc cm^-3 yr^-1)
+    up to the next entry; entries without a DMDot are held constant, as in
+    the step plot of ``jodrell_dm.py``. MJDs before the first entry are NaN.
+    """
+    table = np.array(conn.execute('SELECT mjd, dm, COALESCE(dmdot, 0.0) FROM jb ORDER BY mjd').fetchall(),
+                     dtype=float).reshape(-1, 3)
+    mjd = np.asarray(mjd, dtype=float)
+    if table.size == 0:
+        return np.full(mjd.shape, np.nan)
+    idx = np.searchsorted(table[:, 0], mjd, side='right') - 1
+    safe = np.clip(idx, 0, None)
+    dm = table[safe, 1] + table[safe, 2] * (mjd - table[safe, 0]) / 365.25
+    return np.where(idx >= 0, dm, np.nan)
+
+
+def nightly(conn, start=None, end=None, sun=False, sun_limit=None):
+    """Robust per-night DM aggregates with the JB reference DM at each night's mean MJD.
+
+    A night is the integer MJD. ``dm_mad`` is the scaled median absolute
+    deviation (1.4826 * MAD) and ``dm_wmean`` the inverse-variance weighted
+    mean of pulses with a finite ``dm_err``. With ``sun=True`` (implied by
+    ``sun_limit``) the Crab's solar separation (deg) is filled in from
+    ``solarsep``, otherwise NaN; ``near_sun`` flags the nights within
+    ``sun_limit`` degrees of the Sun (``solarsep.near_sun``).
+
+    Returns
+    -------
+    nights : structured array (NIGHT_DTYPE)
+    """
+    pulses = query_range(conn, start, end)
+    if pulses.size == 0:
+        return np.empty(0, dtype=NIGHT_DTYPE)
+    night = np.floor(pulses['mjd']).astype(np.int64)
+    uniq, first, counts = np.unique(night, return_index=True, return_counts=True)
+
+    out = np.zeros(uniq.size, dtype=NIGHT_DTYPE)
+    out['night'] = uniq
+    out['n'] = counts
+    for i, (lo, n) in enumerate(zip(first, counts)):
+        p = pulses[lo:lo + n]
+        med = np.median(p['dm'])
+        out['mjd'][i] = p['mjd'].mean()
+        out['dm_median'][i] = med
+        out['dm_mad'][i] = 1.4826 * np.median(np.abs(p['dm'] - med))
+        good = np.isfinite(p['dm_err']) & (p['dm_err'] > 0)
+        if good.any():
+            w = p['dm_err'][good]**-2
+            out['dm_wmean'][i] = (w * p['dm'][good]).sum() / w.sum()
+            out['dm_wmean_err'][i] = w.sum()**-0.5
+        else:
+            out['dm_wmean'][i] = out['dm_wmean_err'][i] = np.nan
+    out['jb_dm'] = jb_dm(conn, out['mjd'])
+    if sun or sun_limit is not None:
+        import solarsep
+        out['sun_sep'] = solarsep.sun_separation(out['mjd'])
+        if sun_limit is not None:
+            out['near_sun'] = solarsep.near_sun(out['mjd'], sun_limit)
+    else:
+        out['sun_sep'] = np.nan
+    return out
+
+
+def write_nightly(nights, fname):
+    with open(fname, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(NIGHT_DTYPE.names)
+        for r in nights:
+            writer.writerow([r[name] for name in NIGHT_DTYPE.names])
+    print(f"Saved {len(nights)} nights to {fname}")
+
+
+def main():
+    args = fetch_args()
+    conn = connect(args.database)
+
+    if args.jb is not None or conn.execute('SELECT COUNT(*) FROM jb').fetchone()[0] == 0:
+        for fname in args.jb or [JB_CSV]:
+            print(f"Ingested {ingest_jb(conn, fname)} Jodrell Bank DMs from {fname}")
+    for fname in args.input or []:
+        print(f"Ingested {ingest_results(conn, read_results_csv(fname))} pulse DMs from {fname}")
+
+    nights = nightly(conn, args.start, args.end, sun_limit=args.sun_limit)
+    if args.sun_limit is not None:
+        near = nights['near_sun']
+        print(f"{'Flagged' if args.keep_near_sun else 'Rejected'} {np.count_nonzero(near)} nights "
+              f"within {args.sun_limit} deg of the Sun")
+        if not args.keep_near_sun:
+            nights = nights[~near]
+    for r in nights:
+        print(f"MJD {r['night']}: {r['n']} pulses, DM = {r['dm_median']:.5f} +/- {r['dm_mad']:.5f} "
+              f"(JB {r['jb_dm']:.5f})" + (' near Sun' if r['near_sun'] else ''))
+    if args.output:
+        write_nightly(nights, args.output)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import argparse
+import csv
+import glob
+import os
+
+import numpy as np
+
+import arcache
+import dmdb
+import stagereport
+
+# Structured result of a DM search, one row per archive
+RESULT_DTYPE = np.dtype([('archive', 'U512'), ('mjd', 'f8'), ('dm', 'f8'), ('dm_err', 'f8'),
+                         ('peak', 'f8'), ('nharm', 'i4')])
+
+
+def fetch_args():
+    '''
+    Fetches the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description='Phase-coherence DM search of giant-pulse archives.')
+    parser.add_argument('input', type=str, nargs='+', help='Archive(s) or directory(s) of .ar files')
+    parser.add_argument('-DM_s', '--dm-start', type=float, help='Lowest trial DM (default = 56.6)', default=56.6)
+    parser.add_argument('-DM_e', '--dm-end', type=float, help='Highest trial DM (default = 56.9)', default=56.9)
+    parser.add_argument('--coarse', type=float, help='Coarse DM step (default = 0.01)', default=0.01)
+    parser.add_argument('-DM_step', '--fine', type=float, help='Fine DM step around the coarse peak (default = 0.001)', default=0.001)
+    parser.add_argument('--nharm', type=int, help='Number of Fourier harmonics to use (default = automatic)', required=False)
+    parser.add_argument('--batch', type=int, help='Pulses searched together (default = 64)', default=64)
+    parser.add_argument('-o', '--output', type=str, help='Write results to this CSV file', required=False)
+    parser.add_argument('--db', type=str, help='Also ingest results into this DM time-series database', required=False)
+    stagereport.add_arguments(parser)
+
+    return parser.parse_args()
+
+
+def unit_phasors(data, weights=None):
+    """Fourier transform every channel and normalise each component to unit amplitude.
+
+    Zero-weight channels and empty components contribute nothing.
+
+    Returns
+    -------
+    phasors : array, shape (nchan, nbin // 2 + 1)
+    """
+    spec = np.fft.rfft(np.asarray(data, dtype=float), axis=-1)
+    amp = np.abs(spec)
+    phasors = np.divide(spec, amp, out=np.zeros_like(spec), where=amp > 0)
+    if weights is not None:
+        phasors[..., np.asarray(weights) == 0, :] = 0
+    return phasors
+
+
+def noise_level(phasors):
+    """Expected coherent power of one harmonic with no pulse: the number of live channels."""
+    return np.count_nonzero(np.abs(phasors[..., 1:]).sum(axis=-1), axis=-1).astype(float)
+
+
+def harmonic_power(phasors, f_channels, dms, t_res, f_ref, kmax=None, max_elements=4_000_000):
+    """Phase-coherent power of every harmonic of one or many pulses for every trial DM.
+
+    Dedispersing a channel by DM is a phase rotation of its Fourier
+    components, so |sum_c U_ck exp(2 pi i k s_c / N)|^2 is evaluated for
+    all DMs without ever dedispersing the waterfall. For every harmonic the
+    channel sum is one matrix product over the whole batch of pulses.
+
+    Parameters
+    ----------
+    phasors : array, shape ([npulse,] nchan, nfreq)
+        Unit phasors from ``unit_phasors``.
+    dms : array_like
+        Trial DMs.
+    kmax : int, optional
+        Highest harmonic, defaults to all of them.
+
+    Returns
+    -------
+    power : array, shape ([npulse,] kmax, ndm)
+        Power of harmonics k = 1..kmax.
+    """
+    phasors = np.asarray(phasors)
+    single = phasors.ndim == 2
+    if single:
+        phasors = phasors[None]
+    npulse, nchan, nfreq = phasors.shape
+    nbin = 2 * (nfreq - 1)
+    kmax = nfreq - 1 if kmax is None else min(int(kmax), nfreq - 1)
+    dms = np.atleast_1d(np.asarray(dms, dtype=float))
+    k = np.arange(1, kmax + 1)
+
+    Ut = np.ascontiguousarray(np.moveaxis(phasors[..., 1:kmax + 1], -1, 0))  # (K, npulse, nchan)
+    # per-channel shift in bins per unit DM
+    g = arcache.dm_delays(f_channels, 1.0, f_ref) / t_res                # (nchan,)
+
+    chunk = max(1, max_elements // (nchan * kmax))
+    out = np.empty((npulse, kmax, dms.size))
+    for start in range(0, dms.size, chunk):
+        d = dms[start:start + chunk]
+        rot = np.exp((2j * np.pi / nbin) * k[:, None, None] * g[None, :, None] * d[None, None, :])  # (K, nchan, nd)
+        out[:, :, start:start + chunk] = np.moveaxis(np.abs(Ut @ rot)**2, 0, 1)
+    return out[0] if single else out
+
+
+def coherent_power(phasors, f_channels, dms, t_res, f_ref, nharm=None):
+    """Phase-coherent power summed over harmonics k = 1..nharm (per pulse).
+
+    Returns
+    -------
+    power : array, shape ([npulse,] ndm)
+    """
+    nharm_max = None if nharm is None else int(np.max(nharm))
+    power = harmonic_power(phasors, f_channels, dms, t_res, f_ref, nharm_max)
+    if nharm is None or np.ndim(nharm) == 0:
+        return power.sum(axis=-2)
+    kmask = np.arange(1, power.shape[-2] + 1)[None, :] <= np.asarray(nharm)[:, None]
+    return np.einsum('pkd,pk->pd', power, kmask.astype(float))
+
+
+def select_nharm(spectrum, noise, min_harm=4):
+    """Number of harmonics that maximises the S/N of the harmonic sum.
+
+    Without a pulse the coherent power of a harmonic is exponentially
+    distributed with mean and standard deviation ``noise``, so the sum of
+    the first n harmonics has S/N (sum - n * noise) / (noise * sqrt(n)).
+    """
+    n = np.arange(1, len(spectrum) + 1)
+    snr = (np.cumsum(spectrum) - n * noise) / (noise * np.sqrt(n))
+    snr[:min_harm - 1] = -np.inf
+    return int(np.argmax(snr) + 1)
+
+
+def peak_dm(dms, power, noise, npts=7):
+    """DM of the peak from a quadratic fit, with its 1-sigma error.
+
+    For unit phasors the log-likelihood of a trial DM is power / (2 * noise)
+    up to a constant, so the 1-sigma error is the DM offset over which the
+    fitted parabola drops by ``noise``.
+    """
+    i = int(np.argmax(power))
+    lo, hi = max(0, i - npts // 2), min(len(dms), i + npts // 2 + 1)
+    x = dms[lo:hi] - dms[i]
+    if x.size < 4:
+        return dms[i], np.nan
+    a, b, c = np.polyfit(x, power[lo:hi], 2)
+    if a >= 0:
+        return dms[i], np.nan
+    return dms[i] - b / (2 * a), np.sqrt(noise / -a)
+
+
+def search_pulses(phasors, f_channels, t_res, f_ref, nharm=None, dm_start=56.6, dm_end=56.9,
+                  coarse=0.01, fine=0.001):
+    """Coarse-to-fine DM search of a batch of pulses sharing one channelisation.
+
+    The coarse pass sums all harmonics (or the first ``nharm``); unless
+    ``nharm`` is given, each pulse's harmonics are then chosen from its
+    coherent spectrum at the coarse peak before the fine pass.
+
+    Returns
+    -------
+    dm, dm_err, peak : arrays, one value per pulse
+    nharm : array of int
+    """
+    phasors = np.asarray(phasors)
+    if phasors.ndim == 2:
+        phasors = phasors[None]
+    npulse = phasors.shape[0]
+    noise = noise_level(phasors)
+
+    coarse_dms = np.arange(dm_start, dm_end + coarse / 2, coarse)
+    coarse_spec = harmonic_power(phasors, f_channels, coarse_dms, t_res, f_ref, nharm)
+    best = np.argmax(coarse_spec.sum(axis=1), axis=1)
+    if nharm is None:
+        harms = np.array([select_nharm(coarse_spec[p, :, best[p]], noise[p]) for p in range(npulse)])
+    else:
+        harms = np.full(npulse, int(nharm))
+
+    dm = np.empty(npulse); dm_err = np.empty(npulse); peak = np.empty(npulse)
+    offsets = np.arange(-coarse, coarse + fine / 2, fine)
+    for p in range(npulse):
+        fine_dms = coarse_dms[best[p]] + offsets
+        fine_power = coherent_power(phasors[p], f_channels, fine_dms, t_res, f_ref, harms[p])
+        dm[p], dm_err[p] = peak_dm(fine_dms, fine_power, noise[p])
+        peak[p] = fine_power.max()
+    return dm, dm_err, peak, harms
+
+
+def search_archives(archives, dm_start=56.6, dm_end=56.9, coarse=0.01, fine=0.001, nharm=None, batch=64):
+    """DM search of many archives, batching those with the same channelisation.
+
+    Waterfalls come from the ``arcache`` cache, so each archive is read by
+    PSRCHIVE at most once. Up to ``batch`` pulses are searched together.
+
+    Returns
+    -------
+    results : structured array (RESULT_DTYPE)
+    """
+    groups = {}
+    loaded = {}
+    with stagereport.stage('load_archives'):
+        for ar in archives:
+            data, weights, f_channels, meta = arcache.load_cached(ar)
+            key = (data.shape, meta['t_res'], meta['f_ref'], f_channels.tobytes())
+            groups.setdefault(key, []).append(ar)
+            loaded[ar] = (data, weights, f_channels, meta)
+    stagereport.count('archives_read', len(loaded))
+
+    results = np.zeros(len(archives), dtype=RESULT_DTYPE)
+    row = {ar: i for i, ar in enumerate(archives)}
+    for key, members in groups.items():
+        _, t_res, f_ref, _ = key
+        f_channels = loaded[members[0]][2]
+        for start in range(0, len(members), batch):
+            chunk = members[start:start + batch]
+            with stagereport.stage('phasors'):
+                phasors = np.stack([unit_phasors(loaded[ar][0], loaded[ar][1]) for ar in chunk])
+            with stagereport.stage('search'):
+                dm, dm_err, peak, harms = search_pulses(phasors, f_channels, t_res, f_ref, nharm,
+                                                        dm_start, dm_end, coarse, fine)
+            stagereport.count('pulses_searched', len(chunk))
+            for j, ar in enumerate(chunk):
+                results[row[ar]] = (ar, loaded[ar][3].get('mjd', np.nan), dm[j], dm_err[j], peak[j], harms[j])
+    return results
+
+
+def write_results(results, fname):
+    with open(fname, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(RESULT_DTYPE.names)
+        for r in results:
+            writer.writerow([r[name] for name in RESULT_DTYPE.names])
+    print(f"Saved {len(results)} DM measurements to {fname}")
+
+
+def find_archives(inputs):
+    """Expand directories into the .ar files they contain."""
+    archives = []
+    for path in inputs:
+        if os.path.isdir(path):
+            archives.extend(sorted(glob.glob(os.path.join(path, '**', '*.ar'), recursive=True)))
+        else:
+            archives.append(path)
+    return archives
+
+
+def search(args):
+    stagereport.lap('dm_search')
+    archives = find_archives(args.input)
+    results = search_archives(archives, args.dm_start, args.dm_end, args.coarse, args.fine, args.nharm,
+                              args.batch)
+
+    for r in results:
+        print(f"{r['archive']} MJD: {r['mjd']:.8f} DM: {r['dm']:.5f} +/- {r['dm_err']:.5f}")
+    stagereport.lap('write')
+    if args.output:
+        write_results(results, args.output)
+    if args.db:
+        conn = dmdb.connect(args.db)
+        print(f"Ingested {dmdb.ingest_results(conn, results)} pulse DMs into {args.db}")
+        conn.close()
+
+
+def main():
+    args = fetch_args()
+    with stagereport.from_args(args, 'dmsearch'):
+        search(args)
+
+
+if __name__ == "__main__":
+    main()
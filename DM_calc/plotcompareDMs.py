@@ -1,11 +1,35 @@
-import psrchive
+import argparse
+import os
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
-import scienceplots; plt.style.use(['science','no-latex'])
+import arcache
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from crabgp import plotting
+
+
+def fetch_args():
+    '''
+    Fetches the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description='Plot the spectrum and waterfall of an archive dedispersed at two DMs.')
+    parser.add_argument('input', type=str, help='Archive (.ar), e.g. Crab_uncorrected.ar')
+    parser.add_argument('--dm', type=float, nargs=2, help='The two DMs (default = 56.8 56.711)', default=[56.8, 56.711])
+    parser.add_argument('--snr', type=float, nargs=2, help='S/N at the two DMs, written on the plot', required=False)
+    parser.add_argument('--tmin', type=float, help='Start of the plotted time range in s (default = 0.1)', default=0.1)
+    parser.add_argument('--tmax', type=float, help='End of the plotted time range in s (default = 0.21)', default=0.21)
+    parser.add_argument('-o', '--output', type=str, help='Output name without extension (default = DMcompare)', default='DMcompare')
+
+    return parser.parse_args()
+
 
 def _load_psrchive(fname, dm):
     """Load data from a PSRCHIVE file.
 
+    The pscrunched, tscrunched, un-dedispersed waterfall is cached by
+    ``arcache`` and dedispersed to ``dm`` in NumPy, so trying another DM
+    does not re-read the archive.
+
     Parameters
     ----------
     fname : str
@@ -21,46 +45,20 @@ def _load_psrchive(fname, dm):
         Sampling time, in s.
 
     """
-    archive = psrchive.Archive_load(fname)
-    archive.pscrunch()
-    # un-dedisperse
-    archive.set_dispersion_measure(0.)
-    archive.dedisperse()
-    archive.set_dedispersed(False)
-    # archive.centre() # no polyco
-    
-    archive.set_dispersion_measure(dm)
-    archive.dedisperse()
-    archive.set_dedispersed(True)
-    archive.tscrunch()
-    
-    weights = archive.get_weights().squeeze()
-    waterfall = np.ma.masked_array(archive.get_data().squeeze())
-    waterfall[weights == 0] = np.ma.masked
-    f_channels = np.array([
-        archive.get_first_Integration().get_centre_frequency(i) \
-        for i in range(archive.get_nchan())])
-    t_res = archive.get_first_Integration().get_duration() \
-        / archive.get_nbin()
-
-    if archive.get_bandwidth() < 0:
-        waterfall = np.flipud(waterfall)
-        f_channels = f_channels[::-1]
-
-    return waterfall, f_channels, t_res
+    return arcache.load_waterfall(fname, dm)
 
 
 
 def main():
-    
-    uc_waterfall, uc_f_channels, uc_t_res = _load_psrchive('Crab_uncorrected.ar', dm=56.8)
-    c_waterfall, c_f_channels, c_t_res = _load_psrchive('Crab_uncorrected.ar', dm=56.711)
+    args = fetch_args()
+    uc_waterfall, uc_f_channels, uc_t_res = _load_psrchive(args.input, dm=args.dm[0])
+    c_waterfall, c_f_channels, c_t_res = _load_psrchive(args.input, dm=args.dm[1])
     print("Waterfall shape:", uc_waterfall.shape)
     
     # uc_t_res
     
-    # mask time from 0.12 to 0.17 
-    time_mask = (np.arange(uc_waterfall.shape[1]) * uc_t_res >= 0.1) & (np.arange(uc_waterfall.shape[1]) * uc_t_res <= 0.21)
+    # mask time from tmin to tmax
+    time_mask = (np.arange(uc_waterfall.shape[1]) * uc_t_res >= args.tmin) & (np.arange(uc_waterfall.shape[1]) * uc_t_res <= args.tmax)
     # invert mask to keep only time from 0.12 to 0.17
     uc_waterfall = uc_waterfall[:, time_mask]
     c_waterfall  = c_waterfall[:, time_mask]
@@ -71,6 +69,7 @@ def main():
     c_avg_spectrum = np.mean(c_waterfall, axis=0)
    
     # gridspec 2x2, share x axis 
+    plt = plotting.pyplot()
     
     fig, axs = plt.subplots(
         2, 2,
@@ -84,11 +83,10 @@ def main():
     axs[0, 0].plot(freq, uc_avg_spectrum/np.max(c_avg_spectrum), color='black')
     axs[0, 1].plot(freq, c_avg_spectrum/np.max(c_avg_spectrum), color='black')
     # add text for SNR and DM values 
-    axs[0, 0].text(0.79, 0.85, "DM = 56.8", transform=axs[0, 0].transAxes, ha='center', va='center')
-    axs[0, 0].text(0.8, 0.73, "SNR = 762.9", transform=axs[0, 0].transAxes, ha='center', va='center')
-        
-    axs[0, 1].text(0.79, 0.85, "DM = 56.711", transform=axs[0, 1].transAxes, ha='center', va='center')
-    axs[0, 1].text(0.8, 0.73, "SNR = 1839.1", transform=axs[0, 1].transAxes, ha='center', va='center')
+    for i, ax in enumerate(axs[0, :]):
+        ax.text(0.79, 0.85, f"DM = {args.dm[i]:g}", transform=ax.transAxes, ha='center', va='center')
+        if args.snr:
+            ax.text(0.8, 0.73, f"SNR = {args.snr[i]:.1f}", transform=ax.transAxes, ha='center', va='center')
     
     # x-limits
     axs[0, 0].set_xlim(freq.min(), freq.max())
@@ -127,8 +125,8 @@ def main():
     axs[1, 1].set_xlabel("Time (s)")
     axs[1, 0].set_ylabel("Frequency (MHz)")
     plt.tight_layout()
-    plt.savefig('DMcompare.png', dpi=300)
-    plt.savefig('DMcompare.pdf', dpi=300)
+    plt.savefig(f'{args.output}.png', dpi=300)
+    plt.savefig(f'{args.output}.pdf', dpi=300)
   
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -22,8 +22,7 @@ mjd=$(awk -v mjd="$start_mjd" \
 
 echo "start MJD: $mjd"
 
-new_DM=$(python /mnt/ucc4_data2/data/Owen/software/DM_phase/DM_phase_parallel.py \
-    --mjd $mjd --tobs $t_obs --csv -no_plot --n_jobs 62 \
+new_DM=$(python "$(dirname "$0")/dmsearch.py" \
     -DM_s 56.6 -DM_e 56.9 -DM_step 0.001 "$archive" \
     | tee /dev/tty \
     | grep -oP 'DM:\s*\K[0-9.]+' )
\ No newline at end of file
@@ -0,0 +1,147 @@
+import os
+import sys
+
+import numpy as np
+
+import candstore
+import stagereport
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plots'))
+
+# Reduced candidate record: numeric columns plus integer references back into
+# the per-observation stores, so no strings are held until the final selection
+REDUCED_DTYPE = np.dtype([('time', 'f8'), ('mjd', 'f8'), ('dm', 'f8'), ('width', 'f8'), ('snr', 'f8'),
+                          ('ifile', 'i4'), ('obs', 'i4'), ('row', 'i8')])
+
+
+class Categories:
+    """Incrementally built string -> integer code table."""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, strings):
+        uniq, inverse = np.unique(strings, return_inverse=True)
+        lut = np.empty(len(uniq), dtype=np.int32)
+        for i, value in enumerate(uniq):
+            value = str(value)
+            if value not in self.codes:
+                self.codes[value] = len(self.values)
+                self.values.append(value)
+            lut[i] = self.codes[value]
+        return lut[inverse.ravel()]
+
+    def decode(self, codes):
+        return np.asarray(self.values, dtype=str)[codes] if len(codes) else np.empty(0, dtype=str)
+
+
+def iter_chunks(obs_dirs, chunksize=1_000_000):
+    """Yield ``(obs_id, start, chunk)`` slices of the memory-mapped stores."""
+    for obs_id, obs_dir in enumerate(obs_dirs):
+        store = candstore.load_store(obs_dir)
+        for start in range(0, len(store), chunksize):
+            yield obs_id, start, store[start:start + chunksize]
+
+
+def chunk_mask(chunk, threshold=None, dm_min=None, drop_replot=True, sun_limit=None):
+    """Boolean mask of the S/N, DM, '_replot' and near-Sun cuts used by transientXanalysis.
+
+    With ``sun_limit`` candidates recorded within that many degrees of the
+    Sun (``solarsep.near_sun``) are dropped.
+    """
+    mask = np.ones(len(chunk), dtype=bool)
+    if threshold is not None:
+        mask &= chunk['snr'] > threshold
+    if dm_min is not None:
+        mask &= chunk['dm'] > dm_min
+    if drop_replot:
+        mask &= np.char.find(chunk['png'], '_replot') < 0
+    if sun_limit is not None and mask.any():
+        import solarsep
+        mask[mask] = ~solarsep.near_sun(chunk['mjd'][mask], sun_limit)
+    return mask
+
+
+def max_snr_per_time(records):
+    """Keep the highest-S/N record per unique time (last one wins on ties)."""
+    order = np.lexsort((records['snr'], records['time']))
+    records = records[order]
+    keep = np.r_[records['time'][1:] != records['time'][:-1], True]
+    return records[keep]
+
+
+@stagereport.timed('select')
+def select_candidates(obs_dirs, threshold=None, dm_min=None, drop_replot=True,
+                      chunksize=1_000_000, verbose=True, sun_limit=None):
+    """Filter and de-duplicate the candidate stores chunk by chunk.
+
+    Each chunk is cut, reduced to its highest-S/N candidate per time and
+    merged into a running buffer that is itself reduced whenever it grows
+    past ``chunksize``, so memory is bounded by the number of unique
+    times rather than the number of candidates.
+
+    Returns
+    -------
+    kept : structured array (REDUCED_DTYPE)
+        Surviving candidates ordered by descending S/N.
+    ifiles : Categories
+        Code table for the ``ifile`` column.
+    """
+    ifiles = Categories()
+    buffer = []
+    nbuffer = 0
+    nread = 0
+    reduced = np.empty(0, dtype=REDUCED_DTYPE)
+
+    for obs_id, start, chunk in iter_chunks(obs_dirs, chunksize):
+        nread += len(chunk)
+        idx = np.flatnonzero(chunk_mask(chunk, threshold, dm_min, drop_replot, sun_limit))
+        if idx.size == 0:
+            continue
+
+        records = np.empty(idx.size, dtype=REDUCED_DTYPE)
+        for field in ('time', 'mjd', 'dm', 'width', 'snr'):
+            records[field] = chunk[field][idx]
+        records['ifile'] = ifiles.encode(chunk['ifile'][idx])
+        records['obs'] = obs_id
+        records['row'] = start + idx
+
+        buffer.append(max_snr_per_time(records))
+        nbuffer += len(buffer[-1])
+        if nbuffer > chunksize:
+            reduced = max_snr_per_time(np.concatenate([reduced] + buffer))
+            buffer, nbuffer = [], 0
+
+    reduced = max_snr_per_time(np.concatenate([reduced] + buffer))
+    stagereport.count('candidates_streamed', nread)
+    if verbose:
+        print(f"Streamed {nread} candidates, kept {len(reduced)} unique times")
+
+    return reduced[np.argsort(reduced['snr'])[::-1]], ifiles
+
+
+def resolve_strings(kept, obs_dirs, ifiles, n=None, n_png=None):
+    """Look up ``png`` and ``ifile`` strings for the first kept candidates.
+
+    The first ``n`` (all if None) are resolved; with ``n_png`` the lookup
+    continues, in doubling batches, until ``n_png`` of the resolved rows
+    have a non-empty ``png`` or ``kept`` runs out.
+    """
+    def lookup(rows):
+        png = np.empty(len(rows), dtype=object)
+        for obs_id, obs_dir in enumerate(obs_dirs):
+            sel = np.flatnonzero(rows['obs'] == obs_id)
+            if sel.size:
+                png[sel] = candstore.load_store(obs_dir)['png'][rows['row'][sel]]
+        return png.astype(str)
+
+    end = len(kept) if n is None else min(n, len(kept))
+    png = lookup(kept[:end])
+    if n_png is not None:
+        step = max(end, n_png, 1)
+        while end < len(kept) and np.count_nonzero(png != '') < n_png:
+            png = np.concatenate([png, lookup(kept[end:end + step])])
+            end = len(png)
+            step *= 2
+    return png, ifiles.decode(kept['ifile'][:end])
@@ -0,0 +1,340 @@
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'profiling'))
+import stagereport
+
+# Columns of a TransientX .cands line that the analysis scripts use
+CANDS_USECOLS = (2, 3, 4, 5, 8, 10)
+FLOAT_FIELDS = ('time', 'mjd', 'dm', 'width', 'snr')
+STR_FIELDS = ('png', 'ifile')
+
+# Candidates written directly as structured arrays (transientX/gpsearch.py)
+NATIVE_SUFFIX = '.cands.npy'
+
+STORE_NAME = 'cands_store.npy'
+INDEX_NAME = 'cands_store.json'
+# Written in each input directory: observation -> store, row count and stamp
+MERGED_INDEX_NAME = 'cands_index.json'
+STORE_VERSION = 1
+
+
+def fetch_args():
+    '''
+    Fetches the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description='Ingest TransientX .cands files into a columnar candidate store.')
+    parser.add_argument('-i', '--input', type=str, help='Input directory(s)', required=True)
+    parser.add_argument('--rebuild', help='Re-parse every .cands file (default = False)', required=False, action='store_true')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of parser processes (default = all cores)', required=False)
+
+    return parser.parse_args()
+
+
+def cands_dtype(png_len=1, ifile_len=1):
+    """Structured dtype of the candidate store for the given string widths."""
+    return np.dtype([(name, 'f8') for name in FLOAT_FIELDS] +
+                    [('png', f'U{max(int(png_len), 1)}'), ('ifile', f'U{max(int(ifile_len), 1)}')])
+
+
+def parse_cands(cands_file):
+    """Parse one .cands text file into a structured candidate array.
+
+    ``time`` is relative to the earliest MJD in the file, as in
+    ``transientXanalysis.read_transientx``. Native ``.cands.npy`` tables
+    are loaded as they are.
+    """
+    if cands_file.endswith(NATIVE_SUFFIX):
+        return np.load(cands_file)
+    if os.path.getsize(cands_file) == 0:
+        return np.empty(0, dtype=cands_dtype())
+
+    raw = np.loadtxt(cands_file, usecols=CANDS_USECOLS, dtype=str, ndmin=2)
+    if raw.shape[0] == 0:
+        return np.empty(0, dtype=cands_dtype())
+
+    png, ifile = raw[:, 4], raw[:, 5]
+    cands = np.empty(raw.shape[0], dtype=cands_dtype(max(map(len, png)), max(map(len, ifile))))
+    for name, col in zip(('mjd', 'dm', 'width', 'snr'), range(4)):
+        cands[name] = raw[:, col].astype(float)
+    cands['time'] = cands['mjd'] - cands['mjd'].min()
+    cands['png'] = png
+    cands['ifile'] = ifile
+
+    return cands
+
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return {'mtime': st.st_mtime, 'size': st.st_size}
+
+
+def _read_index(obs_dir):
+    index_path = os.path.join(obs_dir, INDEX_NAME)
+    store_path = os.path.join(obs_dir, STORE_NAME)
+    if not (os.path.exists(index_path) and os.path.exists(store_path)):
+        return None
+    with open(index_path) as f:
+        index = json.load(f)
+    if index.get('version') != STORE_VERSION:
+        return None
+    return index
+
+
+def _common_dtype(arrays):
+    png_len = max((a.dtype['png'].itemsize // 4 for a in arrays), default=1)
+    ifile_len = max((a.dtype['ifile'].itemsize // 4 for a in arrays), default=1)
+    return cands_dtype(png_len, ifile_len)
+
+
+def _write_store(obs_dir, parts, files):
+    """Concatenate per-file parts and atomically replace the store + index."""
+    dtype = _common_dtype(parts)
+    nrows = sum(len(p) for p in parts)
+    store = np.empty(nrows, dtype=dtype)
+
+    start = 0
+    index = {'version': STORE_VERSION, 'nrows': nrows, 'files': {}}
+    for (name, stamp), part in zip(files, parts):
+        stop = start + len(part)
+        for field in dtype.names:
+            store[field][start:stop] = part[field]
+        index['files'][name] = dict(stamp, start=start, stop=stop)
+        start = stop
+
+    store_path = os.path.join(obs_dir, STORE_NAME)
+    index_path = os.path.join(obs_dir, INDEX_NAME)
+    with open(store_path + '.tmp', 'wb') as f:
+        np.save(f, store)
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(store_path + '.tmp', store_path)
+    os.replace(index_path + '.tmp', index_path)
+
+    return nrows
+
+
+def _is_fresh(entry, stamp):
+    return entry is not None and entry['mtime'] == stamp['mtime'] and entry['size'] == stamp['size']
+
+
+def find_cands_files(obs_dir, recursive=False):
+    """TransientX .cands files and native .cands.npy tables in a directory."""
+    pattern = os.path.join(obs_dir, '**', '*.cands') if recursive else os.path.join(obs_dir, '*.cands')
+    return glob.glob(pattern, recursive=recursive) + glob.glob(pattern + '.npy', recursive=recursive)
+
+
+def _plan_observation(obs_dir, cands_files=None, rebuild=False):
+    """Work out which .cands files in ``obs_dir`` need (re-)parsing.
+
+    Returns ``(names, stamps, index, stale)``; ``stale`` is empty and
+    ``index`` is not None when the store is already up to date.
+    """
+    if cands_files is None:
+        cands_files = find_cands_files(obs_dir)
+    names = sorted(os.path.basename(f) for f in cands_files)
+    stamps = {name: _file_stamp(os.path.join(obs_dir, name)) for name in names}
+
+    index = None if rebuild else _read_index(obs_dir)
+    old = index['files'] if index is not None else {}
+    stale = [n for n in names if not _is_fresh(old.get(n), stamps[n])]
+    if index is not None and not stale and list(old) != names:
+        # files were removed: nothing to parse but the store must be rewritten
+        index = dict(index, files={n: old[n] for n in names}, rewrite=True)
+    return names, stamps, index, stale
+
+
+def _assemble_observation(obs_dir, names, stamps, index, parsed):
+    """Write the store for ``obs_dir`` from old rows plus freshly parsed files."""
+    old = index['files'] if index is not None else {}
+    old_store = np.load(os.path.join(obs_dir, STORE_NAME), mmap_mode='r') if index is not None else None
+
+    parts = []
+    for name in names:
+        if name in parsed:
+            parts.append(parsed[name])
+        else:
+            entry = old[name]
+            parts.append(old_store[entry['start']:entry['stop']])
+
+    return _write_store(obs_dir, parts, [(n, stamps[n]) for n in names])
+
+
+def ingest_observation(obs_dir, cands_files=None, rebuild=False):
+    """Bring the store in ``obs_dir`` up to date with its .cands files.
+
+    Only files whose mtime/size differ from the index are re-parsed; rows of
+    unchanged files are copied from the existing (memory-mapped) store.
+
+    Returns
+    -------
+    nparsed : int
+        Number of .cands files that had to be parsed.
+    nrows : int
+        Number of candidates now held in the store.
+    """
+    names, stamps, index, stale = _plan_observation(obs_dir, cands_files, rebuild)
+    if not stale and index is not None and not index.get('rewrite'):
+        return 0, index['nrows']
+
+    parsed = {name: parse_cands(os.path.join(obs_dir, name)) for name in stale}
+    return len(stale), _assemble_observation(obs_dir, names, stamps, index, parsed)
+
+
+def _write_merged_index(input_dir, obs_dirs):
+    """Atomically write the merged index of the stores below ``input_dir``."""
+    top = os.path.abspath(input_dir)
+    index = {'version': STORE_VERSION, 'observations': {}}
+    for obs_dir in obs_dirs:
+        if os.path.commonpath([top, obs_dir]) != top:
+            continue
+        obs_index = _read_index(obs_dir)
+        if obs_index is None:
+            continue
+        store_path = os.path.join(obs_dir, STORE_NAME)
+        index['observations'][os.path.relpath(obs_dir, top)] = dict(
+            _file_stamp(store_path), store=os.path.relpath(store_path, top), nrows=obs_index['nrows'])
+
+    index_path = os.path.join(top, MERGED_INDEX_NAME)
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(index_path + '.tmp', index_path)
+    return index
+
+
+def read_merged_index(input_dir):
+    """The merged index of ``input_dir``, or None if missing or out of date.
+
+    Maps each observation directory (relative to ``input_dir``) to its
+    ``store`` path, ``nrows`` and the store's ``mtime``/``size``, so a
+    run's observations and candidate counts are known without walking
+    the tree or opening the stores. An entry whose store has changed
+    since makes the whole index stale.
+    """
+    index_path = os.path.join(input_dir, MERGED_INDEX_NAME)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path) as f:
+        index = json.load(f)
+    if index.get('version') != STORE_VERSION:
+        return None
+    for entry in index['observations'].values():
+        store_path = os.path.join(input_dir, entry['store'])
+        if not os.path.exists(store_path) or not _is_fresh(entry, _file_stamp(store_path)):
+            return None
+    return index
+
+
+def group_cands_files(input_dirs):
+    """Recursively find .cands (and .cands.npy) files and group them by their parent directory."""
+    groups = {}
+    for d in input_dirs:
+        for f in find_cands_files(d, recursive=True):
+            groups.setdefault(os.path.dirname(os.path.abspath(f)), []).append(f)
+    return groups
+
+
+@stagereport.timed('ingest')
+def ingest(input_dirs, rebuild=False, verbose=True, n_jobs=None):
+    """Ingest every observation directory found below ``input_dirs``.
+
+    Stale .cands files from all observations are parsed together over a
+    pool of ``n_jobs`` processes (all cores by default, 1 to stay serial).
+
+    Returns the list of observation directories holding a store. The
+    merged index of each input directory is rewritten afterwards (see
+    ``read_merged_index``).
+    """
+    groups = group_cands_files(input_dirs)
+    plans = {obs_dir: _plan_observation(obs_dir, files, rebuild) for obs_dir, files in groups.items()}
+
+    todo = [(obs_dir, name) for obs_dir, plan in sorted(plans.items()) for name in plan[3]]
+    paths = [os.path.join(obs_dir, name) for obs_dir, name in todo]
+    stagereport.count('cands_files_parsed', len(paths))
+    serial = n_jobs == 1 or len(paths) < 2
+    pool = None if serial else ProcessPoolExecutor(max_workers=n_jobs)
+
+    def _assemble(obs_dir, parsed):
+        names, stamps, index, stale = plans[obs_dir]
+        nrows = _assemble_observation(obs_dir, names, stamps, index, parsed)
+        if verbose:
+            print(f"Parsed {len(stale)}/{len(names)} .cands files in {obs_dir} ({nrows} candidates)")
+
+    try:
+        if serial:
+            results = map(parse_cands, paths)
+        else:
+            nworkers = n_jobs or os.cpu_count() or 1
+            results = pool.map(parse_cands, paths, chunksize=max(1, len(paths) // (8 * nworkers)))
+
+        # results arrive in order, so each observation is written (and its
+        # parsed arrays released) as soon as its last stale file is parsed
+        remaining = {obs_dir: len(plan[3]) for obs_dir, plan in plans.items()}
+        parsed = {}
+        for (obs_dir, name), cands in zip(todo, results):
+            parsed.setdefault(obs_dir, {})[name] = cands
+            stagereport.count('candidates_parsed', len(cands))
+            remaining[obs_dir] -= 1
+            if remaining[obs_dir] == 0:
+                _assemble(obs_dir, parsed.pop(obs_dir))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    for obs_dir, (names, stamps, index, stale) in sorted(plans.items()):
+        if not stale and index is not None and index.get('rewrite'):
+            _assemble(obs_dir, {})
+    for input_dir in input_dirs:
+        _write_merged_index(input_dir, sorted(groups))
+    return sorted(groups)
+
+
+def load_store(obs_dir):
+    """Memory-map the candidate store of a single observation directory."""
+    return np.load(os.path.join(obs_dir, STORE_NAME), mmap_mode='r')
+
+
+def load_candidates(input_dirs, rebuild=False, verbose=True, n_jobs=None):
+    """Ingest (if needed) and return all candidates below ``input_dirs``.
+
+    A single observation is returned as a read-only memory map; several
+    observations are copied field by field into one pre-sized structured
+    array, so the peak memory is the size of the result.
+    """
+    obs_dirs = ingest(input_dirs, rebuild=rebuild, verbose=verbose, n_jobs=n_jobs)
+    stores = [load_store(d) for d in obs_dirs]
+    if len(stores) == 0:
+        return np.empty(0, dtype=cands_dtype())
+    if len(stores) == 1:
+        return stores[0]
+
+    dtype = _common_dtype(stores)
+    cands = np.empty(sum(len(s) for s in stores), dtype=dtype)
+    start = 0
+    for store in stores:
+        stop = start + len(store)
+        for field in dtype.names:
+            cands[field][start:stop] = store[field]
+        start = stop
+    return cands
+
+
+def main():
+    args = fetch_args()
+    input_dirs = args.input.split(' ') if ' ' in args.input else [args.input]
+
+    ingest(input_dirs, rebuild=args.rebuild, n_jobs=args.jobs)
+    for input_dir in input_dirs:
+        observations = read_merged_index(input_dir)['observations']
+        nrows = sum(entry['nrows'] for entry in observations.values())
+        print(f"Candidate store up to date in {input_dir}: {len(observations)} observation(s), {nrows} candidates")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import base64
+import html
+import io
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import timebin
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from crabgp import plotting
+
+SNR_LEVELS = (300, 200, 100, 50, 30, 10)
+
+
+def summarise(snr, dm, width, mjd, fluxes_jy=None, done_fraction=None):
+    """Aggregated statistics of the selected pulses for the report summary page.
+
+    Only histograms and counts are kept, so the summary stays small however
+    many pulses a night has.
+    """
+    snr = np.asarray(snr, dtype=float)
+    summary = {
+        'npulses': int(snr.size),
+        'done_fraction': done_fraction,
+        'snr_counts': {level: int((snr > level).sum()) for level in SNR_LEVELS},
+        'snr_mean': float(snr.mean()) if snr.size else np.nan,
+        'snr_std': float(snr.std()) if snr.size else np.nan,
+        'snr_hist': np.histogram(snr, bins=np.arange(0, (snr.max() if snr.size else 0) + 10, 10)),
+        'dm_hist': np.histogram(np.asarray(dm, dtype=float), bins=60) if snr.size else None,
+        'width_hist': np.histogram(np.asarray(width, dtype=float), bins=60) if snr.size else None,
+        'hourly': timebin.events_per_hour(mjd),
+    }
+    if fluxes_jy is not None and np.size(fluxes_jy):
+        summary['flux_median'] = float(np.median(fluxes_jy))
+        summary['flux_max'] = float(np.max(fluxes_jy))
+    return summary
+
+
+def summary_lines(summary):
+    """Text lines of the summary statistics (as printed by transientXanalysis)."""
+    lines = []
+    if summary['done_fraction'] is not None:
+        lines.append(f"{summary['done_fraction'] * 100:.2f}% Processing Done")
+    lines.append(f"Total Pulses: {summary['npulses']}")
+    lines += [f"S/N > {level}: {count}" for level, count in summary['snr_counts'].items()]
+    lines.append(f"Mean S/N: {summary['snr_mean']:.2f}, Std S/N: {summary['snr_std']:.2f}")
+    if 'flux_median' in summary:
+        lines.append(f"Median S_min: {summary['flux_median']:.2f} Jy, Max S_min: {summary['flux_max']:.2f} Jy")
+    return lines
+
+
+def summary_figure(summary, title='', dpi=150):
+    """Render the summary page (statistics and histograms) to PNG bytes.
+
+    The figure is drawn on its own Agg canvas, outside pyplot's figure
+    manager, so the caller's matplotlib backend is left as it is.
+    """
+    plotting.pyplot()
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(11, 8.5))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(2, 2)
+    ax = axes[0, 0]
+    ax.axis('off')
+    ax.text(0.0, 1.0, '\n'.join(([title, ''] if title else []) + summary_lines(summary)), va='top', family='monospace',
+            transform=ax.transAxes)
+
+    for ax, key, label in ((axes[0, 1], 'snr_hist', 'S/N'), (axes[1, 0], 'dm_hist', 'DM (pc cm$^{-3}$)')):
+        if summary[key] is not None:
+            counts, edges = summary[key]
+            ax.stairs(counts, edges, color='black')
+            ax.set_yscale('log')
+        ax.set_xlabel(label)
+        ax.set_ylabel('Number of Pulses')
+
+    hours, counts = summary['hourly']
+    axes[1, 1].scatter(hours, counts, color='black', s=8)
+    axes[1, 1].set_xlabel('UTC Time')
+    axes[1, 1].set_ylabel('Number of Pulses per Hour')
+    axes[1, 1].tick_params(axis='x', rotation=45)
+
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=dpi)
+    return buf.getvalue()
+
+
+def load_thumbnail(source, max_px=1600, quality=85):
+    """Decode an image (path or bytes) and downscale it to at most ``max_px`` a side.
+
+    Returns
+    -------
+    jpeg : bytes
+        The thumbnail, JPEG encoded.
+    size : tuple of int
+        Its (width, height) in pixels.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as im:
+        im.draft('RGB', (max_px, max_px))
+        im = im.convert('RGB')
+        im.thumbnail((max_px, max_px))
+        buf = io.BytesIO()
+        im.save(buf, format='JPEG', quality=quality)
+        return buf.getvalue(), im.size
+
+
+def iter_thumbnails(sources, n_threads=8, max_px=1600, quality=85):
+    """Yield ``(source, jpeg, size)`` in order, decoding in a thread pool.
+
+    At most ``2 * n_threads`` images are in flight, so memory stays bounded
+    however many images there are. Unreadable images yield ``jpeg=None``.
+    """
+    def load(source):
+        try:
+            return load_thumbnail(source, max_px, quality)
+        except (OSError, ValueError):
+            return None, None
+
+    window = max(1, 2 * n_threads)
+    with ThreadPoolExecutor(max_workers=max(1, n_threads)) as pool:
+        pending = deque()
+        for source in sources:
+            pending.append((source, pool.submit(load, source)))
+            if len(pending) >= window:
+                source_, future = pending.popleft()
+                yield (source_,) + future.result()
+        while pending:
+            source_, future = pending.popleft()
+            yield (source_,) + future.result()
+
+
+class StreamingPDF:
+    """Minimal PDF writer with one JPEG image per page, written as it goes.
+
+    Each page is flushed to disk when added; only the object offsets are
+    kept until the cross-reference table is written on ``close``.
+    """
+
+    def __init__(self, fname, dpi=150):
+        self.fname = fname
+        self.dpi = dpi
+        self.f = open(fname + '.tmp', 'wb')
+        self.offsets = [0, 0, 0]   # objects 1 (catalog) and 2 (pages) are written last
+        self.pages = []
+        self.f.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _object(self, body, stream=None):
+        self.offsets.append(self.f.tell())
+        num = len(self.offsets) - 1
+        self.f.write(f'{num} 0 obj\n'.encode() + body)
+        if stream is not None:
+            self.f.write(b'\nstream\n' + stream + b'\nendstream')
+        self.f.write(b'\nendobj\n')
+        return num
+
+    def add_jpeg(self, jpeg, size):
+        width, height = size
+        w_pt, h_pt = width * 72.0 / self.dpi, height * 72.0 / self.dpi
+        image = self._object(f'<< /Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace /DeviceRGB '
+                             f'/BitsPerComponent 8 /Filter /DCTDecode /Length {len(jpeg)} >>'.encode(), jpeg)
+        content = f'q {w_pt:.2f} 0 0 {h_pt:.2f} 0 0 cm /Im0 Do Q'.encode()
+        contents = self._object(f'<< /Length {len(content)} >>'.encode(), content)
+        self.pages.append(self._object(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {w_pt:.2f} {h_pt:.2f}] '
+                                       f'/Resources << /XObject << /Im0 {image} 0 R >> >> /Contents {contents} 0 R >>'.encode()))
+
+    def close(self):
+        for num, body in ((1, b'<< /Type /Catalog /Pages 2 0 R >>'),
+                          (2, f"<< /Type /Pages /Kids [{' '.join(f'{p} 0 R' for p in self.pages)}] "
+                              f"/Count {len(self.pages)} >>".encode())):
+            self.offsets[num] = self.f.tell()
+            self.f.write(f'{num} 0 obj\n'.encode() + body + b'\nendobj\n')
+        xref = self.f.tell()
+        self.f.write(f'xref\n0 {len(self.offsets)}\n0000000000 65535 f \n'.encode())
+        self.f.write(b''.join(f'{offset:010d} 00000 n \n'.encode() for offset in self.offsets[1:]))
+        self.f.write(f'trailer\n<< /Size {len(self.offsets)} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode())
+        self.f.close()
+        os.replace(self.fname + '.tmp', self.fname)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self.f.close()
+            os.remove(self.fname + '.tmp')
+
+
+class StreamingHTML:
+    """Single-file HTML report with embedded JPEG thumbnails, written as it goes."""
+
+    def __init__(self, fname, title=''):
+        self.fname = fname
+        self.f = open(fname + '.tmp', 'w')
+        self.f.write(f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+                     '<style>body{font-family:sans-serif} figure{display:inline-block;margin:8px} '
+                     'img{max-width:100%}</style></head><body>\n'
+                     f'<h1>{html.escape(title)}</h1>\n')
+
+    def add_jpeg(self, jpeg, size, caption='', link=None):
+        img = f'<img src="data:image/jpeg;base64,{base64.b64encode(jpeg).decode()}" width="{size[0]}" height="{size[1]}">'
+        if link:
+            img = f'<a href="{html.escape(link)}">{img}</a>'
+        self.f.write(f'<figure>{img}<figcaption>{html.escape(caption)}</figcaption></figure>\n')
+
+    def close(self):
+        self.f.write('</body></html>\n')
+        self.f.close()
+        os.replace(self.fname + '.tmp', self.fname)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self.f.close()
+            os.remove(self.fname + '.tmp')
+
+
+def build_report(fname, pngs, summary=None, captions=None, title='', n_threads=8, max_px=1600, dpi=150):
+    """Write a PDF or HTML (by extension) report: summary page, then the pulse plots.
+
+    The plots are decoded and downscaled in a thread pool and streamed into
+    the report in the given order (highest S/N first), so memory use is
+    bounded by the thread pool's window rather than the number of plots.
+
+    Returns
+    -------
+    n_written, n_missing : int
+        Pulse plots included and plots that could not be read.
+    """
+    captions = [''] * len(pngs) if captions is None else list(captions)
+    html_out = fname.lower().endswith(('.html', '.htm'))
+    writer = StreamingHTML(fname, title) if html_out else StreamingPDF(fname, dpi)
+
+    n_written = n_missing = 0
+    with writer:
+        if summary is not None:
+            jpeg, size = load_thumbnail(summary_figure(summary, title, dpi), max_px=max(max_px, 2000))
+            if html_out:
+                writer.add_jpeg(jpeg, size, 'Summary')
+            else:
+                writer.add_jpeg(jpeg, size)
+        for i, (png, jpeg, size) in enumerate(iter_thumbnails(pngs, n_threads, max_px)):
+            if jpeg is None:
+                n_missing += 1
+                continue
+            if html_out:
+                writer.add_jpeg(jpeg, size, captions[i], link=os.path.abspath(png))
+            else:
+                writer.add_jpeg(jpeg, size)
+            n_written += 1
+    return n_written, n_missing
@@ -0,0 +1,52 @@
+import numpy as np
+
+MJD_EPOCH = np.datetime64('1858-11-17T00:00:00', 's')
+SECONDS_PER_DAY = 86400
+
+
+def mjd_to_datetime64(mjd, unit='us'):
+    """Convert an array of MJDs (UTC) to ``datetime64`` without Python objects."""
+    mjd = np.asarray(mjd, dtype=float)
+    per_day = np.timedelta64(1, 'D') // np.timedelta64(1, unit)
+    return MJD_EPOCH.astype(f'datetime64[{unit}]') + np.round(mjd * per_day).astype(f'timedelta64[{unit}]')
+
+
+def bin_counts(mjd, interval=3600.0, fill=False):
+    """Count events in fixed UTC intervals.
+
+    Parameters
+    ----------
+    mjd : array_like
+        Event times, in MJD.
+    interval : float
+        Bin width, in s. Bins are aligned to the MJD epoch, so 3600 gives
+        whole UTC hours and 86400 whole UTC days.
+    fill : bool
+        Also return the empty bins between the first and last event.
+
+    Returns
+    -------
+    bin_start : array of datetime64[s]
+        Start of every returned bin.
+    counts : array of int
+        Number of events in each bin.
+    """
+    mjd = np.asarray(mjd, dtype=float)
+    if mjd.size == 0:
+        return np.empty(0, dtype='datetime64[s]'), np.empty(0, dtype=int)
+
+    idx = np.floor(mjd * (SECONDS_PER_DAY / interval)).astype(np.int64)
+    if fill:
+        first = idx.min()
+        counts = np.bincount(idx - first)
+        bins = first + np.arange(counts.size, dtype=np.int64)
+    else:
+        bins, counts = np.unique(idx, return_counts=True)
+
+    bin_start = MJD_EPOCH + np.round(bins * interval).astype('timedelta64[s]')
+    return bin_start, counts
+
+
+def events_per_hour(mjd, fill=False):
+    """Number of events per UTC hour; see ``bin_counts``."""
+    return bin_counts(mjd, 3600.0, fill=fill)
@@ -3,13 +3,19 @@ import argparse
 import glob as glob
 import os as os
 import numpy as np 
-import scipy.stats as stats
-import img2pdf
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
-import scienceplots 
 import subprocess
-plt.style.use(['science', 'no-latex'])
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calibration'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'profiling'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plots'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import radiometer
+import stagereport
+import candstore
+import candselect
+import report
+import timebin
+from crabgp import plotting
 
 def fetch_args(): 
     '''
@@ -20,17 +26,22 @@ def fetch_args():
     parser.add_argument('-t', '--threshold', type=float, help='Threshold for single pulse detection (default = 0)', required=False)
     parser.add_argument('-dm', '--dm', type=float, help='DM thresehold to plot (default = 0)', required=False)
     parser.add_argument('-pdf', '--pdf', help='Save as pdf (default = False)', required=False, action='store_true')
+    parser.add_argument('--html', help='Save the report as a single HTML page instead of a pdf (default = False)', required=False, action='store_true')
+    parser.add_argument('--thumb', type=int, help='Longest side of the pulse plots in the report, in pixels (default = 1600)', default=1600)
     parser.add_argument('-convert', '--convert', help='Use imagik convert function for pdf (default = False)', required=False, action='store_true')
     parser.add_argument('-n', '--nplots',type=int,help='Maximum number of highest-SNR pulse plots to save to PDF',required=False)
+    parser.add_argument('--sun-limit', type=float, help='Drop candidates within this many degrees of the Sun (default = keep all)', required=False)
+    parser.add_argument('--chunksize', type=int, help='Stream the candidate stores in chunks of this many rows (default = load everything)', required=False)
+    parser.add_argument('-j', '--jobs', type=int, help='Number of processes used to parse new .cands files (default = all cores)', required=False)
+    parser.add_argument('--no-plot', help='Skip the distribution plots and the report summary page; matplotlib is not imported (default = False)', required=False, action='store_true')
+    stagereport.add_arguments(parser)
     
     return parser.parse_args()
 
 def read_transientx(cands_file):
-    mjd, dm, width, snr, png, ifile = np.loadtxt(cands_file, usecols=(2, 3, 4, 5, 8, 10), unpack=True, dtype=str)
-    mjd = mjd.astype(float); dm = dm.astype(float); width = width.astype(float); snr = snr.astype(float)
-    time = mjd - mjd.min()
+    cands = candstore.parse_cands(cands_file)
     
-    return time, dm, width, snr, png, ifile, mjd 
+    return cands['time'], cands['dm'], cands['width'], cands['snr'], cands['png'], cands['ifile'], cands['mjd'] 
 
 def marker_scaling(sig, threshold=10.0):
     """
@@ -43,10 +54,39 @@ def marker_scaling(sig, threshold=10.0):
     
     return marker_sizes
 
-def main(): 
+def plot_distributions(snr, mjd):
+    """
+    Saves the S/N histogram and the pulses per UTC hour.
+    """
+    plt = plotting.pyplot()
+
+    # --- Plot Histogram of S/N --- Bins of 10 up to max S/N
+    plt.figure(figsize=(6, 4))
+    bins = np.arange(0, snr.max() + 10, 10)
+    plt.hist(snr, bins=bins, color='black', histtype='step')
+    plt.xlabel('S/N')
+    plt.ylabel('Number of Pulses')
+    plt.xlim(0, snr.max() + 10)
+    plt.yscale('log')
+    plt.savefig('Crab_GP_SNR_dist.png', dpi=300, bbox_inches='tight')
     
-    args = fetch_args()
+    # -- Events per hour vs MJD ---
+    # Count events per UTC hour directly from the MJD array
+    unique_hours, counts = timebin.events_per_hour(mjd)
+
+    # --- Plot ---
+    plt.figure(figsize=(6, 4))
+    plt.scatter(unique_hours, counts, color='black')
+    plt.xlabel('UTC Time')
+    plt.ylabel('Number of Pulses per Hour')
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    plt.savefig('Crab_GP_events_per_hour_UTC.png', dpi=300)
+
+def analyse(args):
     
+    if args.no_plot:
+        plotting.disable()
     if args.threshold is None:
         args.threshold = 0.0
     if args.dm is None:
@@ -58,9 +98,9 @@ def main():
     else:
         input_dirs = [args.input]
    
-    cands_files = []
-    for d in input_dirs:
-        cands_files.extend(glob.glob(f"{d}/**/*.cands", recursive=True))
+    stagereport.lap('discover')
+    # TransientX .cands files and native .cands.npy tables (gpsearch), as ingested below
+    cands_files = [f for files in candstore.group_cands_files(input_dirs).values() for f in files]
     
     if len(cands_files) == 0:
         print('No candidates files found in {}'.format(args.input))
@@ -75,128 +115,114 @@ def main():
     
     print('Number of candidates files:', len(cands_files))
     print('Number of filterbank files:', len(filterbank_files))
+    stagereport.count('cands_files', len(cands_files))
     
     base_path = '/'.join(args.input.split('/')[0:-2])
     
-    # Cat all the candidates
-    time = []; dm = []; width = []; snr = []; png = []; ifile = []; mjd = []
-    
-    for cands_file in cands_files:
-        time_, dm_, width_, snr_, png_, ifile_, mjd_ = read_transientx(cands_file)
-        
-        time.extend(time_)
-        dm.extend(dm_)
-        width.extend(width_)
-        snr.extend(snr_)
-        png.extend(png_)
-        ifile.extend(ifile_)
-        mjd.extend(mjd_)
+    stagereport.lap('load')
+    if args.chunksize:
+        # Out-of-core mode: filter and de-duplicate store chunks, strings stay integer coded
+        obs_dirs = candstore.ingest(input_dirs, n_jobs=args.jobs)
+        kept, ifile_codes = candselect.select_candidates(
+            obs_dirs, threshold=args.threshold, dm_min=args.dm, chunksize=args.chunksize, sun_limit=args.sun_limit)
+
+        if kept.size == 0:
+            print(f'⚠️ No single pulses found in {args.input} for current setup')
+            return
+
+        print("Number of unique times (kept highest S/N):", kept.size)
+        stagereport.count('candidates_kept', kept.size)
+
+        snr, time, width, dm, mjd = [kept[c] for c in ('snr', 'time', 'width', 'dm', 'mjd')]
+        report_out = args.pdf or args.html
+        # the report needs nplots rows with a plot (native candidates have none)
+        nstrings = None if (report_out and args.nplots is None) else 5
+        png, ifile = candselect.resolve_strings(kept, obs_dirs, ifile_codes, n=nstrings,
+                                                n_png=args.nplots if report_out else None)
+
+    else:
+        # Load all the candidates from the columnar store (only new/changed .cands are parsed)
+        cands = candstore.load_candidates(input_dirs, n_jobs=args.jobs)
     
-    print(f"Read in {len(time)} candidates from {cands_file}")
-
-   # --- Convert to numpy arrays ---
-    snr   = np.asarray(snr)
-    dm    = np.asarray(dm)
-    time  = np.asarray(time)
-    width = np.asarray(width)
-    png   = np.asarray(png)
-    ifile = np.asarray(ifile)
-    mjd   = np.asarray(mjd)
-
-    # --- Build combined mask ---
-    mask = np.ones_like(snr, dtype=bool)
-
-    # S/N threshold
-    if args.threshold is not None:
-        mask &= snr > args.threshold
-
-    # DM cut
-    if args.dm is not None:
-        mask &= dm > args.dm
-
-    # Remove any entries containing '_replot'
-    mask &= np.char.find(png.astype(str), '_replot') < 0
-
-    # --- Apply mask once ---
-    snr, time, width, dm, png, ifile, mjd = [
-        arr[mask] for arr in (snr, time, width, dm, png, ifile, mjd)
-    ]
-
-    if snr.size == 0:
-        print(f'⚠️ No single pulses found in {cands_file} for current setup')
-        return
-
-    # --- Sort by time then S/N ---
-    order = np.lexsort((snr, time))
-    snr_s, time_s, width_s, dm_s, png_s, ifile_s, mjd_s = [
-        arr[order] for arr in (snr, time, width, dm, png, ifile, mjd)
-    ]
-
-    # --- Keep highest S/N per unique time ---
-    keep = np.r_[time_s[1:] != time_s[:-1], True]
-
-    snr, time, width, dm, png, ifile, mjd = [
-        arr[keep] for arr in (snr_s, time_s, width_s, dm_s, png_s, ifile_s, mjd_s)
-    ]
-
-    print("Number of unique times (kept highest S/N):", time.size)
-
-    # --- Order by descending S/N for plotting ---
-    order = np.argsort(snr)[::-1]
-    snr, time, width, dm, png, ifile, mjd = [
-        arr[order] for arr in (snr, time, width, dm, png, ifile, mjd)
-    ]
+        print(f"Read in {len(cands)} candidates from {len(cands_files)} candidates files")
+        stagereport.count('candidates_read', len(cands))
+
+        stagereport.lap('dedup')
+        # --- Convert to numpy arrays ---
+        snr   = np.asarray(cands['snr'])
+        dm    = np.asarray(cands['dm'])
+        time  = np.asarray(cands['time'])
+        width = np.asarray(cands['width'])
+        png   = np.asarray(cands['png'])
+        ifile = np.asarray(cands['ifile'])
+        mjd   = np.asarray(cands['mjd'])
+
+        # --- Build combined mask ---
+        mask = np.ones_like(snr, dtype=bool)
+
+        # S/N threshold
+        if args.threshold is not None:
+            mask &= snr > args.threshold
+
+        # DM cut
+        if args.dm is not None:
+            mask &= dm > args.dm
+
+        # Remove any entries containing '_replot'
+        mask &= np.char.find(png.astype(str), '_replot') < 0
+
+        # Solar separation cut
+        if args.sun_limit is not None:
+            import solarsep
+            mask[mask] = ~solarsep.near_sun(mjd[mask], args.sun_limit)
+
+        # --- Apply mask once ---
+        snr, time, width, dm, png, ifile, mjd = [
+            arr[mask] for arr in (snr, time, width, dm, png, ifile, mjd)
+        ]
+
+        if snr.size == 0:
+            print(f'⚠️ No single pulses found in {args.input} for current setup')
+            return
+
+        # --- Sort by time then S/N ---
+        order = np.lexsort((snr, time))
+        snr_s, time_s, width_s, dm_s, png_s, ifile_s, mjd_s = [
+            arr[order] for arr in (snr, time, width, dm, png, ifile, mjd)
+        ]
+
+        # --- Keep highest S/N per unique time ---
+        keep = np.r_[time_s[1:] != time_s[:-1], True]
+
+        snr, time, width, dm, png, ifile, mjd = [
+            arr[keep] for arr in (snr_s, time_s, width_s, dm_s, png_s, ifile_s, mjd_s)
+        ]
+
+        print("Number of unique times (kept highest S/N):", time.size)
+        stagereport.count('candidates_kept', time.size)
+
+        # --- Order by descending S/N for plotting ---
+        order = np.argsort(snr)[::-1]
+        snr, time, width, dm, png, ifile, mjd = [
+            arr[order] for arr in (snr, time, width, dm, png, ifile, mjd)
+        ]
     
     print("--- Top 5 candidates ---")
     for t, d, w, s, p, i, m in zip(time[:5], dm[:5], width[:5], snr[:5], png[:5], ifile[:5], mjd[:5]):
         print(f"Time: {t:.2f} s, DM: {d:.2f} pc cm^-3, Width: {w:.2f} ms, S/N: {s:.2f}, png: {p}, ifile: {i}, MJD: {m}")
-        
-    print(f"\nSummary statistics: {len(cands_files)/len(filterbank_files)*100:.2f}% Processing Done | Total Pulses: {len(snr)}")
-    print(f"S/N > 300: {(snr > 300).sum()}")
-    print(f"S/N > 200: {(snr > 200).sum()}")
-    print(f"S/N > 100: {(snr > 100).sum()}")
-    print(f"S/N > 50: {(snr > 50).sum()}")
-    print(f"S/N > 30: {(snr > 30).sum()}")
-    print(f"S/N > 10: {(snr > 10).sum()}")
-    print(f"Mean S/N: {snr.mean():.2f}, Std S/N: {snr.std():.2f}")
     
-    filename = ifile[0].split('.')[0]
+    stagereport.lap('flux')
+    fluxes_jy = radiometer.flux_from_snr(width*1e-3, snr, band='HBA', nchan=3296, fmin=100.0, fmax=190.0, chan_bw=0.2) * 1e-3
+    summary = report.summarise(snr, dm, width, mjd, fluxes_jy, done_fraction=len(cands_files)/len(filterbank_files) if filterbank_files else None)
+    print("\nSummary statistics: " + ' | '.join(report.summary_lines(summary)[:2]))
+    for line in report.summary_lines(summary)[2:]:
+        print(line)
     
-    # --- Plot Histogram of S/N --- Bins of 10 up to max S/N
-    plt.figure(figsize=(6, 4))
-    bins = np.arange(0, snr.max() + 10, 10)
-    plt.hist(snr, bins=bins, color='black', histtype='step')
-    plt.xlabel('S/N')
-    plt.ylabel('Number of Pulses')
-    plt.xlim(0, snr.max() + 10)
-    plt.yscale('log')
-    plt.savefig('Crab_GP_SNR_dist.png', dpi=300, bbox_inches='tight')
+    filename = ifile[0].split('.')[0]
     
-    # -- Events per hour vs MJD ---
-    from datetime import datetime, timedelta
-
-    # --- Convert MJD to UTC datetime ---
-    def mjd_to_datetime(mjd):
-        mjd_epoch = datetime(1858, 11, 17)  # MJD reference
-        return np.array([mjd_epoch + timedelta(days=float(d)) for d in mjd])
-
-    utc_times = mjd_to_datetime(mjd)
-
-    # --- Bin by hour ---
-    # Round down to the hour
-    utc_hours = np.array([t.replace(minute=0, second=0, microsecond=0) for t in utc_times])
-
-    # Count events per hour
-    unique_hours, counts = np.unique(utc_hours, return_counts=True)
-
-    # --- Plot ---
-    plt.figure(figsize=(6, 4))
-    plt.scatter(unique_hours, counts, color='black')
-    plt.xlabel('UTC Time')
-    plt.ylabel('Number of Pulses per Hour')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.savefig('Crab_GP_events_per_hour_UTC.png', dpi=300)
+    if plotting.enabled():
+        stagereport.lap('plots')
+        plot_distributions(snr, mjd)
 
 
     # # Top row (3 plots)
@@ -254,29 +280,31 @@ def main():
     # plt.savefig(output_file)
     # print(f"Saved summary plot to {output_file}")
 
-    # Save pngs to a single pdf
-    if args.pdf:
-        os.chdir(base_path)
-        
-        snr_sort = np.argsort(snr)[::-1]
-        png_sorted = png[snr_sort]
-        png_sorted = [os.path.normpath(str(p)) for p in png_sorted]
-
-        # Limit number of plots if requested
-        if args.nplots is not None:
-            png_sorted = png_sorted[:args.nplots]
+    # Stream the summary page and the highest-S/N pulse plots into one report
+    if args.pdf or args.html:
+        stagereport.lap('report')
+        # native (gpsearch) candidates have no plot: leave them out of the report
+        with_png = np.flatnonzero([bool(str(p)) for p in png])[:args.nplots]
+        # png paths are relative to the directory above the observations
+        png_sorted = [os.path.normpath(os.path.join(base_path, str(png[i]))) for i in with_png]
+        captions = [f"S/N {snr[i]:.1f}, DM {dm[i]:.2f}, width {width[i]:.2f} ms, MJD {mjd[i]:.8f}" for i in with_png]
 
-        # Put your summary plot first
-        png_sorted.insert(0, output_file)
+        ext = 'html' if args.html else 'pdf'
+        report_name = os.path.join(args.input, f'{filename}_transx_t{args.threshold}_DM{args.dm}.{ext}')
+        # the summary page is drawn with matplotlib
+        n_written, n_missing = report.build_report(report_name, png_sorted, summary if plotting.enabled() else None, captions, title=filename,
+                                                   n_threads=args.jobs or os.cpu_count(), max_px=args.thumb)
 
-        pdf_name = os.path.join(args.input, f'{filename}_transx_t{args.threshold}_DM{args.dm}.pdf')
+        print(f"Saved {report_name}")
+        print(f"Included {n_written} pulse plots (highest S/N first)" + (f", {n_missing} missing" if n_missing else ''))
+        stagereport.count('report_plots', n_written)
+        stagereport.count('report_plots_missing', n_missing)
 
-        # Write PDF
-        with open(pdf_name, "wb") as f:
-            f.write(img2pdf.convert(png_sorted))
 
-        print(f"Saved {pdf_name}")
-        print(f"Included {len(png_sorted) - 1} pulse plots (highest S/N first)")
+def main():
+    args = fetch_args()
+    with stagereport.from_args(args, 'transientXanalysis'):
+        analyse(args)
 
 
 if __name__ == "__main__":
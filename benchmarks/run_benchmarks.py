@@ -0,0 +1,367 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for subdir in ('TransientX', 'transientX', 'DM_calc', 'calibration', 'modelling', 'plots', 'folding'):
+    sys.path.insert(0, os.path.join(REPO_DIR, subdir))
+import synthetic
+
+RESULTS_VERSION = 1
+
+# name -> setup(workdir, scale, rng) returning (run, nitems) or (run, nitems, check);
+# ``check()`` returns quality metrics, with ``failures`` counted as regressions.
+# Filled by @benchmark
+BENCHMARKS = {}
+
+
+def fetch_args():
+    '''
+    Fetches the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description='Time the pipeline hot paths on synthetic Crab data.')
+    parser.add_argument('-o', '--output', type=str, help='Results JSON (default = bench_results.json)', default='bench_results.json')
+    parser.add_argument('-s', '--scale', type=float, help='Multiply every input size by this factor (default = 1)', default=1.0)
+    parser.add_argument('-r', '--repeat', type=int, help='Timed runs per benchmark, the best is reported (default = 3)', default=3)
+    parser.add_argument('-b', '--bench', type=str, nargs='+', help=f"Benchmarks to run (default = all: {', '.join(BENCHMARKS)})", required=False)
+    parser.add_argument('--compare', type=str, help='Baseline results JSON; exit non-zero on regressions', required=False)
+    parser.add_argument('--tolerance', type=float, help='Allowed slowdown against the baseline (default = 1.25)', default=1.25)
+    parser.add_argument('--workdir', type=str, help='Keep the synthetic inputs in this directory (default = temporary)', required=False)
+    parser.add_argument('--seed', type=int, help='Random seed of the synthetic data (default = 0)', default=0)
+
+    return parser.parse_args()
+
+
+def benchmark(name):
+    """Register a benchmark setup function under ``name``."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def scaled(n, scale, minimum=1):
+    return max(minimum, int(round(n * scale)))
+
+
+@benchmark('parse_cands')
+def bench_parse_cands(workdir, scale, rng):
+    """``read_transientx`` core: text .cands file to a structured array."""
+    import candstore
+
+    fname = synthetic.write_cands(os.path.join(workdir, 'parse_fbf00000.cands'), scaled(200_000, scale), rng)
+    return lambda: candstore.parse_cands(fname), scaled(200_000, scale)
+
+
+@benchmark('dedup')
+def bench_dedup(workdir, scale, rng):
+    """Ingest of an observation's .cands files into the store, then max-S/N-per-time selection."""
+    import candselect
+    import candstore
+
+    ncands = scaled(500_000, scale)
+    obs_dir = os.path.join(workdir, 'dedup_obs')
+    synthetic.write_observation(obs_dir, ncands, 16, rng)
+
+    def run():
+        obs_dirs = candstore.ingest([obs_dir], rebuild=True, verbose=False, n_jobs=1)
+        return candselect.select_candidates(obs_dirs, threshold=8.0, dm_min=50.0, chunksize=100_000, verbose=False)
+    return run, ncands
+
+
+@benchmark('burst_smin')
+def bench_burst_smin(workdir, scale, rng):
+    """Radiometer S_min of a catalogue of bursts with a per-burst channel mask."""
+    import radiometer
+
+    nburst = scaled(1_000_000, scale)
+    _, _, width, snr = synthetic.pulse_params(nburst, rng)
+    radiometer.channel_grid('HBA')
+    mask = rng.random(radiometer.channel_grid('HBA')['freq'].size) > 0.1
+
+    def run():
+        radiometer.flux_from_snr(width * 1e-3, snr, 'HBA')
+        return radiometer.flux_from_snr(width * 1e-3, snr, 'HBA', rfi_mask=mask)
+    return run, nburst
+
+
+@benchmark('scattering_fit')
+def bench_scattering_fit(workdir, scale, rng):
+    """Thick and modified thin-screen fits of the sub-band profiles of scattered pulses."""
+    import arcache
+    import modelScattering
+
+    npulse = scaled(8, scale)
+    tasks = []
+    for _ in range(npulse):
+        data, f_channels, meta = synthetic.scattered_waterfall(rng, nchan=128, nbin=1024, snr=200.0)
+        data = arcache.dedisperse(data, f_channels, meta['dm'], meta['t_res'], meta['f_ref'])
+        profiles, _ = modelScattering.split_subbands(data, f_channels, n_subbands=8)
+        t = np.arange(meta['nbin']) * meta['t_res']
+        tasks.extend((t, profile) for profile in profiles)
+
+    def run():
+        for t, profile in tasks:
+            modelScattering.fit_subband_thick_fast(t, profile)
+            modelScattering.fit_subband_mod_thin_fast(t, profile)
+    return run, len(tasks)
+
+
+@benchmark('scattering_backends')
+def bench_scattering_backends(workdir, scale, rng):
+    """Warm-started sub-band fits with the fast backend, checked against lmfit.
+
+    The check fits every sub-band with both backends (cold and warm) and
+    counts the fits where the fast backend ends more than 2 in AIC above
+    lmfit (failures, also when its best model per sub-band is worse), the
+    sub-bands whose best model differs, and the median relative tau
+    difference of the best fits that agree on the model.
+    """
+    import lmfit  # noqa: F401 (the reference backend; skipped without it)
+    import arcache
+    import modelScattering
+
+    npulse = scaled(4, scale)
+    archives = []
+    for _ in range(npulse):
+        data, f_channels, meta = synthetic.scattered_waterfall(rng, nchan=128, nbin=1024, snr=200.0)
+        data = arcache.dedisperse(data, f_channels, meta['dm'], meta['t_res'], meta['f_ref'])
+        profiles, f_centres = modelScattering.split_subbands(data, f_channels, n_subbands=8)
+        archives.append((f'pulse{len(archives)}', profiles, f_centres, meta['t_res']))
+    models = ['thick', 'mod_thin']
+
+    def fit(backend):
+        return [modelScattering.choose_models(modelScattering._fit_archive_task(archive + (models, backend, {})))
+                for archive in archives]
+
+    def check():
+        worse = cold_worse = best_worse = differ = 0
+        tau_diff = []
+        for (_, profiles, _, t_res), rows_ref, rows_fast in zip(archives, fit('lmfit'), fit('fast')):
+            worse += sum(fast['aic'] > ref['aic'] + 2 for ref, fast in zip(rows_ref, rows_fast))
+            best_ref = {row['subband']: row for row in rows_ref if row['best']}
+            best_fast = {row['subband']: row for row in rows_fast if row['best']}
+            differ += sum(best_ref[i]['model'] != best_fast[i]['model'] for i in best_ref)
+            best_worse += sum(best_fast[i]['aic'] > best_ref[i]['aic'] + 2 for i in best_ref)
+            tau_diff += [abs(best_fast[i]['tau'] / best_ref[i]['tau'] - 1) for i in best_ref
+                         if best_ref[i]['model'] == best_fast[i]['model'] and best_ref[i]['tau'] > 0]
+            t = np.arange(len(profiles[0])) * t_res
+            for profile in profiles:
+                for model in models:
+                    ref, _, _ = modelScattering.FIT_FUNCS['lmfit'][model](t, profile)
+                    fast, _, _ = modelScattering.FIT_FUNCS['fast'][model](t, profile)
+                    cold_worse += fast.aic > ref.aic + 2
+        return {'fits': 2 * len(archives) * len(models) * len(archives[0][1]), 'warm_worse_aic': int(worse),
+                'cold_worse_aic': int(cold_worse), 'best_worse_aic': int(best_worse), 'best_model_differs': int(differ),
+                'median_tau_rel_diff': float(np.median(tau_diff)) if tau_diff else None,
+                'failures': int(worse + cold_worse + best_worse)}
+    return lambda: fit('fast'), sum(len(p) for _, p, _, _ in archives), check
+
+
+@benchmark('dm_search')
+def bench_dm_search(workdir, scale, rng):
+    """Coarse-to-fine phase-coherence DM search of a batch of pulses."""
+    import dmsearch
+
+    npulse = scaled(16, scale)
+    waterfalls = [synthetic.scattered_waterfall(rng, nchan=256, nbin=1024, tau_ref=3e-4, snr=60.0) for _ in range(npulse)]
+    f_channels, meta = waterfalls[0][1], waterfalls[0][2]
+
+    def run():
+        phasors = np.stack([dmsearch.unit_phasors(data) for data, _, _ in waterfalls])
+        return dmsearch.search_pulses(phasors, f_channels, meta['t_res'], meta['f_ref'])
+    return run, npulse
+
+
+@benchmark('sun_separation')
+def bench_sun_separation(workdir, scale, rng):
+    """Crab-Sun separation of every candidate MJD from the cached daily grid."""
+    import solarsep
+
+    n = scaled(2_000_000, scale)
+    grid = synthetic.write_sun_grid(os.path.join(workdir, 'sun_grid.npz'))
+    mjd = rng.uniform(58000.0, 62000.0, n)
+    solarsep.sun_grid(grid)
+    return lambda: solarsep.sun_separation(mjd, fname=grid), n
+
+
+@benchmark('jb_ephemeris')
+def bench_jb_ephemeris(workdir, scale, rng):
+    """JB table load, epoch lookup and F0 extrapolation for many observations."""
+    import jbephem
+
+    n = scaled(1_000_000, scale)
+    fname = synthetic.write_jb_csv(os.path.join(workdir, 'jb_ephemeris.csv'), scaled(2000, scale), rng)
+    mjd = rng.uniform(56000.0, 60000.0, n)
+
+    def run():
+        jbephem.load_table.cache_clear()
+        return jbephem.spin_frequency(mjd, fname)
+    return run, n
+
+
+@benchmark('requantize')
+def bench_requantize(workdir, scale, rng):
+    """32-bit to 8-bit filterbank requantisation."""
+    import filterbank
+
+    nsamples = scaled(131_072, scale, 1024)
+    fil = synthetic.write_filterbank(os.path.join(workdir, 'requant_32bit.fil'), nsamples, rng, nbits=32)
+    out = os.path.join(workdir, 'requant_8bit.fil')
+    return lambda: filterbank.requantize(fil, out, nbits=8), nsamples
+
+
+@benchmark('gp_search')
+def bench_gp_search(workdir, scale, rng):
+    """Sub-band dedispersion and boxcar single-pulse search of an 8-bit filterbank."""
+    import gpsearch
+
+    nsamples = scaled(131_072, scale, 16384)
+    duration = nsamples * synthetic.TSAMP
+    pulses = [(t, synthetic.CRAB_DM, 3.0, 0.002) for t in rng.uniform(1.0, max(1.5, duration - 2.0), 10)]
+    fil = synthetic.write_filterbank(os.path.join(workdir, 'gp_8bit.fil'), nsamples, rng, pulses=pulses)
+    return lambda: gpsearch.search_filterbank(fil, dms=[synthetic.CRAB_DM - 0.1, synthetic.CRAB_DM,
+                                                        synthetic.CRAB_DM + 0.1]), nsamples
+
+
+@benchmark('rfi_mask')
+def bench_rfi_mask(workdir, scale, rng):
+    """Block statistics and flagging of an 8-bit filterbank."""
+    import rfimask
+
+    nsamples = scaled(131_072, scale, 16384)
+    fil = synthetic.write_filterbank(os.path.join(workdir, 'rfi_8bit.fil'), nsamples, rng)
+    return lambda: rfimask.compute_mask(fil, n_threads=8, **rfimask.DEFAULTS), nsamples
+
+
+@benchmark('fold')
+def bench_fold(workdir, scale, rng):
+    """Multi-band fold of an 8-bit filterbank with the JB ephemeris."""
+    import fold
+
+    nsamples = scaled(131_072, scale, 16384)
+    fil = synthetic.write_filterbank(os.path.join(workdir, 'fold_8bit.fil'), nsamples, rng, tstart=60000.0)
+    return lambda: fold.fold_filterbank(fil, nbin=256, nsubint=16, nsub=64, topo=True), nsamples
+
+
+def time_benchmark(name, workdir, scale, repeat, seed):
+    """Set up benchmark ``name`` and time it ``repeat`` times.
+
+    Returns a result record; benchmarks whose modules (or their optional
+    dependencies) cannot be imported are recorded as skipped.
+    """
+    rng = np.random.default_rng(seed)
+    bench_dir = os.path.join(workdir, name)
+    os.makedirs(bench_dir, exist_ok=True)
+    try:
+        run, nitems, *check = BENCHMARKS[name](bench_dir, scale, rng)
+    except ImportError as e:
+        return {'name': name, 'skipped': f'{type(e).__name__}: {e}'}
+
+    times = []
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - t0)
+    best = min(times)
+    result = {'name': name, 'nitems': nitems, 'times': times, 'best': best, 'median': float(np.median(times)),
+              'per_item_us': best / nitems * 1e6, 'doc': (BENCHMARKS[name].__doc__ or '').strip()}
+    if check:
+        result['quality'] = check[0]()
+    return result
+
+
+def compare(results, baseline, tolerance=1.25):
+    """Benchmarks slower than ``tolerance`` times the baseline, per item.
+
+    Benchmarks whose quality check reports failures are regressions
+    whatever the baseline (with ratio None).
+
+    Returns
+    -------
+    regressions : list of (name, ratio)
+    """
+    base = {r['name']: r for r in baseline['results'] if 'per_item_us' in r}
+    regressions = []
+    for r in results:
+        if r.get('quality', {}).get('failures'):
+            regressions.append((r['name'], None))
+        if 'per_item_us' in r and r['name'] in base:
+            r['ratio'] = r['per_item_us'] / base[r['name']]['per_item_us']
+            if r['ratio'] > tolerance:
+                regressions.append((r['name'], r['ratio']))
+    return regressions
+
+
+def write_results(results, fname, scale, repeat, seed):
+    record = {
+        'version': RESULTS_VERSION,
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'scale': scale,
+        'repeat': repeat,
+        'seed': seed,
+        'results': results,
+    }
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(record, f, indent=2)
+    os.replace(fname + '.tmp', fname)
+
+
+def main():
+    args = fetch_args()
+    names = args.bench or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmark(s): {', '.join(unknown)} (available: {', '.join(BENCHMARKS)})")
+        raise SystemExit(2)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='crab_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+    try:
+        for name in names:
+            result = time_benchmark(name, workdir, args.scale, args.repeat, args.seed)
+            results.append(result)
+            if 'skipped' in result:
+                print(f"{name:<16} skipped ({result['skipped']})")
+            else:
+                print(f"{name:<16} {result['best']:9.4f} s  {result['nitems']:>9d} items  {result['per_item_us']:10.3f} us/item")
+                if 'quality' in result:
+                    print(f"{'':<16} " + ', '.join(f"{key} {value:.3g}" if isinstance(value, float) else f"{key} {value}"
+                                                   for key, value in result['quality'].items()))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = {'results': []}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    write_results(results, args.output, args.scale, args.repeat, args.seed)
+    print(f"Results written to {args.output}")
+
+    for name, ratio in regressions:
+        if ratio is None:
+            print(f"REGRESSION {name}: fit quality check failed ({results[names.index(name)]['quality']})")
+        else:
+            print(f"REGRESSION {name}: {ratio:.2f}x slower than {args.compare}")
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import csv
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'transientX'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'DM_calc'))
+import arcache
+import filterbank
+
+# LOFAR HBA-like defaults (top of the band first, as in the REALTA filterbanks)
+FCH1 = 190.0
+BANDWIDTH = 80.0
+TSAMP = 0.000655
+CRAB_DM = 56.75
+CRAB_F0 = 29.6
+
+JB_COLUMNS = ['Date', 'MJD', 't_JPL_sec', 't_acc_usec', 'nu_Hz', 'sigma_nu', 'nudot_1e-15_s-2', 'sigma_nudot',
+              'DM_pc_cm-3', 'DMDot_pc_cm-3_yr-1', 'tau_408_usec']
+
+
+def pulse_params(n, rng, mjd0=60000.0, duration=3600.0, dup_frac=0.3):
+    """Random giant-pulse candidates: a power-law S/N above 7 and log-normal widths.
+
+    A fraction ``dup_frac`` of the pulses is reported again at the same MJD
+    with a lower S/N, as TransientX does for neighbouring DM/width trials.
+
+    Returns
+    -------
+    mjd, dm, width, snr : arrays (width in ms)
+    """
+    nuniq = max(1, int(round(n / (1 + dup_frac))))
+    mjd = mjd0 + np.sort(rng.uniform(0, duration, nuniq)) / 86400.0
+    dup = rng.choice(nuniq, n - nuniq, replace=True) if n > nuniq else np.empty(0, dtype=int)
+    mjd = np.concatenate([mjd, mjd[dup]])
+    dm = rng.normal(CRAB_DM, 0.2, n)
+    width = rng.lognormal(np.log(5.0), 0.6, n)
+    snr = 7.0 + 5.0 * rng.pareto(2.5, n)
+    order = np.argsort(mjd, kind='stable')
+    return mjd[order], dm[order], width[order], snr[order]
+
+
+def write_cands(fname, n, rng, mjd0=60000.0, duration=3600.0, fil='/data/synthetic/Crab_P000_8bit.fil'):
+    """Write ``n`` candidates in the TransientX .cands column layout.
+
+    Columns: id, beam, MJD, DM, width (ms), S/N, max S/N, boxcar, png,
+    ncand and the filterbank, as read by ``candstore.parse_cands`` and the
+    awk filters of genArchives.sh.
+    """
+    mjd, dm, width, snr = pulse_params(n, rng, mjd0, duration)
+    stem = os.path.splitext(os.path.basename(fname))[0]
+    with open(fname, 'w') as f:
+        for i in range(n):
+            png = f"{stem}_{mjd[i]:.10f}_{dm[i]:.2f}_{snr[i]:.2f}.png"
+            f.write(f"{i + 1} 0 {mjd[i]:.12f} {dm[i]:.4f} {width[i]:.4f} {snr[i]:.4f} {snr[i]:.4f} 1 {png} 1 {fil}\n")
+    return fname
+
+
+def write_observation(obs_dir, ncands, nfiles, rng, mjd0=60000.0):
+    """An observation directory with ``nfiles`` .cands files under transientx_output/."""
+    out = os.path.join(obs_dir, 'transientx_output')
+    os.makedirs(out, exist_ok=True)
+    per_file = max(1, ncands // nfiles)
+    return [write_cands(os.path.join(out, f'Crab_{mjd0 + i / 24:.6f}_fbf{i:05d}.cands'), per_file, rng,
+                        mjd0 + i / 24, 3600.0, os.path.join(obs_dir, f'Crab_{i}_P000_8bit.fil'))
+            for i in range(nfiles)]
+
+
+def scattered_profile(t, t0, tau, width, amp=1.0):
+    """Gaussian pulse convolved with a one-sided exponential scattering tail (periodic in ``t``)."""
+    nbin = t.size
+    t_res = t[1] - t[0]
+    k = np.fft.rfftfreq(nbin, t_res)
+    spec = np.exp(-2j * np.pi * k * t0 - 0.5 * (2 * np.pi * k * width)**2) / (1 + 2j * np.pi * k * tau)
+    profile = np.fft.irfft(spec, n=nbin)
+    return amp * profile / profile.max()
+
+
+def scattered_waterfall(rng, nchan=256, nbin=1024, t_res=None, dm=CRAB_DM, tau_ref=2e-3, f_ref=150.0, alpha=4.0,
+                        width=3e-4, snr=50.0, f_lo=FCH1 - BANDWIDTH, f_hi=FCH1):
+    """Un-dedispersed single-pulse waterfall with known DM and scattering time.
+
+    The scattering time scales as ``tau_ref * (f / f_ref)**-alpha``; the
+    pulse is dispersed relative to the band centre, like the archives read
+    by ``arcache``.
+
+    Returns
+    -------
+    data : array, shape (nchan, nbin)
+    f_channels : array
+        Ascending channel frequencies, in MHz.
+    meta : dict
+        ``t_res``, ``f_ref`` (dedispersion reference), ``nbin``, ``nchan``,
+        ``dm``, ``tau_ref``, ``alpha`` and ``t0``.
+    """
+    t_res = t_res if t_res is not None else 1.0 / CRAB_F0 / nbin
+    f_channels = np.linspace(f_lo, f_hi, nchan, endpoint=False) + (f_hi - f_lo) / nchan / 2
+    t = np.arange(nbin) * t_res
+    t0 = 0.3 * nbin * t_res
+    tau = tau_ref * (f_channels / f_ref)**-alpha
+    chan_snr = snr / np.sqrt(nchan)
+    data = np.array([scattered_profile(t, t0, tau_c, width, chan_snr) for tau_c in tau])
+    centre = (f_lo + f_hi) / 2
+    data = arcache.dedisperse(data, f_channels, -dm, t_res, centre)
+    data += rng.normal(0.0, 1.0, data.shape)
+    meta = {'t_res': t_res, 'f_ref': centre, 'nbin': nbin, 'nchan': nchan, 'dm': dm, 'tau_ref': tau_ref,
+            'alpha': alpha, 't0': t0, 'mjd': 60000.0}
+    return data.astype(np.float32), f_channels, meta
+
+
+def write_filterbank(fname, nsamples, rng, nchans=256, pulses=(), nbits=8, tstart=60000.0, tsamp=TSAMP,
+                     fch1=FCH1, foff=None, chunk=16384):
+    """Write a small SIGPROC filterbank with Gaussian noise and dispersed pulses.
+
+    Parameters
+    ----------
+    pulses : iterable of (t, dm, amp, width)
+        Arrival time at the top of the band (s), DM, amplitude (in noise
+        rms per channel) and Gaussian width (s).
+    nbits : int
+        8 (uint8 around 128) or 32 (float32).
+    """
+    foff = -BANDWIDTH / nchans if foff is None else foff
+    header = {'telescope_id': 11, 'machine_id': 0, 'data_type': 1, 'nbits': nbits, 'nchans': nchans, 'nifs': 1,
+              'tstart': tstart, 'tsamp': tsamp, 'fch1': fch1, 'foff': foff, 'source_name': 'B0531+21'}
+    freqs = filterbank.channel_freqs(header)
+    f_top = freqs.max()
+    with open(fname, 'wb') as f:
+        filterbank.write_header(f, header)
+        for start in range(0, nsamples, chunk):
+            n = min(chunk, nsamples - start)
+            block = rng.normal(0.0, 1.0, (n, nchans)).astype(np.float32)
+            t = (start + np.arange(n))[:, None] * tsamp
+            for t_p, dm, amp, width in pulses:
+                arrival = t_p + arcache.K_DM * dm * (freqs**-2 - f_top**-2)
+                if arrival.min() - 5 * width > t[-1, 0] or arrival.max() + 5 * width < t[0, 0]:
+                    continue
+                block += amp * np.exp(-0.5 * ((t - arrival[None, :]) / width)**2)
+            if nbits == 8:
+                f.write(np.clip(np.rint(128 + 16 * block), 0, 255).astype(np.uint8).tobytes())
+            else:
+                f.write((100.0 + 10.0 * block).astype(np.float32).tobytes())
+    return fname
+
+
+def write_jb_csv(fname, nrows, rng, start_mjd=55910, step=31):
+    """Write a Jodrell Bank Crab ephemeris CSV with ``nrows`` monthly entries."""
+    f1 = -3.708e-10
+    with open(fname, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(JB_COLUMNS)
+        for i in range(nrows):
+            mjd = start_mjd + i * step
+            nu = 29.70553903 + f1 * (mjd - start_mjd) * 86400.0
+            date = np.datetime64('1858-11-17') + np.timedelta64(int(mjd), 'D')
+            y, m, d = str(date).split('-')
+            writer.writerow([f'{d}/{m}/{y}', mjd, f'{rng.uniform(0, 0.03):.6f}', 100, f'{nu:.8f}', 3,
+                             f'{f1 * 1e15 + rng.normal(0, 50):.2f}', 0.5, f'{CRAB_DM + rng.normal(0, 0.02):.5f}',
+                             f'{rng.normal(0, 0.2):.5f}', 100])
+    return fname
+
+
+def sun_direction(mjd):
+    """Geocentric unit vector of the Sun from the low-precision almanac formulae (~0.01 deg)."""
+    n = np.asarray(mjd, dtype=float) - 51544.5
+    L = np.radians(280.460 + 0.9856474 * n)
+    g = np.radians(357.528 + 0.9856003 * n)
+    lam = L + np.radians(1.915) * np.sin(g) + np.radians(0.020) * np.sin(2 * g)
+    eps = np.radians(23.439 - 4e-7 * n)
+    return np.stack([np.cos(lam), np.cos(eps) * np.sin(lam), np.sin(eps) * np.sin(lam)], axis=-1)
+
+
+def write_sun_grid(fname, start=55000.0, end=63000.0, step=1.0):
+    """Daily Sun grid in the ``solarsep.sun_grid`` cache format, without astropy."""
+    mjd = np.arange(start, end + step / 2, step)
+    np.savez(fname, mjd=mjd, sun=sun_direction(mjd))
+    return fname
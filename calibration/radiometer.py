@@ -0,0 +1,172 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DATA_DIR = os.path.join(REPO_DIR, 'data')
+
+# Station tables and the PSRFITS template that describes each band's setup
+STATIONS = {
+    'HBA': {'template': 'lofar.template', 'tsys': 'lofar_hba_tsys.csv', 'aeff': 'lofar_hba_aeff.csv'},
+    'LBA': {'template': 'lofarLBA.template', 'tsys': 'lofar_lba_tsys.csv', 'aeff': 'lofar_lba_aeff.csv'},
+}
+
+k_B = 1380  # Boltzmann constant in Jy m^2 K^-1
+
+_GRID_CACHE = {}
+
+
+def interp_conv_temp(n, freq_mhz, conv_temp_k, fmin=100.0, fmax=190.0):
+    f_new = np.linspace(fmin, fmax, int(n))
+    t_new = np.interp(f_new, freq_mhz, conv_temp_k)
+    return f_new, t_new
+
+
+@lru_cache(maxsize=None)
+def read_template(band='HBA'):
+    """Read centre frequency, bandwidth and channel count from a band's template.
+
+    Returns
+    -------
+    fmin, fmax : float
+        Band edges, in MHz.
+    nchan : int
+        Number of frequency channels.
+    """
+    values = {}
+    with open(os.path.join(REPO_DIR, STATIONS[band]['template'])) as f:
+        for line in f:
+            key = line[:8].strip()
+            if key in ('OBSFREQ', 'OBSBW', 'OBSNCHAN'):
+                values[key] = float(line[9:].split('/')[0])
+    half_bw = abs(values['OBSBW']) / 2
+    return values['OBSFREQ'] - half_bw, values['OBSFREQ'] + half_bw, int(values['OBSNCHAN'])
+
+
+@lru_cache(maxsize=None)
+def load_tables(band='HBA'):
+    """Load the T_sys and effective-area tables of a band.
+
+    Returns ``(tsys_freq, tsys, aeff_freq, aeff)``, frequencies in MHz.
+    """
+    tsys = np.loadtxt(os.path.join(DATA_DIR, STATIONS[band]['tsys']), delimiter=',', skiprows=2)
+    aeff = np.loadtxt(os.path.join(DATA_DIR, STATIONS[band]['aeff']), delimiter=',', skiprows=2)
+    return tsys[:, 0], tsys[:, 1], aeff[:, 0], aeff[:, 1]
+
+
+def _mask_key(rfi_mask):
+    if rfi_mask is None:
+        return None
+    return np.packbits(np.asarray(rfi_mask, dtype=bool)).tobytes()
+
+
+def channel_grid(band='HBA', nchan=None, fmin=None, fmax=None, rfi_mask=None):
+    """Per-channel frequency, T_sys and A_eff grids, cached per setup.
+
+    Missing ``nchan``/``fmin``/``fmax`` are taken from the band's template.
+    The grids and their radiometer weight sum are cached keyed by
+    ``(band, nchan, fmin, fmax, rfi_mask)``, so repeated calls are free.
+
+    Returns
+    -------
+    grid : dict
+        ``freq``, ``T_sys``, ``A_eff`` (all channels) and ``weight_sum``,
+        the sum over unmasked channels of (A_eff / (2 k_B T_sys))**2.
+    """
+    t_fmin, t_fmax, t_nchan = read_template(band)
+    nchan = t_nchan if nchan is None else int(nchan)
+    fmin = t_fmin if fmin is None else float(fmin)
+    fmax = t_fmax if fmax is None else float(fmax)
+
+    key = (band, nchan, fmin, fmax, _mask_key(rfi_mask))
+    if key not in _GRID_CACHE:
+        tsys_freq, tsys, aeff_freq, aeff = load_tables(band)
+        freq, T_sys = interp_conv_temp(nchan, tsys_freq, tsys, fmin=fmin, fmax=fmax)
+        A_eff = np.interp(freq, aeff_freq, aeff)
+        weight = (A_eff / (2 * k_B * T_sys))**2
+        if rfi_mask is not None:
+            weight = weight[np.asarray(rfi_mask, dtype=bool)]
+        _GRID_CACHE[key] = {'freq': freq, 'T_sys': T_sys, 'A_eff': A_eff, 'weight_sum': weight.sum()}
+    return _GRID_CACHE[key]
+
+
+def burst_smin_batch(freq, T_sys, A_phys, SNR_limit, W_burst,
+                     chan_BW, n_p=2, rfi_mask=None, dtype=np.float64):
+    """Compute S_min for many bursts at once.
+
+    Same radiometer sum as ``fluxDistTX.burst_smin``, but the per-channel
+    quadrature sum only depends on T_sys/A_phys so it is evaluated once and
+    scaled by each burst's S/N and width.
+
+    Parameters
+    ----------
+    SNR_limit, W_burst : array_like
+        S/N and width (s) of every burst.
+    rfi_mask : array_like of bool, optional
+        Channels to keep, either one (nchan,) mask shared by all bursts or
+        an (nburst, nchan) mask per burst.
+    dtype : dtype
+        Output precision; float32 halves the memory for large catalogues.
+
+    Returns
+    -------
+    S_min : array
+        S_min of every burst, in mJy.
+    """
+    T_sys = np.broadcast_to(np.asarray(T_sys, dtype=float), np.shape(freq))
+    A_phys = np.broadcast_to(np.asarray(A_phys, dtype=float), np.shape(freq))
+
+    # sum_i 1/S_min_i**2 = (n_p * chan_BW * W / SNR**2) * sum_i (A_i / (2 k_B T_i))**2
+    chan_weight = (A_phys / (2 * k_B * T_sys))**2
+    if rfi_mask is None:
+        weight_sum = chan_weight.sum()
+    else:
+        weight_sum = np.asarray(rfi_mask, dtype=float) @ chan_weight
+
+    return _smin(SNR_limit, W_burst, weight_sum, chan_BW, n_p, dtype)
+
+
+def _smin(snr, width, weight_sum, chan_BW, n_p, dtype):
+    chan_BW_Hz = chan_BW * 1e6
+    snr = np.asarray(snr, dtype=dtype)
+    width = np.asarray(width, dtype=dtype)
+    S_min = snr / np.sqrt(n_p * chan_BW_Hz * width * np.asarray(weight_sum, dtype=dtype))
+    return (S_min * 1000).astype(dtype, copy=False)  # mJy
+
+
+def flux_from_snr(width, snr, band='HBA', nchan=None, fmin=None, fmax=None,
+                  chan_bw=None, n_p=2, rfi_mask=None, dtype=np.float64):
+    """Radiometer flux density of bursts from their S/N and width.
+
+    Parameters
+    ----------
+    width : array_like
+        Burst widths, in s.
+    snr : array_like
+        Burst S/N.
+    band : str
+        'HBA' or 'LBA'; selects the station tables and template defaults.
+    nchan, fmin, fmax : optional
+        Channelisation, defaults taken from the band's template.
+    chan_bw : float, optional
+        Channel bandwidth in MHz, defaults to the grid's channel spacing.
+    rfi_mask : array_like of bool, optional
+        Channels to keep; (nchan,) masks are cached, (nburst, nchan) masks
+        are applied per burst.
+
+    Returns
+    -------
+    flux : array
+        Flux density of every burst, in mJy.
+    """
+    if rfi_mask is not None and np.ndim(rfi_mask) == 2:
+        grid = channel_grid(band, nchan, fmin, fmax)
+        weight_sum = np.asarray(rfi_mask, dtype=float) @ ((grid['A_eff'] / (2 * k_B * grid['T_sys']))**2)
+    else:
+        grid = channel_grid(band, nchan, fmin, fmax, rfi_mask)
+        weight_sum = grid['weight_sum']
+
+    if chan_bw is None:
+        chan_bw = (grid['freq'][-1] - grid['freq'][0]) / (grid['freq'].size - 1)
+    return _smin(snr, width, weight_sum, chan_bw, n_p, dtype)
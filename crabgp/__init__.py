@@ -0,0 +1 @@
+"""Crab giant-pulse analysis tools; see ``crabgp --help`` for the subcommands."""
@@ -0,0 +1,3 @@
+from crabgp.cli import main
+
+main()
@@ -0,0 +1,86 @@
+import argparse
+import os
+import runpy
+import sys
+
+from crabgp import plotting
+
+# The script directories are installed as crabgp sub-packages of the same name
+# (see pyproject.toml); in a checkout (or an editable install) they sit next
+# to crabgp/
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_ROOTS = (PACKAGE_DIR, os.path.join(PACKAGE_DIR, '..'))
+
+# subcommand -> (script relative to the repository, description). Scripts are
+# only located here; they are imported when their subcommand runs, so the
+# dependencies of one never slow down another.
+COMMANDS = {
+    'analyse': ('TransientX/transientXanalysis.py', 'Filter, de-duplicate and report TransientX candidates'),
+    'cands': ('TransientX/candstore.py', 'Ingest .cands files into the columnar candidate stores'),
+    'flux': ('plots/fluxDistTX.py', 'Radiometer flux-density distribution of the candidates'),
+    'search': ('transientX/gpsearch.py', 'Narrow-DM sub-band single-pulse search of filterbanks'),
+    'pipeline': ('transientX/txpipeline.py', 'Requantise, search and record filterbanks in a resumable pipeline'),
+    'filterbank': ('transientX/filterbank.py', 'SIGPROC filterbank header, requantisation and cut-outs'),
+    'rfimask': ('transientX/rfimask.py', 'Cached RFI mask of a filterbank'),
+    'fold': ('folding/fold.py', 'Multi-band fold and F0/DM refinement with the JB ephemeris'),
+    'ephem': ('folding/grabJBephem.py', 'Jodrell Bank ephemeris par files for filterbanks'),
+    'dmsearch': ('DM_calc/dmsearch.py', 'Phase-coherence DM search of giant-pulse archives'),
+    'dmdb': ('DM_calc/dmdb.py', 'DM time-series database'),
+    'compare-dms': ('DM_calc/plotcompareDMs.py', 'Plot an archive dedispersed at two DMs'),
+    'jb-dms': ('plots/jodrell_dm.py', 'JB ephemeris DMs with the nightly giant-pulse DMs'),
+    'scatter': ('modelling/modelScattering.py', 'Fit scattering models to giant-pulse archives'),
+    'replot': ('observation/replot.py', 'Select candidates and make replot_fil archives of them'),
+    'obscat': ('observation/obscat.py', 'Observation catalogue'),
+    'pull': ('observation/pull-crab.py', 'Ingest the REALTA catalogue and export the Crab observations'),
+    'solar': ('plots/solar_timeline.py', 'Crab-Sun separation over the observations'),
+    'bench': ('benchmarks/run_benchmarks.py', 'Time the hot paths on synthetic data'),
+}
+
+
+def fetch_args(argv=None):
+    '''
+    Fetches the arguments from the command line
+    '''
+    width = max(map(len, COMMANDS))
+    parser = argparse.ArgumentParser(
+        prog='crabgp', description='Crab giant-pulse analysis tools.',
+        epilog='subcommands:\n' + '\n'.join(f'  {name:<{width}}  {desc}' for name, (_, desc) in COMMANDS.items()) +
+               "\n\nRun 'crabgp <subcommand> --help' for the options of a subcommand.",
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--no-plot', action='store_true', help='Skip all plotting; matplotlib is never imported')
+    parser.add_argument('command', choices=sorted(COMMANDS), metavar='subcommand', help='Tool to run (see below)')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Options passed on to the subcommand')
+
+    return parser.parse_args(argv)
+
+
+def script_path(command):
+    """Path of a subcommand's script, in an installed crabgp or a checkout."""
+    for root in SCRIPT_ROOTS:
+        script = os.path.normpath(os.path.join(root, COMMANDS[command][0]))
+        if os.path.isfile(script):
+            return script
+    raise SystemExit(f"crabgp: {COMMANDS[command][0]} is not installed; reinstall crabgp (pip install .)")
+
+
+def run(command, args=()):
+    """Run a subcommand's script as ``__main__`` with ``args`` as its command line.
+
+    The script's directory goes first on ``sys.path``, as when it is run
+    directly, so its sibling imports resolve the same way.
+    """
+    script = script_path(command)
+    sys.path.insert(0, os.path.dirname(script))
+    sys.argv = [f'crabgp {command}'] + list(args)
+    runpy.run_path(script, run_name='__main__')
+
+
+def main(argv=None):
+    args = fetch_args(argv)
+    if args.no_plot:
+        plotting.disable()
+    run(args.command, args.args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import os
+from functools import lru_cache
+
+# Set by ``crabgp --no-plot`` (or a script's --no-plot); inherited by worker
+# processes and by scripts launched from shell wrappers
+NO_PLOT_ENV = 'CRABGP_NO_PLOT'
+STYLE = ('science', 'no-latex')
+
+
+def enabled():
+    """Whether plots should be made (False in --no-plot mode)."""
+    return os.environ.get(NO_PLOT_ENV, '') in ('', '0')
+
+
+def disable():
+    os.environ[NO_PLOT_ENV] = '1'
+
+
+@lru_cache(maxsize=None)
+def pyplot(style=STYLE):
+    """Import matplotlib.pyplot with the scienceplots style applied, on first use.
+
+    Scripts call this where they plot rather than at import time, so
+    ``--help``, --no-plot runs and batch jobs never load matplotlib.
+    """
+    import matplotlib.pyplot as plt
+    import scienceplots  # noqa: F401 (registers the 'science' styles)
+    plt.style.use(list(style))
+    return plt
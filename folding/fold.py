@@ -0,0 +1,365 @@
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'transientX'))
+import filterbank
+import gpsearch
+import jbephem
+import rfimask
+
+FOLDING_DIRNAME = 'folding'
+
+# Kept channel ranges (ascending frequency) of the three prepfold runs of foldCrab.sh
+DEFAULT_BANDS = {
+    'lowfreq': '251:1599',
+    'hifreq': '3001:3849',
+    'full': '251:3849',
+}
+
+# I-LOFAR (IE613), Birr: longitude, latitude (deg), height (m)
+SITE = (-7.9216, 53.0947, 75.0)
+# Crab pulsar (ICRS), degrees
+CRAB_RA = 83.6331
+CRAB_DEC = 22.0174
+C_KMS = 299792.458
+
+
+def fetch_args():
+    '''
+    Fetches the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description='Fold Crab filterbanks with the Jodrell Bank ephemeris in one pass.')
+    parser.add_argument('input', type=str, nargs='+', help='Filterbank(s) or directory(s) searched for *P000.fil')
+    parser.add_argument('-o', '--output', type=str, help=f'Output directory (default = <fil dir>/{FOLDING_DIRNAME})', required=False)
+    parser.add_argument('-n', '--nbin', type=int, help='Profile bins (default = 256)', default=256)
+    parser.add_argument('--nsubint', type=int, help='Sub-integrations (default = 64)', default=64)
+    parser.add_argument('--nsub', type=int, help='Frequency sub-bands (default = 128)', default=128)
+    parser.add_argument('--band', type=str, action='append', help='Extra band as name=lo:hi (channels, ascending frequency)', required=False)
+    parser.add_argument('--zap', type=str, help="Channels always zapped (default = rfimask's band edges, '' for none)", required=False)
+    parser.add_argument('--no-rfi-mask', action='store_true', help='Do not apply the cached RFI mask (rfimask.py)')
+    parser.add_argument('--npfact', type=float, help='F0 search half-range, in bins of drift over the observation (default = 10)', default=10)
+    parser.add_argument('--dm-range', type=float, help='DM search half-range around the JB DM (default = 0.05)', default=0.05)
+    parser.add_argument('--topo', action='store_true', help='Fold at the ephemeris F0 without the barycentric Doppler correction')
+    parser.add_argument('--chunk', type=int, help='Samples read per block (default = 16384)', default=16384)
+    parser.add_argument('-j', '--jobs', type=int, help='Filterbanks folded in parallel (default = 1)', default=1)
+
+    return parser.parse_args()
+
+
+def spin_model(mjd, fname=jbephem.JB_CSV):
+    """F0 (Hz), F1 (s^-2) and F2 (s^-3) at ``mjd`` from the preceding JB ephemeris entry."""
+    table = jbephem.load_table(fname)
+    idx = jbephem.lookup(mjd, fname)
+    if idx < 0:
+        raise ValueError(f"MJD {mjd} predates the Jodrell Bank ephemeris")
+    dt = (mjd - table['mjd'][idx]) * 86400.0
+    f1 = float(table['f1'][idx]) * 1e-15 + jbephem.F2 * dt
+    return float(jbephem.spin_frequency(mjd, fname)), f1, jbephem.F2, float(table['dm'][idx])
+
+
+def pulse_phase(t, f0, f1=0.0, f2=0.0):
+    """Rotations since ``t = 0`` (s) of a Taylor-series spin model."""
+    return t * (f0 + t * (f1 / 2.0 + t * f2 / 6.0))
+
+
+def doppler_phase(tstart, tobs, f0, step=30.0, site=SITE, ra=CRAB_RA, dec=CRAB_DEC):
+    """Extra rotations from the observatory's motion towards the pulsar.
+
+    The JB ephemeris is barycentric; the observed frequency is
+    f0 * (1 + v / c), with v the barycentric velocity correction towards
+    the target (astropy), evaluated every ``step`` s and integrated.
+
+    Returns
+    -------
+    t : array
+        Grid times since ``tstart``, in s.
+    extra : array
+        Rotations accumulated by then on top of the barycentric model.
+    doppler : array
+        1 + v / c on the grid.
+    """
+    from astropy import units as u
+    from astropy.coordinates import EarthLocation, SkyCoord
+    from astropy.time import Time
+
+    t = np.linspace(0.0, tobs, max(2, int(np.ceil(tobs / step)) + 1))
+    location = EarthLocation.from_geodetic(site[0] * u.deg, site[1] * u.deg, site[2] * u.m)
+    target = SkyCoord(ra=ra * u.deg, dec=dec * u.deg, frame='icrs')
+    v = target.radial_velocity_correction('barycentric', obstime=Time(tstart + t / 86400.0, format='mjd'),
+                                          location=location).to_value(u.km / u.s)
+    doppler = 1.0 + v / C_KMS
+    extra = f0 * np.concatenate([[0.0], np.cumsum(np.diff(t) * (doppler[1:] + doppler[:-1] - 2.0) / 2.0)])
+    return t, extra, doppler
+
+
+def band_subbands(freqs, bands, nsub):
+    """Channel -> sub-band assignment whose sub-bands never straddle a band edge.
+
+    Channels (in file order) are cut into ``nsub`` contiguous groups in
+    ascending frequency, with extra cuts at the edges of every band.
+
+    Returns
+    -------
+    subband : array of int, shape (nchan,)
+    members : dict
+        Band name -> boolean array over sub-bands.
+    """
+    nchan = len(freqs)
+    ascending = np.argsort(freqs)
+    cuts = set((np.arange(1, nsub) * nchan // nsub).tolist())
+    chans = {}
+    for name, spec in bands.items():
+        c = rfimask.parse_ranges(spec)
+        c = c[c < nchan]
+        chans[name] = c
+        if c.size:
+            cuts.update([int(c.min()), int(c.max()) + 1])
+    cuts = np.array(sorted(x for x in cuts if 0 < x < nchan), dtype=np.int64)
+    sub_asc = np.searchsorted(cuts, np.arange(nchan), side='right')
+
+    subband = np.empty(nchan, dtype=np.int64)
+    subband[ascending] = sub_asc
+    members = {}
+    for name, c in chans.items():
+        members[name] = np.zeros(cuts.size + 1, dtype=bool)
+        members[name][np.unique(sub_asc[c])] = True
+    return subband, members
+
+
+def fold_filterbank(fname, nbin=256, nsubint=64, nsub=128, bands=None, weights=None, dm=None, f0=None, topo=False,
+                    chunk=16384):
+    """Fold a filterbank into a (sub-integration, sub-band, bin) cube in one pass.
+
+    The memory-mapped data are normalised per channel, dedispersed to
+    ``dm`` into sub-bands (``gpsearch.SubbandDedisperser``) and every
+    top-of-band sample is added to the bin of its pulse phase, computed
+    from the JB ephemeris F0/F1/F2 extrapolated to the file's start and
+    Doppler shifted to the observatory (unless ``topo``, where ``f0`` is
+    taken as topocentric).
+
+    Returns
+    -------
+    fold : dict
+        ``cube`` (sub-band profiles, hit-normalised), ``hits`` (nsubint,
+        nbin), ``freqs`` (sub-band centres), ``members`` (band -> sub-bands),
+        ``t_subint`` (mid-times, s), ``f0``, ``f1``, ``f2``, ``dm``, ``tstart``,
+        ``tobs`` and ``doppler`` (1 + v/c at mid-observation).
+    """
+    header = filterbank.read_header(fname)
+    data = filterbank.open_data(fname, header)
+    freqs = filterbank.channel_freqs(header)
+    f0_jb, f1, f2, dm_jb = spin_model(header['tstart'])
+    f0 = f0_jb if f0 is None else f0
+    dm = dm_jb if dm is None else dm
+    tsamp = header['tsamp']
+    nsamples = header['nsamples']
+    tobs = nsamples * tsamp
+
+    if topo:
+        grid_t, grid_extra, doppler = np.array([0.0, tobs]), np.zeros(2), np.ones(2)
+    else:
+        grid_t, grid_extra, doppler = doppler_phase(header['tstart'], tobs, f0)
+
+    subband, members = band_subbands(freqs, bands if bands is not None else DEFAULT_BANDS, nsub)
+    med, rms = filterbank.channel_stats(data)
+    scale = (1.0 / rms).astype(np.float32)
+    if weights is not None:
+        scale *= np.asarray(weights, dtype=np.float32)
+    dd = gpsearch.SubbandDedisperser(freqs, tsamp, [dm], weights=(scale != 0), subband=subband)
+
+    cube = np.zeros((nsubint, dd.nsub, nbin))
+    hits = np.zeros((nsubint, nbin))
+    skip = dd.max_delay
+    t0 = 0  # top-of-band sample number of the next completed sample
+    for start in range(0, nsamples + dd.max_delay + chunk, chunk):
+        block = np.zeros((chunk, header['nchans']), dtype=np.float32)
+        rows = data[start:min(start + chunk, nsamples)]
+        if len(rows):
+            block[:len(rows)] = (np.asarray(rows, dtype=np.float32) - med) * scale
+        series = dd.push(block)
+        if skip:
+            series, skip = series[:, skip:], max(0, skip - series.shape[1])
+        # samples whose low-frequency channels run past the end of the file are incomplete
+        n = min(series.shape[1], nsamples - dd.max_delay - t0)
+        if n <= 0:
+            if t0 + dd.max_delay >= nsamples:
+                break
+            continue
+        t = (t0 + np.arange(n)) * tsamp
+        phase = pulse_phase(t, f0, f1, f2) + np.interp(t, grid_t, grid_extra)
+        idx = (np.floor(phase % 1.0 * nbin).astype(np.int64) % nbin
+               + nbin * np.minimum((t / tobs * nsubint).astype(np.int64), nsubint - 1))
+        hits += np.bincount(idx, minlength=nsubint * nbin).reshape(nsubint, nbin)
+        flat = (np.arange(dd.nsub)[:, None] * (nsubint * nbin) + idx[None, :]).ravel()
+        cube += np.bincount(flat, weights=series[:, :n].ravel(), minlength=dd.nsub * nsubint * nbin) \
+            .reshape(dd.nsub, nsubint, nbin).transpose(1, 0, 2)
+        t0 += n
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cube = np.where(hits[:, None, :] > 0, cube / hits[:, None, :], 0.0)
+    f_sub = np.array([freqs[subband == s].mean() for s in range(dd.nsub)])
+    return {'cube': cube, 'hits': hits, 'freqs': f_sub, 'members': members,
+            't_subint': (np.arange(nsubint) + 0.5) * tobs / nsubint, 'f0': f0, 'f1': f1, 'f2': f2, 'dm': dm,
+            'tstart': header['tstart'], 'tobs': tobs, 'doppler': float(np.interp(tobs / 2, grid_t, doppler)),
+            'fname': fname}
+
+
+def rotate(profiles, shifts):
+    """Rotate profiles (..., nbin) earlier by ``shifts`` (turns, broadcast) with Fourier phase gradients."""
+    nbin = profiles.shape[-1]
+    spec = np.fft.rfft(profiles, axis=-1)
+    k = np.arange(spec.shape[-1])
+    return np.fft.irfft(spec * np.exp(2j * np.pi * np.asarray(shifts)[..., None] * k), n=nbin, axis=-1)
+
+
+def profile_chi2(profiles, sigma=None):
+    """Reduced chi-square of profiles (..., nbin) against a flat line, as prepfold reports."""
+    dev = profiles - profiles.mean(axis=-1, keepdims=True)
+    if sigma is None:
+        sigma = np.std(dev, axis=-1, keepdims=True)
+    return np.sum(dev**2, axis=-1) / (sigma**2 * (profiles.shape[-1] - 1))
+
+
+def _off_pulse_sigma(profile):
+    """Noise of a profile from its differences (robust to the pulse)."""
+    return 1.4826 * np.median(np.abs(np.diff(profile))) / np.sqrt(2)
+
+
+def refine(fold, npfact=10, dm_range=0.05, nstep=2, band=None):
+    """Refine F0 and DM on the folded cube, without refolding.
+
+    F0 offsets shift the sub-integrations by ``df * t``; DM offsets shift
+    the sub-bands by their dispersion delay. Trials step by 1/``nstep`` bin
+    of drift over the observation (F0, over +-``npfact`` bins) or of
+    smearing across the band (DM, over +-``dm_range``); the trial with the
+    highest profile chi-square wins. F0 is refined first on the DM-summed
+    sub-integrations, then DM on the F0-corrected sub-bands, using the
+    sub-bands of ``band`` (default all).
+
+    Returns
+    -------
+    best : dict
+        ``f0``, ``dm``, ``df``, ``ddm`` and ``chi2`` of the best trials.
+    """
+    cube = fold['cube']
+    nbin = cube.shape[-1]
+    use = fold['members'].get(band) if band is not None else None
+    if use is None or not use.any():
+        use = np.ones(cube.shape[1], dtype=bool)
+    t = fold['t_subint'] - fold['tobs'] / 2
+
+    subints = cube[:, use].sum(axis=1)
+    sigma = _off_pulse_sigma(subints.sum(axis=0)) or None
+    # one bin of drift over the observation is df = 1 / (nbin * tobs)
+    df = np.arange(-npfact * nstep, npfact * nstep + 1) / nstep / (nbin * fold['tobs'])
+    chi2_f = profile_chi2(rotate(subints[None], -df[:, None] * t[None, :]).sum(axis=1), sigma)
+    best_df = df[np.argmax(chi2_f)]
+
+    subbands = rotate(cube, -best_df * t[:, None]).sum(axis=0)[use]
+    f_sub = fold['freqs'][use]
+    f_top = fold['freqs'].max()
+    f0 = fold['f0'] + best_df
+    smear = gpsearch.K_DM * (f_sub.min()**-2 - f_top**-2) * f0  # turns per unit DM across the band
+    ddm = np.arange(-dm_range, dm_range, 1.0 / (nstep * nbin * smear)) if smear > 0 else np.zeros(1)
+    ddm = np.r_[ddm[ddm < 0], 0.0, -ddm[ddm < 0][::-1]]
+    delay = gpsearch.K_DM * (f_sub**-2 - f_top**-2) * f0  # turns per unit DM
+    chi2_dm = profile_chi2(rotate(subbands[None], ddm[:, None] * delay[None, :]).sum(axis=1), sigma)
+    i = np.argmax(chi2_dm)
+    return {'f0': f0, 'dm': fold['dm'] + ddm[i], 'df': best_df, 'ddm': ddm[i], 'chi2': float(chi2_dm[i])}
+
+
+def band_profiles(fold, best=None):
+    """Profile of every band, corrected to the refined F0 and DM when ``best`` is given."""
+    cube = fold['cube']
+    if best is not None:
+        t = fold['t_subint'] - fold['tobs'] / 2
+        delay = gpsearch.K_DM * (fold['freqs']**-2 - fold['freqs'].max()**-2) * best['f0']
+        cube = rotate(cube, -best['df'] * t[:, None] + best['ddm'] * delay[None, :])
+    subbands = cube.sum(axis=0)
+    return {name: subbands[use].sum(axis=0) for name, use in fold['members'].items() if use.any()}
+
+
+def output_paths(fname, output_dir=None):
+    output_dir = output_dir or os.path.join(os.path.dirname(os.path.abspath(fname)), FOLDING_DIRNAME)
+    stem = os.path.join(output_dir, os.path.basename(fname)[:-len('.fil')] + '_fold')
+    return stem + '.npz', stem + '.json'
+
+
+def fold_to_files(fname, output_dir=None, rfi_mask=True, zap=None, bands=None, npfact=10, dm_range=0.05, **kwargs):
+    """Fold, refine and save one filterbank; return its summary dict.
+
+    Writes ``<stem>_fold.npz`` (cube, sub-band frequencies, band profiles)
+    and ``<stem>_fold.json`` (JB and refined F0/DM, the refined topocentric
+    period at mid-observation and the chi-square of every band).
+    """
+    weights = rfimask.get_mask(fname, zap=zap).weights() if rfi_mask else None
+    bands = dict(DEFAULT_BANDS, **(bands or {}))
+    fold = fold_filterbank(fname, bands=bands, weights=weights, **kwargs)
+    best = refine(fold, npfact, dm_range)
+    profiles = band_profiles(fold, best)
+
+    # refined spin frequency seen at the telescope at mid-observation (e.g. for dspsr -c)
+    f0_topo = (best['f0'] + fold['f1'] * fold['tobs'] / 2) * fold['doppler']
+
+    npz, js = output_paths(fname, output_dir)
+    os.makedirs(os.path.dirname(npz), exist_ok=True)
+    with open(npz + '.tmp', 'wb') as f:
+        np.savez(f, cube=fold['cube'], hits=fold['hits'], freqs=fold['freqs'], t_subint=fold['t_subint'],
+                 **{f'profile_{name}': prof for name, prof in profiles.items()},
+                 **{f'members_{name}': use for name, use in fold['members'].items()})
+    os.replace(npz + '.tmp', npz)
+
+    summary = {
+        'fil': os.path.abspath(fname), 'tstart': fold['tstart'], 'tobs': fold['tobs'],
+        'f0_jb': fold['f0'], 'f1': fold['f1'], 'dm_jb': fold['dm'],
+        'f0': best['f0'], 'dm': best['dm'], 'chi2': best['chi2'],
+        'f0_topo': f0_topo, 'period_topo': 1.0 / f0_topo,
+        'bands': {name: {'chi2': float(profile_chi2(prof, _off_pulse_sigma(prof))), 'nsub': int(fold['members'][name].sum())}
+                  for name, prof in profiles.items()},
+        'npz': npz,
+    }
+    with open(js + '.tmp', 'w') as f:
+        json.dump(summary, f, indent=1)
+    os.replace(js + '.tmp', js)
+    return summary
+
+
+def find_inputs(inputs):
+    fils = []
+    for path in inputs:
+        if os.path.isdir(path):
+            fils.extend(sorted(glob.glob(os.path.join(path, '**', '*P000.fil'), recursive=True)))
+        else:
+            fils.append(path)
+    return fils
+
+
+def main():
+    args = fetch_args()
+    fils = find_inputs(args.input)
+    bands = dict(band.split('=', 1) for band in args.band or [])
+    kwargs = dict(output_dir=args.output, rfi_mask=not args.no_rfi_mask, zap=args.zap, bands=bands,
+                  npfact=args.npfact, dm_range=args.dm_range, topo=args.topo, nbin=args.nbin, nsubint=args.nsubint, nsub=args.nsub,
+                  chunk=args.chunk)
+
+    if args.jobs > 1 and len(fils) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = [pool.submit(fold_to_files, fil, **kwargs) for fil in fils]
+            summaries = [f.result() for f in futures]
+    else:
+        summaries = [fold_to_files(fil, **kwargs) for fil in fils]
+
+    for s in summaries:
+        bands_ = ', '.join(f"{name} chi2={b['chi2']:.1f}" for name, b in s['bands'].items())
+        print(f"{s['fil']}: F0 {s['f0_jb']:.11f} -> {s['f0']:.11f} Hz, DM {s['dm_jb']:.4f} -> {s['dm']:.4f}; {bands_}")
+
+
+if __name__ == "__main__":
+    main()
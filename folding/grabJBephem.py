@@ -1,74 +1,82 @@
-import pandas as pd  
-import argparse 
-# import your 
-from astropy.time import Time
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'transientX'))
+import filterbank
+import jbephem
 
 def date2mjd(date):
     '''
     Input: i.e. 15/12/2011
     '''
+    from astropy.time import Time
     t = Time(date, format='iso', scale='tai')
     return t.mjd
 
 def get_args():
     parser = argparse.ArgumentParser(description="Grab Jodrell Bank Ephermis for the crab data.")
-    parser.add_argument("-f", help="Input filterbank path")
-    parser.add_argument("-o", help="Output par file path", default="pulsar.par")
-    parser.add_argument("-mjd", help="MJD of the observation", type=float, required=False)
+    parser.add_argument("-f", nargs='+', help="Input filterbank path(s)")
+    parser.add_argument("-o", help="Output par file path (single file), or directory for --batch", default="pulsar.par")
+    parser.add_argument("-mjd", help="MJD of the observation(s), one per filterbank", type=float, nargs='+', required=False)
     parser.add_argument("--print", action="store_true", help="Print f0 and DM content to stdout")
+    parser.add_argument("--batch", action="store_true", help="Write one par file per filterbank and print a table of fil, MJD, F0 and DM")
+    parser.add_argument("--table", help="JB ephemeris CSV", default=jbephem.JB_CSV)
     return parser.parse_args()
 
-# TODO: Scarp and convert to .csv
+def header_mjd(fil):
+    return filterbank.read_header(fil)['tstart']
+
+def par_name(fil, output):
+    base = os.path.splitext(os.path.basename(fil))[0] + '.par'
+    return os.path.join(output if os.path.isdir(output) else os.path.dirname(os.path.abspath(fil)), base)
+
 def main():
     args = get_args()
-    df = pd.read_csv("../data/Crab_post2011.csv")
-    
+    fils = args.f or []
+
     if args.mjd is None:
-        import your 
-        header = your.Your(args.f).your_header
-        obs_mjd = header.tstart 
-        
+        obs_mjd = np.array([header_mjd(fil) for fil in fils])
     else:        
-        obs_mjd = args.mjd
-    
+        obs_mjd = np.asarray(args.mjd, dtype=float)
+    if fils and len(fils) != len(obs_mjd):
+        sys.exit(f"Got {len(fils)} filterbanks but {len(obs_mjd)} MJDs")
+
+    # latest epoch at or before every observation, in one binary search
+    idx = jbephem.lookup(obs_mjd, args.table)
+    if np.any(idx < 0):
+        sys.exit(f"MJD(s) {obs_mjd[idx < 0]} predate the Jodrell Bank ephemeris")
+    table = jbephem.load_table(args.table)
+    f0_obs = jbephem.spin_frequency(obs_mjd, args.table)
+
+    if args.batch:
+        print("fil\tmjd\tpepoch\tF0\tF0_obs\tDM\tpar")
+        for i, fil in enumerate(fils):
+            par = par_name(fil, args.o)
+            jbephem.write_par(idx[i], par, args.table)
+            print(f"{fil}\t{obs_mjd[i]}\t{table['mjd'][idx[i]]:g}\t{table['f0'][idx[i]]}\t{f0_obs[i]:.11f}\t"
+                  f"{table['dm'][idx[i]]}\t{par}")
+        return
+
+    obs_mjd, idx = obs_mjd[0], idx[0]
+    closest_mjd = table['mjd'][idx]
     print(obs_mjd)
-    # find cloest MJD in the df that happens before the obs_mjd
-    closest_mjd = df[df['MJD'] <= obs_mjd]['MJD'].max()
-    
-    print("Obs date:", Time(obs_mjd, format='mjd').iso)
-    print("Closest MJD in Jodrell Bank Ephermis:", closest_mjd, "->", Time(closest_mjd, format='mjd').iso)
-    row = df[df['MJD'] == closest_mjd].iloc[0]
+    print("Obs date:", jbephem.mjd2iso(obs_mjd))
+    print("Closest MJD in Jodrell Bank Ephermis:", f"{closest_mjd:g}", "->", jbephem.mjd2iso(closest_mjd))
     
     if args.print:
-        print(f"F0: {row['nu_Hz']}")
-        print(f"DM: {row['DM_pc_cm-3']}")
+        print(f"F0: {table['f0'][idx]}")
+        print(f"DM: {table['dm'][idx]}")
+        print(f"F0_obs: {f0_obs[0]:.11f}")
         return
     
     else: 
-        par_content = f"""PSRJ            J0534+2200
-RAJ             05:34:31.973                  5.000e-03
-DECJ            +22:00:52.06                  6.000e-02
-DM              {row['DM_pc_cm-3']}                        2.400e-04
-PEPOCH          {closest_mjd}
-F0              {row['nu_Hz']}                     1.000e-06
-F1              {row['nudot_1e-15_s-2']}E-15                        1.000e-12
-PMRA            -14.7                         8.000e-01
-PMDEC           2.0                           8.000e-01
-POSEPOCH        {closest_mjd}
-DMEPOCH         {closest_mjd}
-F2              1.1147E-20                    5.000e-24
-EPHEM           DE405
-RM              -45.44                        8.000e-02
-F3              -2.73E-30                     4.000e-32
-EPHVER          2
-UNITS           TDB
-    """
-    
+        par_content = jbephem.write_par(idx, args.o, args.table)
         print(par_content)
-        with open(args.o, "w") as f:
-            f.write(par_content)
-            
         print(f"Par file saved to {args.o}")
             
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,100 @@
+import csv
+import os
+from functools import lru_cache
+
+import numpy as np
+
+JB_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'Crab_post2011.csv')
+
+# Constant terms of the Crab par file that are not in the monthly JB table
+F2 = 1.1147E-20
+
+PAR_TEMPLATE = """PSRJ            J0534+2200
+RAJ             05:34:31.973                  5.000e-03
+DECJ            +22:00:52.06                  6.000e-02
+DM              {dm}                        2.400e-04
+PEPOCH          {mjd}
+F0              {f0}                     1.000e-06
+F1              {f1}E-15                        1.000e-12
+PMRA            -14.7                         8.000e-01
+PMDEC           2.0                           8.000e-01
+POSEPOCH        {mjd}
+DMEPOCH         {mjd}
+F2              1.1147E-20                    5.000e-24
+EPHEM           DE405
+RM              -45.44                        8.000e-02
+F3              -2.73E-30                     4.000e-32
+EPHVER          2
+UNITS           TDB
+    """
+
+
+@lru_cache(maxsize=None)
+def load_table(fname=JB_CSV):
+    """Load the Jodrell Bank Crab ephemeris into arrays sorted by MJD.
+
+    Returns
+    -------
+    table : dict
+        ``mjd``, ``f0`` (Hz), ``f1`` (1e-15 s^-2, as tabulated) and ``dm``
+        (pc cm^-3) arrays.
+    """
+    with open(fname, newline='') as f:
+        rows = list(csv.DictReader(f))
+    table = {
+        'mjd': np.array([float(r['MJD']) for r in rows]),
+        'f0': np.array([r['nu_Hz'] for r in rows]),
+        'f1': np.array([r['nudot_1e-15_s-2'] for r in rows]),
+        'dm': np.array([r['DM_pc_cm-3'] for r in rows]),
+    }
+    order = np.argsort(table['mjd'], kind='stable')
+    # keep the tabulated strings for the par files, floats for arithmetic
+    return {key: value[order] for key, value in table.items()}
+
+
+def lookup(obs_mjd, fname=JB_CSV):
+    """Index of the latest ephemeris epoch at or before every MJD.
+
+    Parameters
+    ----------
+    obs_mjd : float or array_like
+        Observation MJDs.
+
+    Returns
+    -------
+    idx : int or array of int
+        Row of ``load_table(fname)``, -1 for MJDs before the first epoch.
+    """
+    mjd = load_table(fname)['mjd']
+    return np.searchsorted(mjd, obs_mjd, side='right') - 1
+
+
+def spin_frequency(obs_mjd, fname=JB_CSV):
+    """F0 extrapolated from the preceding epoch to each observation with F1 and F2, in Hz."""
+    table = load_table(fname)
+    idx = lookup(obs_mjd, fname)
+    dt = (np.asarray(obs_mjd, dtype=float) - table['mjd'][idx]) * 86400.0
+    f0 = table['f0'][idx].astype(float)
+    f1 = table['f1'][idx].astype(float) * 1e-15
+    return np.where(idx >= 0, f0 + f1 * dt + 0.5 * F2 * dt**2, np.nan)
+
+
+def par_content(idx, fname=JB_CSV):
+    """Crab par file of one ephemeris row."""
+    table = load_table(fname)
+    mjd = table['mjd'][idx]
+    return PAR_TEMPLATE.format(dm=table['dm'][idx], mjd=int(mjd) if mjd.is_integer() else mjd,
+                               f0=table['f0'][idx], f1=table['f1'][idx])
+
+
+def write_par(idx, output, fname=JB_CSV):
+    content = par_content(idx, fname)
+    with open(output, 'w') as f:
+        f.write(content)
+    return content
+
+
+def mjd2iso(mjd):
+    """ISO date of an MJD (UTC calendar, no leap-second handling)."""
+    seconds = np.round(np.asarray(mjd, dtype=float) * 86400.0).astype(np.int64)
+    return str(np.datetime64('1858-11-17T00:00:00') + seconds.astype('timedelta64[s]'))
@@ -1,8 +1,22 @@
-import psrchive 
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 import numpy as np 
-import matplotlib.pyplot as plt
-import scienceplots; plt.style.use(['science', 'no-latex'])
-from lmfit import Model
+import scatterfit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'DM_calc'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'transientX'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'profiling'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import arcache
+import rfimask
+import stagereport
+from crabgp import plotting
 
 
 def f_thick(t, t0, tau, A, offset=0.0):
@@ -27,177 +41,546 @@ def mod_thin_model_func(t, t0, tau, A, gamma, offset):
     return f_mod_thin(t, t0, tau, A, gamma, offset)
 
 
-thick_model   = Model(thick_model_func)
-mod_thin_model = Model(mod_thin_model_func)
+@lru_cache(maxsize=None)
+def lmfit_models():
+    """lmfit Models of the thick and modified thin screens (lmfit is only imported by the 'lmfit' backend)."""
+    from lmfit import Model
+    return Model(thick_model_func), Model(mod_thin_model_func)
+
+
+# Looser tolerances for fits that start from a previous solution
+WARM_TOL = 1e-6
+# Extra starts of the fast modified thin-screen fit: (t0 shift before the
+# peak in samples, tau factor, gamma), applied to the default guess
+MOD_THIN_STARTS = ((5, 1.0, 1.0), (10, 0.3, 0.5), (20, 1.0, 1.0), (10, 0.3, 1.0))
+
 
+def pulse_window(t, profile):
+    """Pulse window (``argmax - 20`` to the end) and default start values.
 
-def fit_subband_thick(t, profile):
-    """Fit thick-screen model to pulse window."""
+    Computed once per sub-band and shared by both models.
+
+    Returns
+    -------
+    t_pulse, y_pulse : array_like
+        Window times and baseline-subtracted profile.
+    guess : dict
+        Start values for t0, tau, A, gamma and offset, plus the tau upper
+        bound ``max_width``.
+    """
     pulse_start = max(0, np.argmax(profile) - 20)
-    pulse_end = min(len(profile), len(profile))
-    t_pulse = t[pulse_start:pulse_end]
-    y_pulse = profile[pulse_start:pulse_end] - np.min(profile[pulse_start:pulse_end])
+    t_pulse = t[pulse_start:]
+    y_pulse = profile[pulse_start:] - np.min(profile[pulse_start:])
     
-    A0 = y_pulse.max()
-    t0_idx = np.argmax(y_pulse)
-    t0_0 = t_pulse[t0_idx]
-    tau_0 = (t_pulse[-1] - t_pulse[0]) / 10.0
-    max_width = (t_pulse[-1] - t_pulse[0]) * 0.5
+    guess = {
+        't0': t_pulse[np.argmax(y_pulse)],
+        'tau': (t_pulse[-1] - t_pulse[0]) / 10.0,
+        'A': y_pulse.max(),
+        'gamma': 0.1,
+        'offset': np.min(y_pulse),
+        'max_width': (t_pulse[-1] - t_pulse[0]) * 0.5,
+    }
+    return t_pulse, y_pulse, guess
+
+
+def _start_values(guess, seed):
+    """Merge a warm-start seed into the default guess, keeping tau/gamma in bounds."""
+    start = dict(guess)
+    if seed:
+        start.update({k: v for k, v in seed.items() if k in start and v is not None and np.isfinite(v)})
+        start['tau'] = min(max(start['tau'], 1e-6 * guess['max_width']), guess['max_width'])
+        start['gamma'] = min(max(start['gamma'], 0.0), 2.0)
+    return start
+
+
+def fit_subband_thick(t, profile, window=None, seed=None):
+    """Fit thick-screen model to pulse window.
+
+    ``window`` is a precomputed ``pulse_window(t, profile)``; ``seed`` is a
+    dict of start values (e.g. the previous sub-band's solution) that also
+    loosens the convergence tolerances.
+    """
+    t_pulse, y_pulse, guess = window if window is not None else pulse_window(t, profile)
+    start = _start_values(guess, seed)
+    thick_model, _ = lmfit_models()
     
-    params = thick_model.make_params(t0=t0_0, tau=tau_0, A=A0, offset=0.0)
-    params['tau'].min, params['tau'].max = 0.0, max_width
+    params = thick_model.make_params(t0=start['t0'], tau=start['tau'], A=start['A'], offset=0.0)
+    params['tau'].min, params['tau'].max = 0.0, guess['max_width']
     params['A'].min = 0.0
     params['t0'].min, params['t0'].max = t_pulse[0], t_pulse[-1]
-    params['offset'].value = np.min(y_pulse) 
+    params['offset'].value = start['offset'] 
     
-    result = thick_model.fit(y_pulse, params, t=t_pulse)
+    fit_kws = {'xtol': WARM_TOL, 'ftol': WARM_TOL} if seed else None
+    result = thick_model.fit(y_pulse, params, t=t_pulse, fit_kws=fit_kws)
     return result, t_pulse, y_pulse
 
 
-def fit_subband_mod_thin(t, profile):
-    """Fit modified thin-screen model to pulse window."""
-    pulse_start = max(0, np.argmax(profile) - 20)
-    pulse_end = min(len(profile), len(profile))
-    t_pulse = t[pulse_start:pulse_end]
-    y_pulse = profile[pulse_start:pulse_end] - np.min(profile[pulse_start:pulse_end])
-    
-    A0 = y_pulse.max()
-    t0_idx = np.argmax(y_pulse)
-    t0_0 = t_pulse[t0_idx]
-    tau_0 = (t_pulse[-1] - t_pulse[0]) / 10.0
-    gamma_0 = 0.1
-    max_width = (t_pulse[-1] - t_pulse[0]) * 0.5
+def fit_subband_mod_thin(t, profile, window=None, seed=None):
+    """Fit modified thin-screen model to pulse window.
+
+    See ``fit_subband_thick`` for ``window`` and ``seed``.
+    """
+    t_pulse, y_pulse, guess = window if window is not None else pulse_window(t, profile)
+    start = _start_values(guess, seed)
+    _, mod_thin_model = lmfit_models()
     
-    params = mod_thin_model.make_params(t0=t0_0, tau=tau_0, A=A0, gamma=gamma_0, offset=0.0)
-    params['tau'].min, params['tau'].max = 0.0, max_width
+    params = mod_thin_model.make_params(t0=start['t0'], tau=start['tau'], A=start['A'], gamma=start['gamma'], offset=0.0)
+    params['tau'].min, params['tau'].max = 0.0, guess['max_width']
     params['A'].min = 0.0
     params['gamma'].min, params['gamma'].max = 0.0, 2.0
     # params['gamma'].value = 0.25
     # params['gamma'].vary = False  
     params['t0'].min, params['t0'].max = t_pulse[0], t_pulse[-1]
-    params['offset'].value = np.min(y_pulse) 
+    params['offset'].value = start['offset'] 
     
-    result = mod_thin_model.fit(y_pulse, params, t=t_pulse)
+    fit_kws = {'xtol': WARM_TOL, 'ftol': WARM_TOL} if seed else None
+    result = mod_thin_model.fit(y_pulse, params, t=t_pulse, fit_kws=fit_kws)
     return result, t_pulse, y_pulse
 
 
-def _load_psrchive(fname, dm):
-    """Load data from a PSRCHIVE file."""
-    archive = psrchive.Archive_load(fname)
-    archive.pscrunch()
-    archive.set_dispersion_measure(dm)
-    archive.dedisperse()
-    archive.set_dedispersed(True)
-    archive.tscrunch()
-    weights = archive.get_weights().squeeze()
-    waterfall = np.ma.masked_array(archive.get_data().squeeze())
-    waterfall[weights == 0] = np.ma.masked
-    f_channels = np.array([
-        archive.get_first_Integration().get_centre_frequency(i)
-        for i in range(archive.get_nchan())])
-    t_res = archive.get_first_Integration().get_duration() / archive.get_nbin()
-
-    if archive.get_bandwidth() < 0:
-        waterfall = np.flipud(waterfall)
-        f_channels = f_channels[::-1]
+def fit_subband_thick_fast(t, profile, window=None, seed=None):
+    """Fit thick-screen model to pulse window (analytic-Jacobian backend)."""
+    t_pulse, y_pulse, guess = window if window is not None else pulse_window(t, profile)
+    start = _start_values(guess, seed)
+    
+    x0 = [start['t0'], start['tau'], start['A'], start['offset']]
+    lower = [t_pulse[0], 0.0, 0.0, -np.inf]
+    upper = [t_pulse[-1], guess['max_width'], np.inf, np.inf]
+    
+    fit_kws = {'xtol': WARM_TOL, 'ftol': WARM_TOL} if seed else {}
+    result = scatterfit.fit_model('thick', t_pulse, y_pulse, x0, lower, upper, **fit_kws)
+    return result, t_pulse, y_pulse
 
-    return waterfall, f_channels, t_res
 
+def fit_subband_mod_thin_fast(t, profile, window=None, seed=None):
+    """Fit modified thin-screen model to pulse window (analytic-Jacobian backend).
 
-def main():
-    # debug_ar = '/mnt/ucc4_data2/data/filterbanks/Crab/2026-02-02/transientx_output/Crab_61073.8131828382_cfbf00000_01_01.ar'
-    debug_ar = '../DM_calc/Crab_uncorrected.ar'
-    ar = debug_ar 
-    waterfall, f_channels, t_res = _load_psrchive(ar, 56.711)
-    
-    verbose = True
+    Besides the (seeded) start, the fit is restarted from ``MOD_THIN_STARTS``
+    and the lowest chi-square kept: started only with t0 at the peak, the
+    fit (like lmfit's) often stops in a local minimum.
+    """
+    t_pulse, y_pulse, guess = window if window is not None else pulse_window(t, profile)
+    start = _start_values(guess, seed)
+    dt = t_pulse[1] - t_pulse[0] if t_pulse.size > 1 else 0.0
     
-    # supress RuntimeWarning: divide by zero encountered in true_divide
-    np.seterr(divide='ignore', invalid='ignore')
+    starts = [[start['t0'], start['tau'], start['A'], start['gamma'], start['offset']]]
+    if seed:
+        starts.append([guess['t0'], guess['tau'], guess['A'], guess['gamma'], guess['offset']])
+    starts += [[max(t_pulse[0], guess['t0'] - shift * dt), guess['tau'] * tau_factor, guess['A'], gamma, guess['offset']]
+               for shift, tau_factor, gamma in MOD_THIN_STARTS]
+    lower = [t_pulse[0], 0.0, 0.0, 0.0, -np.inf]
+    upper = [t_pulse[-1], guess['max_width'], np.inf, 2.0, np.inf]
     
-    print(f"Waterfall shape: {waterfall.shape}")
-    print(f"Frequency channels: {f_channels.shape}")
-    print(f"Time resolution: {t_res}")
-    
-    overall_profile = np.mean(waterfall, axis=0) 
-    max_idx = np.argmax(overall_profile)
-    
-    n_subbands = 10
+    fit_kws = {'xtol': WARM_TOL, 'ftol': WARM_TOL} if seed else {}
+    results = [scatterfit.fit_model('mod_thin', t_pulse, y_pulse, x0, lower, upper, **fit_kws) for x0 in starts]
+    result = min(results, key=lambda r: r.chisqr)
+    result.nfev = sum(r.nfev for r in results)
+    return result, t_pulse, y_pulse
+
+
+def _load_psrchive(fname, dm, with_meta=False):
+    """Load data from a PSRCHIVE file (via the cached, NumPy-dedispersed waterfall)."""
+    return arcache.load_waterfall(fname, dm, with_meta=with_meta)
+
+
+def split_subbands(waterfall, f_channels, n_subbands=10):
+    """Average a waterfall into ``n_subbands`` frequency sub-band profiles.
+
+    Returns
+    -------
+    profiles : list of array_like
+        Mean profile of every sub-band.
+    f_centres : array_like
+        Centre frequency of every sub-band, in MHz.
+    """
     subband_size = len(f_channels) // n_subbands
-    subbands = []
-    for i in range(n_subbands): 
+    profiles = []; f_centres = []
+    for i in range(n_subbands):
         strt_idx = i * subband_size
         end_idx = (i + 1) * subband_size if i < n_subbands - 1 else len(f_channels)
-        subband_array = waterfall[strt_idx:end_idx, :] 
-        subbands.append(subband_array)
-        
-        if verbose: 
-            print(f"Frequency range for sub-band {i}: {f_channels[strt_idx]:.2f} MHz - {f_channels[end_idx-1]:.2f} MHz")
-            print(f"Sub-band {i} shape: {subband_array.shape}")
-    
-    colors = plt.cm.cool(np.linspace(0, 1, len(f_channels)))
+        profiles.append(np.asarray(np.mean(waterfall[strt_idx:end_idx, :], axis=0)))
+        f_centres.append(f_channels[i*subband_size + subband_size//2])
+    return profiles, np.array(f_centres)
+
+
+def _load_subbands(task):
+    """Worker: load an archive and return its sub-band profiles.
+
+    Channels zapped by ``rfi_mask`` (an ``rfimask.RFIMask``) are masked
+    on top of the archive's zero weights before averaging. An archive that
+    cannot be read is reported and returned with ``profiles`` None.
+    ``cached`` tells the parent whether the archive cache was hit, since
+    the counters of workers do not reach its stage report.
+    """
+    ar, dm, n_subbands, rfi_mask = task
+    try:
+        waterfall, f_channels, t_res, meta = _load_psrchive(ar, dm, with_meta=True)
+        if rfi_mask is not None:
+            waterfall[~rfi_mask.resample(f_channels)] = np.ma.masked
+        profiles, f_centres = split_subbands(waterfall, f_channels, n_subbands)
+    except Exception as e:
+        print(f"Failed to load {ar}: {e}")
+        return ar, None, None, None, None
+    return ar, profiles, f_centres, t_res, meta['cached']
+
+
+FIT_FUNCS = {
+    'lmfit': {'thick': fit_subband_thick, 'mod_thin': fit_subband_mod_thin},
+    'fast': {'thick': fit_subband_thick_fast, 'mod_thin': fit_subband_mod_thin_fast},
+}
+RESULT_COLUMNS = ['archive', 'subband', 'freq_mhz', 'model', 'tau', 'tau_err', 'aic', 'redchi',
+                  't0', 'A', 'gamma', 'offset', 'nfev', 'seed', 'best']
+
+# Expected tau ~ f**-4 scaling used to carry a solution to the next sub-band
+SEED_ALPHA = 4.0
+
+
+def _result_row(ar, i, f_centre, model, result, seed_source):
+    params = result.params
+    return {
+        'archive': ar, 'subband': i, 'freq_mhz': f_centre, 'model': model,
+        'tau': params['tau'].value, 'tau_err': params['tau'].stderr,
+        'aic': result.aic, 'redchi': result.redchi,
+        't0': params['t0'].value, 'A': params['A'].value,
+        'gamma': params['gamma'].value if 'gamma' in params else np.nan,
+        'offset': params['offset'].value, 'nfev': result.nfev,
+        'seed': seed_source, 'best': False,
+    }
+
+
+def _fit_task(task):
+    """Worker: fit one (archive, sub-band, model) combination from scratch."""
+    ar, i, f_centre, t_res, profile, model, backend = task
+    x_vals = np.arange(len(profile)) * t_res
+    np.seterr(divide='ignore', invalid='ignore')
+    try:
+        result, _, _ = FIT_FUNCS[backend][model](x_vals, profile)
+    except Exception as e:
+        print(f"Fit failed for {ar} sub-band {i} ({model}): {e}")
+        return None
+    return _result_row(ar, i, f_centre, model, result, 'guess')
+
+
+def _carry_seed(row, f_from, f_to):
+    """Start values for a sub-band at ``f_to`` from a solution at ``f_from``."""
+    return {'tau': row['tau'] * (f_to / f_from)**-SEED_ALPHA, 'gamma': row['gamma']}
+
+
+def _fit_archive_task(task):
+    """Worker: fit all sub-bands and models of one archive with warm starts.
+
+    Sub-bands are fitted from the highest frequency down; each fit starts
+    from the previous sub-band's solution of the same model (or from the
+    seed cache for the first one), and the pulse window is shared by both
+    models.
+    """
+    ar, profiles, f_centres, t_res, models, backend, cache = task
+    np.seterr(divide='ignore', invalid='ignore')
+    rows = []
+    previous = {}
+    for i in np.argsort(f_centres)[::-1]:
+        x_vals = np.arange(len(profiles[i])) * t_res
+        window = pulse_window(x_vals, profiles[i])
+        for model in models:
+            if model in previous:
+                seed = _carry_seed(previous[model], previous[model]['freq_mhz'], f_centres[i])
+                seed_source = 'previous'
+            else:
+                seed = cached_seed(cache, model, f_centres[i])
+                seed_source = 'cache' if seed else 'guess'
+            try:
+                result, _, _ = FIT_FUNCS[backend][model](x_vals, profiles[i], window=window, seed=seed)
+            except Exception as e:
+                print(f"Fit failed for {ar} sub-band {i} ({model}): {e}")
+                continue
+            row = _result_row(ar, int(i), f_centres[i], model, result, seed_source)
+            if getattr(result, 'success', True):
+                previous[model] = row
+            rows.append(row)
+    return sorted(rows, key=lambda row: (row['subband'], models.index(row['model'])))
+
+
+def load_seed_cache(fname):
+    """Load per-model, per-frequency tau/gamma seeds from an earlier run."""
+    if fname is None or not os.path.exists(fname):
+        return {}
+    with open(fname) as f:
+        return json.load(f)
+
+
+def cached_seed(cache, model, f_centre):
+    """Seed for ``model`` at ``f_centre`` from the nearest cached frequency."""
+    entries = cache.get(model)
+    if not entries:
+        return None
+    freqs = np.array([float(f) for f in entries])
+    nearest = freqs[np.argmin(np.abs(freqs - f_centre))]
+    entry = entries[f'{nearest:.1f}']
+    return _carry_seed(entry, nearest, f_centre)
+
+
+def update_seed_cache(fname, rows):
+    """Store the median best-fit tau/gamma per model and sub-band frequency."""
+    cache = load_seed_cache(fname)
+    grouped = {}
+    for row in rows:
+        if row['best']:
+            grouped.setdefault((row['model'], f"{row['freq_mhz']:.1f}"), []).append(row)
+    for (model, freq), group in grouped.items():
+        gammas = [r['gamma'] for r in group if np.isfinite(r['gamma'])]
+        cache.setdefault(model, {})[freq] = {
+            'tau': float(np.median([r['tau'] for r in group])),
+            'gamma': float(np.median(gammas)) if gammas else None,
+        }
+    with open(fname, 'w') as f:
+        json.dump(cache, f, indent=1)
+
+
+def choose_models(rows):
+    """Flag the lowest-AIC model of every (archive, sub-band)."""
+    best = {}
+    for row in rows:
+        key = (row['archive'], row['subband'])
+        if key not in best or row['aic'] < best[key]['aic']:
+            best[key] = row
+    for row in best.values():
+        row['best'] = True
+    return rows
+
+
+def _joint_task(task):
+    """Worker: joint power-law fit of all sub-bands of one archive."""
+    ar, profiles, f_centres, t_res, seeds, model = task
+    names = scatterfit.PARAM_NAMES[model]
+    windows = []; x0 = []; freqs = []
+    for i, profile in enumerate(profiles):
+        if i not in seeds:
+            continue
+        t_pulse, y_pulse, _ = pulse_window(np.arange(len(profile)) * t_res, profile)
+        windows.append((t_pulse, y_pulse))
+        x0.append([seeds[i][name] for name in names])
+        freqs.append(f_centres[i])
+    if len(windows) < 2:
+        return None
+    try:
+        joint = scatterfit.fit_joint(model, windows, freqs, x0)
+    except Exception as e:
+        print(f"Joint fit failed for {ar} ({model}): {e}")
+        return None
+    return {key: joint[key] for key in JOINT_COLUMNS[2:]} | {'archive': ar, 'model': model}
+
+
+JOINT_COLUMNS = ['archive', 'model', 'tau_ref', 'tau_ref_err', 'alpha', 'alpha_err', 'f_ref', 'aic', 'redchi', 'nfev']
+
+
+def fit_joint_archives(rows, subbands, model='mod_thin', n_jobs=None):
+    """Joint tau(f) power-law fit per archive, seeded from the per-band fits.
+
+    Returns one row per archive with tau at the reference frequency and the
+    scattering index alpha (tau ~ f**-alpha).
+    """
+    tasks = []
+    for ar, (profiles, f_centres, t_res) in subbands.items():
+        seeds = {row['subband']: row for row in rows if row['archive'] == ar and row['model'] == model}
+        tasks.append((ar, profiles, f_centres, t_res, seeds, model))
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        joint_rows = [row for row in pool.map(_joint_task, tasks) if row is not None]
+    stagereport.count('joint_fits_run', len(joint_rows))
+    stagereport.count('joint_fit_evals', sum(row['nfev'] for row in joint_rows))
+    return joint_rows
+
+
+def fit_archives(archives, dm, n_subbands=10, models=('thick', 'mod_thin'), n_jobs=None, backend='fast',
+                 warm=True, cache=None, rfi_mask=None):
+    """Fit every (archive x sub-band x model) combination over a process pool.
+
+    With ``warm`` (default) each archive is one task whose sub-band fits are
+    seeded from the neighbouring sub-band (and ``cache`` for the first);
+    otherwise every (archive, sub-band, model) fit is an independent task
+    started from the default guess. ``rfi_mask`` (an ``rfimask.RFIMask``)
+    zaps the same channels in every archive.
+
+    Returns
+    -------
+    rows : list of dict
+        One row per fit, with the lowest-AIC model per sub-band flagged
+        ``best``.
+    subbands : dict
+        Sub-band profiles, centre frequencies and time resolution per archive,
+        kept for (optional) plotting.
+    """
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        subbands = {}
+        with stagereport.stage('load_archives'):
+            cache_hits = 0
+            for ar, profiles, f_centres, t_res, cached in pool.map(_load_subbands, [(ar, dm, n_subbands, rfi_mask) for ar in archives]):
+                if profiles is not None:
+                    subbands[ar] = (profiles, f_centres, t_res)
+                    cache_hits += cached
+        stagereport.count('archives_read', len(subbands))
+        stagereport.count('archive_cache_hits', cache_hits)
+        stagereport.count('psrchive_reads', len(subbands) - cache_hits)
+        stagereport.count('archives_failed', len(archives) - len(subbands))
+        if len(subbands) < len(archives):
+            print(f"Skipped {len(archives) - len(subbands)} of {len(archives)} archives that could not be loaded")
+
+        with stagereport.stage('fit_subbands'):
+            if warm:
+                tasks = [(ar, profiles, f_centres, t_res, list(models), backend, cache or {})
+                         for ar, (profiles, f_centres, t_res) in subbands.items()]
+                rows = [row for rows in pool.map(_fit_archive_task, tasks) for row in rows]
+            else:
+                tasks = [(ar, i, f_centres[i], t_res, profile, model, backend)
+                         for ar, (profiles, f_centres, t_res) in subbands.items()
+                         for i, profile in enumerate(profiles)
+                         for model in models]
+                rows = [row for row in pool.map(_fit_task, tasks, chunksize=max(1, len(tasks) // (4 * (n_jobs or os.cpu_count() or 1)))) if row is not None]
+
+    # fits run in the workers, so their counters are taken from the result rows
+    stagereport.count('fits_run', len(rows))
+    stagereport.count('fits_failed', sum(len(p) for p, _, _ in subbands.values()) * len(models) - len(rows))
+    stagereport.count('fit_evals', sum(row['nfev'] for row in rows))
+    return choose_models(rows), subbands
+
+
+def write_results(rows, fname, columns=RESULT_COLUMNS):
+    """Write fit results to a CSV table."""
+    with open(fname, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    print(f"Saved {len(rows)} fit results to {fname}")
+
+
+def model_curve(row, t):
+    """Evaluate the fitted model of a result row."""
+    if row['model'] == 'thick':
+        return thick_model_func(t, row['t0'], row['tau'], row['A'], row['offset'])
+    return mod_thin_model_func(t, row['t0'], row['tau'], row['A'], row['gamma'], row['offset'])
+
+
+def plot_fits(ar, profiles, f_centres, t_res, rows):
+    """Plot the sub-band profiles of an archive with their best-fit models."""
+    plt = plotting.pyplot()
+
+    best = {row['subband']: row for row in rows if row['archive'] == ar and row['best']}
+    overall_profile = np.mean(profiles, axis=0)
+
+    colors = plt.cm.cool(np.linspace(0, 1, len(profiles)))
     fig, (ax1, ax2) = plt.subplots(
         2, 1, sharex=True, gridspec_kw={'height_ratios': [2, 20]},
         figsize=(4, 10), constrained_layout=True, squeeze=True
     )
-    
-    t_full = np.arange(waterfall.shape[1]) * t_res
+
+    t_full = np.arange(len(overall_profile)) * t_res
     ax1.plot(t_full, overall_profile, color='black')
     ax1.set_ylabel('Intensity')
-    
-    for i, subband in enumerate(subbands[:]):
+
+    t_pulse = t_full
+    for i, avg_spectrum in enumerate(profiles):
         y_shift = i * 1.6 * overall_profile.max()  # Shift each sub-band up for visibility
-        
-        avg_spectrum = np.mean(subband, axis=0) 
-        max_idx = np.argmax(avg_spectrum) 
         x_vals = np.arange(len(avg_spectrum)) * t_res
-        # x_vals -= x_vals[max_idx]
-
-        result_thick, t_pulse_thick, _ = fit_subband_thick(x_vals, avg_spectrum)
-        result_modthin, t_pulse_modthin, _ = fit_subband_mod_thin(x_vals, avg_spectrum)
-        
-        if result_thick.aic < result_modthin.aic:
-            best_y, t_pulse = result_thick.best_fit, t_pulse_thick
-            tau_value = result_thick.params['tau'].value           # Best-fit τ
-            tau_uncertainty = result_thick.params['tau'].stderr    # 1σ
-            fit_report = result_thick.fit_report()
-        else:
-            best_y, t_pulse = result_modthin.best_fit, t_pulse_modthin
-            tau_value = result_modthin.params['tau'].value           # Best-fit τ
-            tau_uncertainty = result_modthin.params['tau'].stderr    # 1σ
-            fit_report = result_modthin.fit_report()
-        
-        print('\nFrequency: {:.2f} MHz'.format(f_channels[i*subband_size + subband_size//2]))
-        print(fit_report)
-        # print(f"τ = {tau_value*1e3:.2f} ± {tau_uncertainty*1e3:.2f} ms, reduced χ² = {reduced_chi2:.2f} for sub-band {i} ({f_channels[i*subband_size + subband_size//2]:.2f} MHz)")
-        
-
-        ax2.scatter(x_vals, avg_spectrum + y_shift, s=5, 
-                color=colors[i*subband_size + subband_size//2],
-                label=f'{f_channels[i*subband_size + subband_size//2]:.2f} MHz')
-    
 
+        ax2.scatter(x_vals, avg_spectrum + y_shift, s=5, color=colors[i], label=f'{f_centres[i]:.2f} MHz')
         ax2.axhline(y_shift, color='gray', ls='--', lw=0.5)
-        ax2.plot(t_pulse, (best_y - best_y.min()) + y_shift, '-', lw=1.5,
-                color='k')
+
+        if i not in best:
+            continue
+        row = best[i]
+        t_pulse = x_vals[max(0, np.argmax(avg_spectrum) - 20):]
+        best_y = model_curve(row, t_pulse)
+        tau_err = row['tau_err'] if row['tau_err'] is not None else np.nan
+        ax2.plot(t_pulse, (best_y - best_y.min()) + y_shift, '-', lw=1.5, color='k')
         half_time = 0.17
-        ax2.text(half_time, y_shift + 0.8, f"{f_channels[i*subband_size + subband_size//2]:.1f} MHz, $\\tau$={tau_value*1e3:.2f} $\pm$ {tau_uncertainty*1e3:.2f} ms", fontsize=8, color='k', va='bottom')
-        
-   
-    
+        ax2.text(half_time, y_shift + 0.8, f"{f_centres[i]:.1f} MHz, $\\tau$={row['tau']*1e3:.2f} $\\pm$ {tau_err*1e3:.2f} ms", fontsize=8, color='k', va='bottom')
+
     ax1.set_xlim(t_pulse.min(), t_pulse.max())
     ax2.set_xlabel('Time [s]')
-    
+
     plt.setp(ax1.get_yticklabels(), visible=False)
     plt.setp(ax2.get_yticklabels(), visible=False)
-    
-    handles, labels = ax2.get_legend_handles_labels()
 
-    # ax2.legend(handles[::-1], labels[::-1], bbox_to_anchor=(1.05, 1), loc='upper left')
-    
     path_basename = ar.split('/')[-1].replace('.ar', '')
     plt.savefig(f'{path_basename}_fit.png', dpi=200)
     plt.savefig(f'{path_basename}_fit.pdf')
+    plt.close(fig)
+
+
+def fetch_args():
+    '''
+    Fetches the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description='Fit scattering models to Crab giant pulse archives.')
+    parser.add_argument('-i', '--input', type=str, nargs='+', help='Archive(s) or directory(s) of .ar files', default=['../DM_calc/Crab_uncorrected.ar'])
+    parser.add_argument('-dm', '--dm', type=float, help='DM to dedisperse to (default = 56.711)', default=56.711)
+    parser.add_argument('-n', '--nsub', type=int, help='Number of frequency sub-bands (default = 10)', default=10)
+    parser.add_argument('-j', '--jobs', type=int, help='Number of worker processes (default = all cores)', required=False)
+    parser.add_argument('-o', '--output', type=str, help='Output results table (default = scattering_fits.csv)', default='scattering_fits.csv')
+    parser.add_argument('--backend', type=str, choices=sorted(FIT_FUNCS), help='Fitting backend (default = fast)', default='fast')
+    parser.add_argument('--cold', help='Start every sub-band fit from the default guess instead of warm-starting (default = False)', required=False, action='store_true')
+    parser.add_argument('--seed-cache', type=str, help='JSON file of tau/gamma seeds from earlier runs, updated after fitting', required=False)
+    parser.add_argument('--joint', help='Also fit tau(f) as a power law across sub-bands per archive (default = False)', required=False, action='store_true')
+    parser.add_argument('--rfi-mask', type=str, help='Filterbank whose cached RFI mask (rfimask.py) is applied to every archive', required=False)
+    parser.add_argument('--plot', help='Plot the best fits of every archive once fitting is done (default = False)', required=False, action='store_true')
+    parser.add_argument('--no-plot', help='Never plot, even with --plot (default = False)', required=False, action='store_true')
+    stagereport.add_arguments(parser)
+
+    return parser.parse_args()
+
+
+def find_archives(inputs):
+    """Expand directories into the .ar files they contain."""
+    archives = []
+    for path in inputs:
+        if os.path.isdir(path):
+            archives.extend(sorted(glob.glob(os.path.join(path, '**', '*.ar'), recursive=True)))
+        else:
+            archives.append(path)
+    return archives
+
+
+def fit_and_report(args):
+    if args.no_plot:
+        plotting.disable()
+    stagereport.lap('fit')
+    archives = find_archives(args.input)
+    print(f"Fitting {len(archives)} archive(s) x {args.nsub} sub-bands x {len(FIT_FUNCS[args.backend])} models")
+
+    cache = load_seed_cache(args.seed_cache)
+    rows, subbands = fit_archives(archives, args.dm, n_subbands=args.nsub, n_jobs=args.jobs, backend=args.backend,
+                                  warm=not args.cold, cache=cache,
+                                  rfi_mask=rfimask.get_mask(args.rfi_mask) if args.rfi_mask else None)
+    stagereport.lap('write')
+    write_results(rows, args.output)
+    print(f"Total function evaluations: {sum(row['nfev'] for row in rows)}")
+    if args.seed_cache:
+        update_seed_cache(args.seed_cache, rows)
+
+    if args.joint:
+        stagereport.lap('joint')
+        joint_rows = fit_joint_archives(rows, subbands, n_jobs=args.jobs)
+        write_results(joint_rows, args.output.replace('.csv', '') + '_joint.csv', columns=JOINT_COLUMNS)
+        for row in joint_rows:
+            print(f"{os.path.basename(row['archive'])}: tau({row['f_ref']:.1f} MHz) = {row['tau_ref']*1e3:.2f} ms, "
+                  f"alpha = {row['alpha']:.2f} +/- {row['alpha_err'] if row['alpha_err'] is not None else np.nan:.2f}")
+
+    for row in rows:
+        if row['best']:
+            tau_err = row['tau_err'] if row['tau_err'] is not None else np.nan
+            print(f"{os.path.basename(row['archive'])} {row['freq_mhz']:.2f} MHz: {row['model']} "
+                  f"tau = {row['tau']*1e3:.2f} +/- {tau_err*1e3:.2f} ms, AIC = {row['aic']:.1f}")
+
+    if args.plot and plotting.enabled():
+        stagereport.lap('plots')
+        for ar, (profiles, f_centres, t_res) in subbands.items():
+            plot_fits(ar, profiles, f_centres, t_res, rows)
+
+
+def main():
+    args = fetch_args()
+    with stagereport.from_args(args, 'modelScattering'):
+        fit_and_report(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,268 @@
+import numpy as np
+from scipy.optimize import least_squares
+
+# Fast least-squares backend for the thick-screen and modified thin-screen
+# scattering models in modelScattering.py. Both models are evaluated with
+# closed-form Jacobians into preallocated buffers, so a fit costs a few tens
+# of model evaluations instead of finite differences over every parameter.
+
+THICK_C = np.pi**2 / 16.0
+
+PARAM_NAMES = {
+    'thick': ('t0', 'tau', 'A', 'offset'),
+    'mod_thin': ('t0', 'tau', 'A', 'gamma', 'offset'),
+}
+
+
+class Param:
+    """Minimal stand-in for an lmfit Parameter (value and 1-sigma error)."""
+
+    def __init__(self, value, stderr=None):
+        self.value = value
+        self.stderr = stderr
+
+
+class FitResult:
+    """Fit summary exposing the lmfit ModelResult attributes used by the scripts."""
+
+    def __init__(self, model, names, x, jac, resid, nfev, best_fit, success=True):
+        n, p = jac.shape
+        chisqr = float(resid @ resid)
+        nfree = max(n - p, 1)
+        try:
+            covar = np.linalg.inv(jac.T @ jac) * (chisqr / nfree)
+            stderr = np.sqrt(np.clip(np.diag(covar), 0.0, None))
+        except np.linalg.LinAlgError:
+            covar, stderr = None, [None] * p
+
+        self.model = model
+        self.params = {name: Param(val, err) for name, val, err in zip(names, x, stderr)}
+        self.covar = covar
+        self.chisqr = chisqr
+        self.redchi = chisqr / nfree
+        self.ndata = n
+        self.nvarys = p
+        self.aic = n * np.log(max(chisqr, 1e-300) / n) + 2 * p
+        self.bic = n * np.log(max(chisqr, 1e-300) / n) + np.log(n) * p
+        self.nfev = nfev
+        self.best_fit = best_fit
+        self.success = success
+
+    def fit_report(self):
+        lines = [f"[[Model]] {self.model} (analytic Jacobian)",
+                 f"    # function evals   = {self.nfev}",
+                 f"    # data points      = {self.ndata}",
+                 f"    # variables        = {self.nvarys}",
+                 f"    chi-square         = {self.chisqr:.8g}",
+                 f"    reduced chi-square = {self.redchi:.8g}",
+                 f"    Akaike info crit   = {self.aic:.8g}",
+                 "[[Variables]]"]
+        for name, par in self.params.items():
+            err = f" +/- {par.stderr:.8g}" if par.stderr is not None else ""
+            lines.append(f"    {name}: {par.value:.8g}{err}")
+        return '\n'.join(lines)
+
+
+class ScatterModel:
+    """Thick or modified thin-screen model with preallocated work buffers.
+
+    ``evaluate`` and ``jacobian`` write into buffers sized for ``t``, so the
+    optimiser does not allocate temporaries on every call. The kernel is
+    zero for t <= t0.
+    """
+
+    def __init__(self, kind, t):
+        self.kind = kind
+        self.names = PARAM_NAMES[kind]
+        self.t = np.ascontiguousarray(t, dtype=float)
+        n = self.t.size
+        self._dt = np.empty(n)
+        self._kernel = np.zeros(n)
+        self._model = np.empty(n)
+        self._jac = np.empty((n, len(self.names)))
+        self._pos = np.empty(n, dtype=bool)
+        self._last = None
+
+    def _kernel_at(self, p):
+        """Evaluate the kernel for parameters ``p`` (cached for the last p)."""
+        key = tuple(p)
+        if key == self._last:
+            return self._kernel
+        np.subtract(self.t, p[0], out=self._dt)
+        np.greater(self._dt, 0.0, out=self._pos)
+        dt = self._dt[self._pos]
+        self._kernel[:] = 0.0
+
+        if self.kind == 'thick':
+            t0, tau, A = p[0], p[1], p[2]
+            self._kernel[self._pos] = np.sqrt(A * np.pi * tau / (4.0 * dt**3)) * np.exp(-THICK_C * tau / dt)
+        else:
+            t0, tau, A, gamma = p[0], p[1], p[2], p[3]
+            self._kernel[self._pos] = A * np.exp(gamma * np.log(dt) - dt / tau)
+        self._last = key
+        return self._kernel
+
+    def evaluate(self, p):
+        kernel = self._kernel_at(p)
+        np.add(kernel, p[-1], out=self._model)
+        return self._model
+
+    def jacobian(self, p):
+        """d model / d parameters, shape (n, nparams), in ``self.names`` order."""
+        kernel = self._kernel_at(p)
+        J = self._jac
+        J[:] = 0.0
+        pos = self._pos
+        dt = self._dt[pos]
+        K = kernel[pos]
+        tau = p[1]
+
+        if self.kind == 'thick':
+            A = p[2]
+            J[pos, 0] = K * (1.5 / dt - THICK_C * tau / dt**2)
+            J[pos, 1] = K * (0.5 / tau - THICK_C / dt)
+            J[pos, 2] = K / (2.0 * A) if A > 0 else 0.0
+        else:
+            A, gamma = p[2], p[3]
+            J[pos, 0] = -K * (gamma / dt - 1.0 / tau)
+            J[pos, 1] = K * dt / tau**2
+            J[pos, 2] = K / A if A > 0 else np.exp(gamma * np.log(dt) - dt / tau)
+            J[pos, 3] = K * np.log(dt)
+        J[:, -1] = 1.0
+        return J
+
+
+def _inside(x0, lower, upper):
+    """Nudge a starting point strictly inside its bounds, as least_squares requires."""
+    span = np.where(np.isfinite(upper - lower), upper - lower, 1.0)
+    eps = 1e-9 * np.maximum(span, 1e-30)
+    return np.clip(x0, lower + eps, upper - eps)
+
+
+def fit_model(kind, t_pulse, y_pulse, x0, lower, upper, **kwargs):
+    """Least-squares fit of one scattering model with an analytic Jacobian.
+
+    Parameters
+    ----------
+    kind : str
+        'thick' or 'mod_thin'.
+    t_pulse, y_pulse : array_like
+        Pulse window and its (baseline-subtracted) profile.
+    x0, lower, upper : array_like
+        Start values and bounds in ``PARAM_NAMES[kind]`` order.
+    **kwargs
+        Passed on to ``scipy.optimize.least_squares`` (e.g. ``xtol``).
+
+    Returns
+    -------
+    result : FitResult
+    """
+    model = ScatterModel(kind, t_pulse)
+    y = np.asarray(y_pulse, dtype=float)
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    x0 = _inside(np.asarray(x0, dtype=float), lower, upper)
+
+    kwargs.setdefault('x_scale', 'jac')
+    sol = least_squares(lambda p: model.evaluate(p) - y, x0, jac=model.jacobian,
+                        bounds=(lower, upper), method='trf', **kwargs)
+    best_fit = model.evaluate(sol.x).copy()
+    return FitResult(kind, model.names, sol.x, sol.jac, sol.fun, sol.nfev, best_fit, sol.success)
+
+
+def fit_joint(kind, windows, freqs, x0, f_ref=None, tau_bounds=(0.0, np.inf), alpha_bounds=(0.0, 10.0), **kwargs):
+    """Joint fit of several sub-bands with tau following a power law in frequency.
+
+    tau_i = tau_ref * (f_i / f_ref)**-alpha, while t0, A, (gamma) and offset
+    are free per sub-band.
+
+    Parameters
+    ----------
+    windows : list of (t_pulse, y_pulse)
+        Pulse window of every sub-band.
+    freqs : array_like
+        Centre frequency of every sub-band, in MHz.
+    x0 : list of array_like
+        Per sub-band start values in ``PARAM_NAMES[kind]`` order; their tau
+        values seed tau_ref and alpha.
+    f_ref : float, optional
+        Reference frequency for tau_ref, defaults to the mean of ``freqs``.
+
+    Returns
+    -------
+    result : dict
+        ``tau_ref``, ``tau_ref_err``, ``alpha``, ``alpha_err``, ``f_ref``,
+        ``per_band`` (list of dicts of the per-band parameters), ``chisqr``,
+        ``redchi``, ``aic`` and ``nfev``.
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    f_ref = float(np.mean(freqs)) if f_ref is None else float(f_ref)
+    log_f = np.log(freqs / f_ref)
+    models = [ScatterModel(kind, t) for t, _ in windows]
+    ys = [np.asarray(y, dtype=float) for _, y in windows]
+    sizes = np.array([y.size for y in ys])
+    edges = np.r_[0, np.cumsum(sizes)]
+    free = [i for i, name in enumerate(PARAM_NAMES[kind]) if name != 'tau']
+    nfree = len(free)
+
+    # starting power law from a straight-line fit of log tau vs log f
+    taus = np.array([max(x[1], 1e-12) for x in x0])
+    if len(taus) > 1 and np.ptp(log_f) > 0:
+        slope, intercept = np.polyfit(log_f, np.log(taus), 1)
+        start = [np.exp(intercept), -slope]
+    else:
+        start = [taus.mean(), 4.0]
+    p0 = np.r_[start, np.concatenate([np.asarray(x, dtype=float)[free] for x in x0])]
+
+    lower = np.r_[tau_bounds[0], alpha_bounds[0], np.tile(-np.inf, nfree * len(windows))]
+    upper = np.r_[tau_bounds[1], alpha_bounds[1], np.tile(np.inf, nfree * len(windows))]
+    for b, (t, _) in enumerate(windows):
+        lower[2 + b * nfree] = t[0]
+        upper[2 + b * nfree] = t[-1]
+        lower[2 + b * nfree + free.index(2)] = 0.0
+        if kind == 'mod_thin':
+            lower[2 + b * nfree + free.index(3)] = 0.0
+            upper[2 + b * nfree + free.index(3)] = 2.0
+    p0 = _inside(p0, lower, upper)
+
+    resid = np.empty(edges[-1])
+    jac = np.zeros((edges[-1], p0.size))
+
+    def band_params(p, b):
+        full = np.empty(len(PARAM_NAMES[kind]))
+        full[free] = p[2 + b * nfree:2 + (b + 1) * nfree]
+        full[1] = p[0] * np.exp(-p[1] * log_f[b])
+        return full
+
+    def fun(p):
+        for b, (model, y) in enumerate(zip(models, ys)):
+            resid[edges[b]:edges[b + 1]] = model.evaluate(band_params(p, b)) - y
+        return resid
+
+    def jacobian(p):
+        jac[:] = 0.0
+        for b, model in enumerate(models):
+            full = band_params(p, b)
+            J = model.jacobian(full)
+            rows = slice(edges[b], edges[b + 1])
+            jac[rows, 0] = J[:, 1] * full[1] / p[0]
+            jac[rows, 1] = -J[:, 1] * full[1] * log_f[b]
+            jac[rows, 2 + b * nfree:2 + (b + 1) * nfree] = J[:, free]
+        return jac
+
+    kwargs.setdefault('x_scale', 'jac')
+    sol = least_squares(fun, p0, jac=jacobian, bounds=(lower, upper), method='trf', **kwargs)
+    summary = FitResult(kind + '_joint', ['tau_ref', 'alpha'] + [f'p{i}' for i in range(p0.size - 2)],
+                        sol.x, sol.jac, sol.fun, sol.nfev, None, sol.success)
+
+    per_band = []
+    for b in range(len(windows)):
+        full = band_params(sol.x, b)
+        per_band.append(dict(zip(PARAM_NAMES[kind], full), freq_mhz=freqs[b]))
+
+    return {
+        'tau_ref': sol.x[0], 'tau_ref_err': summary.params['tau_ref'].stderr,
+        'alpha': sol.x[1], 'alpha_err': summary.params['alpha'].stderr,
+        'f_ref': f_ref, 'per_band': per_band,
+        'chisqr': summary.chisqr, 'redchi': summary.redchi, 'aic': summary.aic, 'nfev': sol.nfev,
+    }
@@ -0,0 +1,194 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+REALTA_CSV = '/mnt/ucc4_data2/data/Owen/software/REALTA-Processing/csv_files/REALTA-Observation-Files.csv'
+CATALOGUE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'REALTA-Catalogue.sqlite')
+
+# Canonical source name -> normalised aliases (lower case, no spaces/underscores)
+ALIASES = {
+    'J0534+2200': ('crab', 'b0531', 'j0534'),
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS observations (
+    id INTEGER PRIMARY KEY,
+    csv TEXT NOT NULL,
+    source_name TEXT,
+    source TEXT,
+    mjd REAL,
+    row TEXT NOT NULL,
+    UNIQUE (csv, row)
+);
+CREATE INDEX IF NOT EXISTS observations_source ON observations (source, mjd);
+CREATE INDEX IF NOT EXISTS observations_mjd ON observations (mjd);
+CREATE TABLE IF NOT EXISTS ingested (
+    csv TEXT PRIMARY KEY,
+    header TEXT NOT NULL,
+    offset INTEGER NOT NULL
+);
+'''
+
+
+def fetch_args():
+    '''
+    Fetches the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description='Ingest and query the REALTA observation catalogue.')
+    parser.add_argument('-i', '--input', type=str, help='REALTA observation CSV', default=REALTA_CSV)
+    parser.add_argument('-d', '--database', type=str, help='Catalogue database', default=CATALOGUE)
+    parser.add_argument('-s', '--source', type=str, help='Source name or alias to query (default = crab)', default='crab')
+    parser.add_argument('--start', type=float, help='Start MJD', required=False)
+    parser.add_argument('--end', type=float, help='End MJD', required=False)
+    parser.add_argument('--rebuild', action='store_true', help='Re-ingest the CSV from scratch')
+    parser.add_argument('-o', '--output', type=str, help='Export the matching observations to this CSV file', required=False)
+
+    return parser.parse_args()
+
+
+def _normalise(name):
+    return ''.join(str(name).split()).replace('_', '').lower()
+
+
+def canonical_source(name):
+    """Canonical name of a source, resolving the aliases in ``ALIASES``.
+
+    Unknown names are returned unchanged (stripped).
+    """
+    norm = _normalise(name)
+    for canonical, aliases in ALIASES.items():
+        if norm.startswith(_normalise(canonical)) or any(alias in norm for alias in aliases):
+            return canonical
+    return str(name).strip()
+
+
+def parse_mjd(value):
+    """MJD as a float, None for header errors and other unparsable entries."""
+    try:
+        mjd = float(value)
+    except (TypeError, ValueError):
+        return None
+    return mjd if np.isfinite(mjd) else None
+
+
+def connect(fname=CATALOGUE):
+    conn = sqlite3.connect(fname)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def ingest(conn, fname=REALTA_CSV, rebuild=False):
+    """Add the rows of the REALTA CSV appended since the last ingest.
+
+    The byte offset reached in each CSV is stored, so a nightly re-run only
+    parses new rows. A changed header or a file shorter than the stored
+    offset triggers a full re-ingest of that CSV.
+
+    Returns
+    -------
+    n : int
+        Number of new rows.
+    """
+    key = os.path.abspath(fname)
+    with open(fname, newline='') as f:
+        header_line = f.readline()
+        header = next(csv.reader([header_line]))
+        state = conn.execute('SELECT header, offset FROM ingested WHERE csv = ?', (key,)).fetchone()
+        size = os.path.getsize(fname)
+        if rebuild or state is None or state[0] != json.dumps(header) or state[1] > size:
+            offset = f.tell()
+            with conn:
+                conn.execute('DELETE FROM observations WHERE csv = ?', (key,))
+        else:
+            offset = state[1]
+        f.seek(offset)
+
+        rows = []
+        for values in csv.reader(iter(f.readline, '')):
+            if not values:
+                continue
+            row = dict(zip(header, values))
+            name = row.get('source_name', '')
+            rows.append((key, name, canonical_source(name), parse_mjd(row.get('time_mjd')), json.dumps(row)))
+        offset = f.tell()
+
+    with conn:
+        before = conn.total_changes
+        conn.executemany('INSERT OR IGNORE INTO observations (csv, source_name, source, mjd, row) VALUES (?, ?, ?, ?, ?)',
+                         rows)
+        added = conn.total_changes - before
+        conn.execute('INSERT OR REPLACE INTO ingested VALUES (?, ?, ?)', (key, json.dumps(header), offset))
+    return added
+
+
+def query(conn, source=None, start=None, end=None, valid_mjd=True):
+    """Observations of a source (any alias) with start <= MJD < end, ordered by MJD.
+
+    Returns
+    -------
+    rows : list of dict
+        The original CSV rows, with ``mjd`` (float or None) and the
+        canonical ``source`` added.
+    """
+    clauses, params = [], []
+    if source is not None:
+        clauses.append('source = ?'); params.append(canonical_source(source))
+    if valid_mjd:
+        clauses.append('mjd IS NOT NULL')
+    if start is not None:
+        clauses.append('mjd >= ?'); params.append(start)
+    if end is not None:
+        clauses.append('mjd < ?'); params.append(end)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+    rows = []
+    for source_, mjd, row in conn.execute(f'SELECT source, mjd, row FROM observations{where} ORDER BY mjd, id', params):
+        row = json.loads(row)
+        row['source'] = source_
+        row['mjd'] = mjd
+        rows.append(row)
+    return rows
+
+
+def query_mjd(conn, source=None, start=None, end=None):
+    """Sorted MJD array of a source's observations."""
+    clauses, params = ['mjd IS NOT NULL'], []
+    if source is not None:
+        clauses.append('source = ?'); params.append(canonical_source(source))
+    if start is not None:
+        clauses.append('mjd >= ?'); params.append(start)
+    if end is not None:
+        clauses.append('mjd < ?'); params.append(end)
+    rows = conn.execute(f"SELECT mjd FROM observations WHERE {' AND '.join(clauses)} ORDER BY mjd", params)
+    return np.array([r[0] for r in rows], dtype=float)
+
+
+def export_csv(rows, fname):
+    """Write queried rows back out with the original CSV columns."""
+    columns = [c for c in rows[0] if c not in ('source', 'mjd')] if rows else []
+    with open(fname, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    args = fetch_args()
+    conn = connect(args.database)
+    print(f"Ingested {ingest(conn, args.input, args.rebuild)} new observations from {args.input}")
+
+    # without an MJD range, rows whose header gave no MJD are kept
+    rows = query(conn, args.source, args.start, args.end, valid_mjd=False)
+    mjds = [row['mjd'] for row in rows if row['mjd'] is not None]
+    print(f"{canonical_source(args.source)}: {len(rows)} observations", end='')
+    print(f" spanning MJD {mjds[0]} to {mjds[-1]}" if mjds else '')
+    if args.output:
+        export_csv(rows, args.output)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
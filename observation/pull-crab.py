@@ -1,23 +1,26 @@
-import pandas as pd
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import obscat
 
 
 def main():
-    obs_df = pd.read_csv('/mnt/ucc4_data2/data/Owen/software/REALTA-Processing/csv_files/REALTA-Observation-Files.csv')
-    print(obs_df.keys())
-    print('Total observations: {}'.format(len(obs_df)))
-    
-    source_names = obs_df['source_name']
-    str1 = 'crab'; str2 = 'B0531'; str3 = 'Crab'
+    conn = obscat.connect()
+    print('New observations ingested: {}'.format(obscat.ingest(conn, obscat.REALTA_CSV)))
+    print('Total observations: {}'.format(conn.execute('SELECT COUNT(*) FROM observations').fetchone()[0]))
     
-    if any(source_names.str.contains(str1)) or any(source_names.str.contains(str2)) or any(source_names.str.contains(str3)):
-        crab_df = obs_df[source_names.str.contains(str1) | source_names.str.contains(str2) | source_names.str.contains(str3)]
-        # print(crab_df)
-        crab_df.to_csv('../REALTA-Crab-Files.csv', index=False)
-        
-    print('Crab observations span from {} to {}'.format(
-        crab_df['time_mjd'].min(), crab_df['time_mjd'].max()
-    ))
-    print('Total Crab observations: {}'.format(len(crab_df)))
+    # Crab aliases (crab/Crab/B0531/J0534+2200) are resolved at ingest;
+    # rows whose header gave no MJD are exported too
+    crab_rows = obscat.query(conn, 'J0534+2200', valid_mjd=False)
+    if crab_rows:
+        obscat.export_csv(crab_rows, '../REALTA-Crab-Files.csv')
+
+        mjds = [row['mjd'] for row in crab_rows if row['mjd'] is not None]
+        if mjds:
+            print('Crab observations span from {} to {}'.format(mjds[0], mjds[-1]))
+    print('Total Crab observations: {}'.format(len(crab_rows)))
+    conn.close()
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,229 @@
+import argparse
+import glob
+import json
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+TEMPLATE = '/mnt/ucc4_data2/data/Owen/software/Crab-Giant-Pulses/lofar.template'
+CANDS_PATTERN = '*fbf00000.cands'
+OUTPUT_DIRNAME = 'transientx_output'
+TRACK_SUFFIX = '_replot.json'
+
+# .cands columns (0-based) read for the selection
+WIDTH_COL, SNR_COL = 4, 5
+# candidates counted by the old genArchives.sh loop against the .ar files: S/N and width (ms) limits
+LEGACY_SNR, LEGACY_WIDTH = 100.0, 45.0
+
+REPLOT_CMD = ['replot_fil', '-v', '-a', '-c', '--template', '{template}', '--widthcutoff', '{widthcutoff}',
+              '--snrcutoff', '{replot_snr}', '--candfile', '{candfile}', '-f', '{fil}']
+
+
+def fetch_args():
+    '''
+    Fetches the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description='Select TransientX candidates and make replot_fil archives of them.')
+    parser.add_argument('obs_dir', type=str, nargs='+', help=f'Observation directory(s) containing {OUTPUT_DIRNAME}/')
+    parser.add_argument('--snr-cutoff', type=float, help='Starting S/N floor, lowered in steps until candidates pass (default = 80)', default=80)
+    parser.add_argument('--step', type=float, help='S/N floor step (default = 10)', default=10)
+    parser.add_argument('--max-width', type=float, help='Width cutoff in ms (default = 60)', default=60)
+    parser.add_argument('--target', type=int, help='Select the N (> 0) highest-S/N candidates instead of the adaptive floor', required=False)
+    parser.add_argument('--template', type=str, help='Folding template for replot_fil', default=TEMPLATE)
+    parser.add_argument('--replot-snr', type=float, help='replot_fil --snrcutoff (default = 100)', default=100)
+    parser.add_argument('-j', '--jobs', type=int, help='replot_fil jobs run at once (default = 4)', default=4)
+    parser.add_argument('--dry-run', action='store_true', help='Only print what would be run')
+
+    return parser.parse_args()
+
+
+def read_cands(cands_file):
+    """Lines of a .cands file and their S/N and width (ms), read once."""
+    with open(cands_file) as f:
+        lines = [line for line in f if line.strip()]
+    if not lines:
+        return lines, np.empty(0), np.empty(0)
+    cols = np.array([line.split() for line in lines], dtype=object)
+    return lines, cols[:, SNR_COL].astype(float), cols[:, WIDTH_COL].astype(float)
+
+
+def select_replot(snr, width, snr_cutoff=80.0, step=10.0, max_width=60.0, target=None):
+    """Indices of the candidates to replot, in one pass over the S/N column.
+
+    With ``target`` the ``target`` highest-S/N candidates narrower than
+    ``max_width`` are taken. Otherwise the S/N floor is the highest of
+    ``snr_cutoff``, ``snr_cutoff - step``, ... (down to 0) that at least one
+    candidate exceeds, as genArchives.sh found by rewriting the file in a
+    loop; it follows from the brightest narrow candidate directly.
+
+    Returns
+    -------
+    idx : array of int
+        Selected candidate indices (file order).
+    floor : float
+        S/N floor used (nan if nothing is selected).
+    """
+    narrow = np.flatnonzero(width < max_width)
+    if narrow.size == 0 or (target is not None and target <= 0):
+        return np.empty(0, dtype=np.int64), np.nan
+    if target is not None:
+        if target < narrow.size:
+            narrow = narrow[np.argpartition(-snr[narrow], target - 1)[:target]]
+        return np.sort(narrow), float(snr[narrow].min())
+
+    best = snr[narrow].max()
+    if best <= 0:
+        return np.empty(0, dtype=np.int64), np.nan
+    # largest floor = snr_cutoff - k * step (k >= 0, floor >= 0) below the brightest candidate
+    k = max(0, int(np.floor((snr_cutoff - best) / step)) + 1)
+    floor = max(snr_cutoff - k * step, 0.0)
+    return narrow[snr[narrow] > floor], floor
+
+
+def track_path(cands_file):
+    return cands_file[:-len('.cands')] + TRACK_SUFFIX
+
+
+def load_done(cands_file):
+    """Candidate indices of ``cands_file`` that already have archives.
+
+    The record is discarded when the .cands file has changed since.
+    """
+    fname = track_path(cands_file)
+    if not os.path.exists(fname):
+        return set()
+    with open(fname) as f:
+        record = json.load(f)
+    st = os.stat(cands_file)
+    if record.get('stamp') != [st.st_size, st.st_mtime]:
+        return set()
+    return set(record.get('done', []))
+
+
+def save_done(cands_file, done):
+    st = os.stat(cands_file)
+    fname = track_path(cands_file)
+    with open(fname + '.tmp', 'w') as f:
+        json.dump({'stamp': [st.st_size, st.st_mtime], 'done': sorted(int(i) for i in done)}, f)
+    os.replace(fname + '.tmp', fname)
+
+
+def legacy_done(lines, snr, width, idx):
+    """Selection of a .cands file already replotted by the old genArchives.sh loop.
+
+    That loop kept no record: it skipped a file once the .ar files in its
+    filterbank's transientx_output/ were at least as many as its S/N > 100,
+    width < 45 ms candidates. Such files get their current selection
+    marked as done; others get an empty set.
+    """
+    fil_dir = os.path.dirname(lines[0].split()[-1]) if lines else ''
+    n_ar = len(glob.glob(os.path.join(fil_dir, OUTPUT_DIRNAME, '**', '*.ar'), recursive=True))
+    n_bright = np.count_nonzero((snr > LEGACY_SNR) & (width < LEGACY_WIDTH))
+    return set(idx.tolist()) if n_ar and n_bright <= n_ar else set()
+
+
+def plan(cands_file, snr_cutoff=80.0, step=10.0, max_width=60.0, target=None, dry_run=False):
+    """Select the candidates of one .cands file that still need archives.
+
+    Writes ``<stem>_filtered.cands`` with the new selection (not with
+    ``dry_run``). Files without a ``_replot.json`` record are checked for
+    archives made by the old genArchives.sh loop (see ``legacy_done``),
+    which seed the record.
+
+    Returns
+    -------
+    job : dict or None
+        ``cands``, ``filtered``, ``fil``, ``idx`` (new indices), ``floor`` and
+        ``nselected``; None when there is nothing (left) to replot.
+    """
+    lines, snr, width = read_cands(cands_file)
+    idx, floor = select_replot(snr, width, snr_cutoff, step, max_width, target)
+    if os.path.exists(track_path(cands_file)):
+        done = load_done(cands_file)
+    else:
+        done = legacy_done(lines, snr, width, idx)
+        if done and not dry_run:
+            save_done(cands_file, done)
+    new = np.array([i for i in idx if i not in done], dtype=np.int64)
+    if new.size == 0:
+        return {'cands': cands_file, 'idx': new, 'floor': floor, 'nselected': idx.size, 'filtered': None, 'fil': None}
+
+    filtered = cands_file[:-len('.cands')] + '_filtered.cands'
+    if not dry_run:
+        with open(filtered + '.tmp', 'w') as f:
+            f.writelines(lines[i] for i in new)
+        os.replace(filtered + '.tmp', filtered)
+    fil = lines[new[0]].split()[-1]
+    return {'cands': cands_file, 'idx': new, 'floor': floor, 'nselected': idx.size, 'filtered': filtered, 'fil': fil}
+
+
+def find_cands(obs_dirs):
+    cands = []
+    for obs_dir in obs_dirs:
+        cands.extend(sorted(glob.glob(os.path.join(obs_dir, OUTPUT_DIRNAME, '**', CANDS_PATTERN), recursive=True)))
+    return cands
+
+
+class Replotter:
+    """Runs replot_fil jobs concurrently and records finished candidates by index."""
+
+    def __init__(self, template=TEMPLATE, max_width=60.0, replot_snr=100.0, dry_run=False):
+        self.template = template
+        self.max_width = max_width
+        self.replot_snr = replot_snr
+        self.dry_run = dry_run
+        self.lock = threading.Lock()
+
+    def command(self, job):
+        # absolute paths: replot_fil runs in the filterbank's directory
+        return [c.format(template=os.path.abspath(self.template), widthcutoff=self.max_width / 1e3, replot_snr=self.replot_snr,
+                         candfile=os.path.abspath(job['filtered']), fil=os.path.abspath(job['fil'])) for c in REPLOT_CMD]
+
+    def run(self, job):
+        cmd = self.command(job)
+        if self.dry_run:
+            print(' '.join(cmd))
+            return job, 0
+        # replot_fil writes its archives to the working directory, next to the filterbank
+        workdir = os.path.dirname(job['fil']) or '.'
+        log = job['filtered'][:-len('.cands')] + '_replot.log'
+        with open(log, 'a') as f:
+            f.write(f"$ {' '.join(cmd)}\n")
+            f.flush()
+            returncode = subprocess.call(cmd, cwd=workdir, stdout=f, stderr=subprocess.STDOUT)
+        if returncode == 0:
+            with self.lock:
+                save_done(job['cands'], load_done(job['cands']) | set(job['idx'].tolist()))
+        return job, returncode
+
+
+def main():
+    args = fetch_args()
+    cands_files = find_cands(args.obs_dir)
+    if not cands_files:
+        print(f"No {CANDS_PATTERN} files found in {', '.join(args.obs_dir)}")
+        raise SystemExit(1)
+
+    jobs = []
+    for cands_file in cands_files:
+        job = plan(cands_file, args.snr_cutoff, args.step, args.max_width, args.target, args.dry_run)
+        print(f"{cands_file}: {job['nselected']} selected (S/N > {job['floor']:.1f}), {job['idx'].size} without archives")
+        if job['idx'].size:
+            jobs.append(job)
+
+    replotter = Replotter(args.template, args.max_width, args.replot_snr, args.dry_run)
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = [pool.submit(replotter.run, job) for job in jobs]
+        for future in as_completed(futures):
+            job, returncode = future.result()
+            failed += returncode != 0
+            print(f"{'done' if returncode == 0 else f'failed ({returncode})'}: {job['filtered']} ({job['idx'].size} candidates)")
+    print(f"{len(jobs)} replot_fil jobs, {failed} failed")
+
+
+if __name__ == "__main__":
+    main()
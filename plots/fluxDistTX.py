@@ -1,9 +1,19 @@
 import argparse 
 import glob 
+import os
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.ticker import LogLocator
-import scienceplots; plt.style.use(['science', 'no-latex'])
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'TransientX'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calibration'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'transientX'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'profiling'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import candstore
+import radiometer
+import rfimask
+import stagereport
+from crabgp import plotting
 
 
 def fetch_args(): 
@@ -13,22 +23,17 @@ def fetch_args():
     parser = argparse.ArgumentParser(description='Single Pulse Analysis Crab Gian Pulses.')
     parser.add_argument('-i', '--input', type=str, help='Input directory', required=True)
     parser.add_argument('-t', '--threshold', type=float, help='Threshold for single pulse detection (default = 0)', required=False)
+    parser.add_argument('--rfi-mask', type=str, help='Filterbank whose cached RFI mask (rfimask.py) removes channels from the radiometer sum', required=False)
+    parser.add_argument('--no-plot', help='Only print the flux densities; matplotlib is not imported (default = False)', required=False, action='store_true')
+    stagereport.add_arguments(parser)
     
     return parser.parse_args()
 
 
 def read_transientx(cands_file):
-    mjd, dm, width, snr, png, ifile = np.loadtxt(cands_file, usecols=(2, 3, 4, 5, 8, 10), unpack=True, dtype=str)
-    mjd = mjd.astype(float); dm = dm.astype(float); width = width.astype(float); snr = snr.astype(float)
-    time = mjd - mjd.min()
+    cands = candstore.parse_cands(cands_file)
     
-    return time, dm, width, snr, png, ifile
-
-def interp_conv_temp(n, freq_mhz, conv_temp_k, fmin=100.0, fmax=190.0):
-    f_new = np.linspace(fmin, fmax, int(n))
-    t_new = np.interp(f_new, freq_mhz, conv_temp_k)
-    return f_new, t_new
-
+    return cands['time'], cands['dm'], cands['width'], cands['snr'], cands['png'], cands['ifile']
 
 def burst_smin(freq, T_sys, A_phys, SNR_limit, W_burst,
                chan_BW, n_p=2, rfi_mask=None):
@@ -43,74 +48,11 @@ def burst_smin(freq, T_sys, A_phys, SNR_limit, W_burst,
     S_min_total = 1.0 / np.sqrt(np.sum(1.0 / S_min_i**2))
     return S_min_total * 1000  # mJy
 
-def main(): 
-    
-    args = fetch_args()
-    
-    if args.threshold is None:
-        args.threshold = 0.0
-    
-    cands_files = glob.glob(f"{args.input}/**/*.cands", recursive=True)
-    print('Number of candidates files:', len(cands_files))
-    
-    base_path = '/'.join(args.input.split('/')[0:-2])
-    
-    # Cat all the candidates
-    time = []; dm = []; width = []; snr = []; png = []; ifile = []
-    
-    for cands_file in cands_files:
-        time_, dm_, width_, snr_, png_, ifile_ = read_transientx(cands_file)
-        
-        time.extend(time_)
-        dm.extend(dm_)
-        width.extend(width_)
-        snr.extend(snr_)
-        png.extend(png_)
-        ifile.extend(ifile_)
-    
-    print(f"Read in {len(time)} candidates from {cands_file}")
-    
-    if args.threshold:
-        mask = snr > args.threshold
-        snr = snr[mask]
-        time = time[mask]
-        width = width[mask]
-        dm = dm[mask]
-        png = png[mask]
-        ifile = ifile[mask]
-        
-    snr = np.array(snr); time = np.array(time); width = np.array(width); dm = np.array(dm); png = np.array(png); ifile = np.array(ifile)
-    print(f"Highest SNR candidate: {snr.max()}; ifile: {ifile[snr.argmax()]}; png: {png[snr.argmax()]}")
-        
-    nchans = 3296
 
-    conv_temp_k = np.array([2278.8,1869.7,1558.3,1315.2,1122.0,965.53,838.23,732.6,644.45,570.1], dtype=float)
-    freq_mhz = np.array([100.0, 110.0, 120.0, 130.0, 140.0, 150.0, 160.0, 170.0, 180.0, 190.0], dtype=float)
-    A_phys = np.array([2400, 2048, 1422, 1152])
-    A_phys_freq = np.array([100.0, 120.0, 150.0, 180.0], dtype=float)
-    
-    f_new, t_new = interp_conv_temp(nchans, freq_mhz, conv_temp_k)
-    A_phys_interp = np.interp(f_new, A_phys_freq, A_phys)
-    
-    # convert width and snr to np.arrays
-    width = np.array(width)
-    snr = np.array(snr)
-    fluxes = []
-    
-    for w, s in zip(width, snr):
-        S_min = burst_smin(f_new, t_new, A_phys_interp, s, w*1e-3, chan_BW=0.2)
-        fluxes.append(S_min)
-    fluxes = np.array(fluxes)
-    
-    # plot a flux distribution
-    fluxes_jy = fluxes * 1e-3
-
-    # Define logarithmically spaced bins
-    bins = np.logspace(
-        np.log10(fluxes_jy.min()),
-        np.log10(fluxes_jy.max()),
-        50
-    )
+def plot_flux_distribution(fluxes):
+    """Histogram of the burst flux densities (mJy) on log-spaced bins, saved to flux_distribution.png."""
+    plt = plotting.pyplot()
+    from matplotlib.ticker import LogLocator
 
     fluxes_jy = fluxes * 1e-3
     fluxes_jy = fluxes_jy[fluxes_jy > 0]
@@ -152,5 +94,66 @@ def main():
     plt.ylabel('Number of Bursts')
     plt.tight_layout()
     plt.savefig('flux_distribution.png')
+
+
+def flux_distribution(args):
+    
+    if args.no_plot:
+        plotting.disable()
+    if args.threshold is None:
+        args.threshold = 0.0
+    
+    stagereport.lap('load')
+    cands_files = glob.glob(f"{args.input}/**/*.cands", recursive=True)
+    print('Number of candidates files:', len(cands_files))
+    
+    base_path = '/'.join(args.input.split('/')[0:-2])
+    
+    # Load all the candidates from the columnar store (only new/changed .cands are parsed)
+    cands = candstore.load_candidates([args.input])
+    
+    print(f"Read in {len(cands)} candidates from {len(cands_files)} candidates files")
+    stagereport.count('cands_files', len(cands_files))
+    stagereport.count('candidates_read', len(cands))
+    
+    snr = np.asarray(cands['snr']); time = np.asarray(cands['time']); width = np.asarray(cands['width'])
+    dm = np.asarray(cands['dm']); png = np.asarray(cands['png']); ifile = np.asarray(cands['ifile'])
+    
+    if args.threshold:
+        mask = snr > args.threshold
+        snr = snr[mask]
+        time = time[mask]
+        width = width[mask]
+        dm = dm[mask]
+        png = png[mask]
+        ifile = ifile[mask]
+        
+    print(f"Highest SNR candidate: {snr.max()}; ifile: {ifile[snr.argmax()]}; png: {png[snr.argmax()]}")
+        
+    stagereport.count('candidates_kept', snr.size)
+    stagereport.lap('flux')
+    # Flux densities from the cached HBA T_sys/A_eff channel grid
+    rfi_mask = None
+    if args.rfi_mask:
+        grid = radiometer.channel_grid('HBA', nchan=3296, fmin=100.0, fmax=190.0)
+        rfi_mask = rfimask.get_mask(args.rfi_mask).resample(grid['freq'])
+        print(f"RFI mask keeps {rfi_mask.sum()}/{rfi_mask.size} channels")
+    fluxes = radiometer.flux_from_snr(width*1e-3, snr, band='HBA', nchan=3296, fmin=100.0, fmax=190.0, chan_bw=0.2,
+                                      rfi_mask=rfi_mask)
+    
+    fluxes_jy = fluxes * 1e-3
+    print(f"Median S_min: {np.median(fluxes_jy):.3f} Jy, Max S_min: {fluxes_jy.max():.3f} Jy")
+
+    # plot a flux distribution
+    if plotting.enabled():
+        stagereport.lap('plots')
+        plot_flux_distribution(fluxes)
+
+
+def main():
+    args = fetch_args()
+    with stagereport.from_args(args, 'fluxDistTX'):
+        flux_distribution(args)
+
         
 if __name__ == "__main__":    main()
\ No newline at end of file
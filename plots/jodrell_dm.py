@@ -1,29 +1,67 @@
+import argparse
+import os
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import scienceplots; plt.style.use(['science','no-latex'])
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'DM_calc'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import dmdb
+from crabgp import plotting
 
-data = np.genfromtxt("JB_dms.txt", dtype=str)
-dates = np.array(data[:, 0], dtype="datetime64[D]")
-dm = data[:, 1].astype(float)
+DM_DB = "dm_timeseries.sqlite"
 
-plt.figure(figsize=(9, 3))
-plt.step(dates, dm, where="post",
-         label="Jodrell Bank Ephemeris", color='k')
 
-# plt.xlabel("Date")
-plt.ylabel("DM [pc cm$^{-3}$]")
+def fetch_args():
+    '''
+    Fetches the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description='Plot the Jodrell Bank ephemeris DMs with the nightly giant-pulse DMs.')
+    parser.add_argument('-i', '--input', type=str, help='JB DM table: date and DM columns (default = JB_dms.txt)', default='JB_dms.txt')
+    parser.add_argument('--db', type=str, help=f'DM time-series database (default = {DM_DB})', default=DM_DB)
+    parser.add_argument('-o', '--output', type=str, help='Output plot (default = DM_time.pdf)', default='DM_time.pdf')
 
-# Format ticks as Year-Month
-ax = plt.gca()
-ax.xaxis.set_major_locator(mdates.MonthLocator(interval=4)) 
-ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
+    return parser.parse_args()
 
-plt.xticks(rotation=45, ha='right')
-plt.xlim(dates[0], dates[-1])
-plt.legend()
 
-plt.tight_layout()
-plt.savefig("DM_time.pdf")
-plt.show()
\ No newline at end of file
+def main():
+    args = fetch_args()
+    data = np.genfromtxt(args.input, dtype=str)
+    dates = np.array(data[:, 0], dtype="datetime64[D]")
+    dm = data[:, 1].astype(float)
+
+    plt = plotting.pyplot()
+    import matplotlib.dates as mdates
+
+    plt.figure(figsize=(9, 3))
+    plt.step(dates, dm, where="post",
+             label="Jodrell Bank Ephemeris", color='k')
+
+    # nightly giant-pulse DMs, if the DM database has been built
+    if os.path.exists(args.db):
+        conn = dmdb.connect(args.db)
+        nights = dmdb.nightly(conn)
+        conn.close()
+        if len(nights):
+            night_dates = np.datetime64('1858-11-17', 'D') + nights['night'].astype('timedelta64[D]')
+            plt.errorbar(night_dates, nights['dm_median'], yerr=nights['dm_mad'], fmt='.', color='C3',
+                         label="Giant pulses (nightly median)")
+
+    # plt.xlabel("Date")
+    plt.ylabel("DM [pc cm$^{-3}$]")
+
+    # Format ticks as Year-Month
+    ax = plt.gca()
+    ax.xaxis.set_major_locator(mdates.MonthLocator(interval=4))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
+
+    plt.xticks(rotation=45, ha='right')
+    plt.xlim(dates[0], dates[-1])
+    plt.legend()
+
+    plt.tight_layout()
+    plt.savefig(args.output)
+    plt.show()
+
+
+if __name__ == "__main__":
+    main()
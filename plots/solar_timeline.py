@@ -1,31 +1,28 @@
-import pandas as pd 
-from astropy import units as u
-from astropy.time import Time
-from astropy.coordinates import GCRS, SkyCoord, get_sun
-import matplotlib.pyplot as plt
+import os
+import sys
 import numpy as np
-import scienceplots; plt.style.use(['science','no-latex'])
 
-def sun_separation(coords, mjd):
-    '''
-    Calculate the separation between the target and the Sun at a given MJD.
-    '''
-    from astropy.coordinates import get_sun, EarthLocation, AltAz
-    from astropy.time import Time
-    
-    t = Time(mjd, format="mjd")
+import solarsep
 
-    sun_gcrs = get_sun(t)                # GCRS(obstime=t)
-    crab_gcrs = coords.transform_to(GCRS(obstime=t))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'observation'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import obscat
+from crabgp import plotting
 
-    return crab_gcrs.separation(sun_gcrs).deg
+SUN_LIMIT = 20  # deg
 
 def main():
-    crab_df = pd.read_csv('../REALTA-Crab-Files.csv')
+    from astropy.time import Time
+
+    # observations with unreadable headers have no MJD in the catalogue
+    conn = obscat.connect()
+    if os.path.exists(obscat.REALTA_CSV):
+        obscat.ingest(conn, obscat.REALTA_CSV)
+    crab_mjd_arr = obscat.query_mjd(conn, 'crab')
+    conn.close()
+    if crab_mjd_arr.size == 0:
+        sys.exit(f"No Crab observations in {obscat.CATALOGUE}; run observation/pull-crab.py to build it")
 
-    crab_df = crab_df[~crab_df['time_mjd'].str.contains('hdr error')]
-    crab_mjd_arr = crab_df['time_mjd'].astype(float)
-    
     print("N obs:", len(crab_mjd_arr))
     print("MJD min/max:", crab_mjd_arr.min(), crab_mjd_arr.max())
     print("Span (days):", crab_mjd_arr.max() - crab_mjd_arr.min())
@@ -35,11 +32,11 @@ def main():
 
     
 
-    crab = SkyCoord(ra=83.6331*u.deg, dec=22.0174*u.deg, frame="icrs")
     smooth_mjd_arr = np.linspace(crab_mjd_arr.min(), crab_mjd_arr.max(), 200)
     
-    sun_separation_vec = np.array([sun_separation(crab, mjd) for mjd in crab_mjd_arr])
-    sun_separation_smooth = np.array([sun_separation(crab, mjd) for mjd in smooth_mjd_arr])
+    sun_separation_vec = solarsep.sun_separation(crab_mjd_arr)
+    sun_separation_smooth = solarsep.sun_separation(smooth_mjd_arr)
+    print(f"Obs within {SUN_LIMIT} deg of the Sun:", np.count_nonzero(sun_separation_vec < SUN_LIMIT))
  
     t_obs = Time(crab_mjd_arr, format="mjd")
     t_smooth = Time(smooth_mjd_arr, format="mjd")
@@ -47,10 +44,13 @@ def main():
     years_obs = t_obs.decimalyear
     years_smooth = t_smooth.decimalyear
 
+    if not plotting.enabled():
+        return
+    plt = plotting.pyplot()
     plt.figure(figsize=(9, 3))
     plt.scatter(years_obs, sun_separation_vec, alpha=0.5)
     plt.plot(years_smooth, sun_separation_smooth, color='grey', linestyle='--')
-    plt.axhline(20, color='red', linestyle=':', label='limit')
+    plt.axhline(SUN_LIMIT, color='red', linestyle=':', label='limit')
     plt.xlabel('Year')
     plt.ylabel('Solar Seperation [deg]')
     plt.tight_layout()
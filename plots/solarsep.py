@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+
+# Crab pulsar (ICRS), degrees
+CRAB_RA = 83.6331
+CRAB_DEC = 22.0174
+
+GRID_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', '.sun_grid.npz')
+GRID_START = 55000.0  # 2009-06-18
+GRID_END = 63000.0    # 2031-07-30
+GRID_STEP = 1.0       # days
+
+_GRID = {}
+
+
+def unit_vector(ra, dec):
+    """Cartesian unit vectors of (ra, dec) in degrees, shape (..., 3)."""
+    ra = np.radians(np.asarray(ra, dtype=float))
+    dec = np.radians(np.asarray(dec, dtype=float))
+    return np.stack([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+def sun_separation_exact(mjd, ra=CRAB_RA, dec=CRAB_DEC):
+    '''
+    Separation between the target and the Sun for an array of MJDs, in degrees.
+
+    One vectorised astropy call: the target is transformed to GCRS at all
+    epochs at once and compared with ``get_sun``.
+    '''
+    from astropy import units as u
+    from astropy.coordinates import GCRS, SkyCoord, get_sun
+    from astropy.time import Time
+
+    t = Time(np.atleast_1d(np.asarray(mjd, dtype=float)), format="mjd")
+    target = SkyCoord(ra=ra * u.deg, dec=dec * u.deg, frame="icrs")
+    sep = target.transform_to(GCRS(obstime=t)).separation(get_sun(t)).deg
+    return sep if np.ndim(mjd) else float(sep[0])
+
+
+def build_grid(start=GRID_START, end=GRID_END, step=GRID_STEP):
+    """Geocentric (GCRS) unit vectors of the Sun on a regular MJD grid, from astropy."""
+    from astropy.coordinates import get_sun
+    from astropy.time import Time
+
+    mjd = np.arange(start, end + step / 2, step)
+    sun = get_sun(Time(mjd, format="mjd"))
+    return mjd, unit_vector(sun.ra.deg, sun.dec.deg)
+
+
+def sun_grid(fname=GRID_FILE):
+    """Daily Sun-position grid, computed once and cached to ``fname``."""
+    if fname not in _GRID:
+        if os.path.exists(fname):
+            with np.load(fname) as grid:
+                _GRID[fname] = (grid['mjd'], grid['sun'])
+        else:
+            mjd, sun = build_grid()
+            np.savez(fname + '.tmp.npz', mjd=mjd, sun=sun)
+            os.replace(fname + '.tmp.npz', fname)
+            _GRID[fname] = (mjd, sun)
+    return _GRID[fname]
+
+
+def sun_separation(mjd, ra=CRAB_RA, dec=CRAB_DEC, fname=GRID_FILE):
+    """Separation between the target and the Sun, in degrees, from the cached grid.
+
+    The Sun's direction is linearly interpolated between daily grid points
+    and renormalised, which is good to ~0.01 deg (the target's annual
+    aberration is ignored). MJDs outside the grid fall back to astropy.
+
+    Parameters
+    ----------
+    mjd : float or array_like
+        Epochs.
+    ra, dec : float
+        Target position (ICRS), in degrees; defaults to the Crab.
+
+    Returns
+    -------
+    sep : float or array
+    """
+    grid_mjd, grid_sun = sun_grid(fname)
+    mjd_arr = np.atleast_1d(np.asarray(mjd, dtype=float))
+    sep = np.empty(mjd_arr.shape)
+
+    inside = (mjd_arr >= grid_mjd[0]) & (mjd_arr <= grid_mjd[-1])
+    if inside.any():
+        x = mjd_arr[inside]
+        i = np.clip(np.searchsorted(grid_mjd, x, side='right') - 1, 0, grid_mjd.size - 2)
+        w = ((x - grid_mjd[i]) / (grid_mjd[i + 1] - grid_mjd[i]))[:, None]
+        sun = (1 - w) * grid_sun[i] + w * grid_sun[i + 1]
+        sun /= np.linalg.norm(sun, axis=1, keepdims=True)
+        cos_sep = np.clip(sun @ unit_vector(ra, dec), -1.0, 1.0)
+        sep[inside] = np.degrees(np.arccos(cos_sep))
+    if not inside.all():
+        sep[~inside] = sun_separation_exact(mjd_arr[~inside], ra, dec)
+    return sep if np.ndim(mjd) else float(sep[0])
+
+
+def near_sun(mjd, limit=20.0, ra=CRAB_RA, dec=CRAB_DEC, fname=GRID_FILE):
+    """True for epochs at which the target is within ``limit`` degrees of the Sun."""
+    return sun_separation(mjd, ra, dec, fname) < limit
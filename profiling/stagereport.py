@@ -0,0 +1,307 @@
+import csv
+import functools
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+REPORT_VERSION = 1
+CSV_COLUMNS = ['run_start', 'script', 'kind', 'name', 'calls', 'wall_s', 'cpu_s', 'peak_rss_mb', 'value']
+
+# Report of the running script; the module-level stage/lap/count/timed helpers
+# record into it and do nothing when no report is active
+_ACTIVE = None
+
+
+def rss_mb():
+    """Resident set size of this process in MB (None where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss_mb(who='self'):
+    """Lifetime peak RSS of this process (or of its largest waited-for child) in MB."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    return usage.ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+
+class MemorySampler:
+    """Background thread sampling the RSS into the peak of every open stage.
+
+    Samples are also taken when stages open and close, so short stages get
+    a peak even between two ticks.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peaks = {}   # open stage id -> peak RSS (MB)
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if rss_mb() is None:
+            return self
+        self._thread = threading.Thread(target=self._run, name='stagereport-rss', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        rss = rss_mb()
+        if rss is None:
+            return None
+        with self.lock:
+            for key, peak in self.peaks.items():
+                if rss > peak:
+                    self.peaks[key] = rss
+        return rss
+
+    def open(self, key):
+        with self.lock:
+            self.peaks[key] = rss_mb() or 0.0
+
+    def close(self, key):
+        self.sample()
+        with self.lock:
+            peak = self.peaks.pop(key, 0.0)
+        return peak or None
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class StageReport:
+    """Per-stage wall/CPU time, peak memory and counters of one script run.
+
+    Stages nest (their names are joined with '/') and a stage entered
+    several times is aggregated into one record. Only the calling process
+    is measured: work done in ``ProcessPoolExecutor`` workers shows up as
+    the wall time of the stage that waits for it, and their counters have
+    to be added by the parent.
+
+    Parameters
+    ----------
+    script : str
+        Name of the script, written into the report.
+    output : str, optional
+        Report written on ``close``; ``.csv`` gives one row per stage and
+        counter, anything else JSON.
+    profile : str, optional
+        Run cProfile over the whole run (main thread only) and dump the
+        statistics to this file on ``close`` (read with ``pstats``).
+    interval : float
+        RSS sampling interval, in s.
+    """
+
+    def __init__(self, script, output=None, profile=None, interval=0.05):
+        self.script = script
+        self.output = output
+        self.profile = profile
+        self.counters = Counter()
+        self.stages = {}
+        self.order = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.sampler = MemorySampler(interval)
+        self.profiler = None
+        self.started = None
+        self._lap = None
+        self._t0 = self._cpu0 = None
+
+    def start(self):
+        global _ACTIVE
+        self.started = datetime.now(timezone.utc)
+        self._t0, self._cpu0 = time.perf_counter(), time.process_time()
+        self.sampler.start()
+        if self.profile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        _ACTIVE = self
+        return self
+
+    def _path(self, name):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return '/'.join(stack + [name]), stack
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as stage ``name`` (nested under any open stage)."""
+        path, stack = self._path(name)
+        key = (path, threading.get_ident(), time.perf_counter_ns())
+        self._entry(path)
+        self.sampler.open(key)
+        stack.append(name)
+        t0, cpu0 = time.perf_counter(), time.thread_time()
+        try:
+            yield self
+        finally:
+            wall, cpu = time.perf_counter() - t0, time.thread_time() - cpu0
+            stack.pop()
+            self._record(path, wall, cpu, self.sampler.close(key))
+
+    def _entry(self, path):
+        # stages are listed in the order they are first entered
+        with self.lock:
+            if path not in self.stages:
+                self.stages[path] = {'name': path, 'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_mb': None}
+                self.order.append(path)
+
+    def _record(self, path, wall, cpu, peak):
+        with self.lock:
+            record = self.stages[path]
+            record['calls'] += 1
+            record['wall_s'] += wall
+            record['cpu_s'] += cpu
+            if peak is not None:
+                record['peak_rss_mb'] = max(record['peak_rss_mb'] or 0.0, peak)
+
+    def lap(self, name):
+        """End the current lap (if any) and start timing stage ``name``.
+
+        For the linear ``main`` of a script, where wrapping every section in
+        a ``with`` block would re-indent it; the last lap ends on ``close``.
+        """
+        self.end_lap()
+        self._lap = self.stage(name)
+        self._lap.__enter__()
+
+    def end_lap(self):
+        if self._lap is not None:
+            lap, self._lap = self._lap, None
+            lap.__exit__(None, None, None)
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.counters[key] += int(n)
+
+    def summary(self):
+        """The report as a JSON-serialisable dict."""
+        wall = time.perf_counter() - self._t0
+        return {
+            'version': REPORT_VERSION,
+            'script': self.script,
+            'argv': sys.argv,
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'run_start': self.started.isoformat(timespec='seconds'),
+            'wall_s': wall,
+            'cpu_s': time.process_time() - self._cpu0,
+            'peak_rss_mb': max_rss_mb('self'),
+            'children_peak_rss_mb': max_rss_mb('children'),
+            'stages': [dict(self.stages[path]) for path in self.order],
+            'counters': dict(self.counters),
+            'profile': self.profile,
+        }
+
+    def write(self, fname):
+        summary = self.summary()
+        tmp = fname + '.tmp'
+        if fname.lower().endswith('.csv'):
+            with open(tmp, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+                writer.writeheader()
+                common = {'run_start': summary['run_start'], 'script': self.script}
+                writer.writerow(common | {'kind': 'run', 'name': 'total', 'calls': 1, 'wall_s': summary['wall_s'],
+                                          'cpu_s': summary['cpu_s'], 'peak_rss_mb': summary['peak_rss_mb']})
+                for record in summary['stages']:
+                    writer.writerow(common | {'kind': 'stage'} | record)
+                for key, value in sorted(summary['counters'].items()):
+                    writer.writerow(common | {'kind': 'counter', 'name': key, 'value': value})
+        else:
+            with open(tmp, 'w') as f:
+                json.dump(summary, f, indent=1)
+        os.replace(tmp, fname)
+        return summary
+
+    def close(self):
+        global _ACTIVE
+        self.end_lap()
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile)
+        if _ACTIVE is self:
+            _ACTIVE = None
+        self.sampler.stop()
+        if self.output:
+            self.write(self.output)
+            print(f"Stage report written to {self.output}")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def active():
+    """The running ``StageReport``, or None."""
+    return _ACTIVE
+
+
+@contextmanager
+def stage(name):
+    """Time a block in the active report (no-op without one)."""
+    if _ACTIVE is None:
+        yield None
+    else:
+        with _ACTIVE.stage(name) as report:
+            yield report
+
+
+def lap(name):
+    if _ACTIVE is not None:
+        _ACTIVE.lap(name)
+
+
+def count(key, n=1):
+    if _ACTIVE is not None:
+        _ACTIVE.count(key, n)
+
+
+def timed(name=None):
+    """Decorator timing every call of a function as a stage of the active report."""
+    def decorate(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _ACTIVE is None:
+                return func(*args, **kwargs)
+            with _ACTIVE.stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def add_arguments(parser):
+    """Add the --stage-report and --profile options to a script's parser."""
+    parser.add_argument('--stage-report', type=str, help='Write per-stage timings, peak memory and counters to this .json or .csv file', required=False)
+    parser.add_argument('--profile', type=str, help='Run cProfile and dump the statistics to this file', required=False)
+    return parser
+
+
+def from_args(args, script):
+    """``StageReport`` configured from the options added by ``add_arguments``."""
+    return StageReport(script, output=args.stage_report, profile=args.profile)
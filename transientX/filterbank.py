@@ -0,0 +1,256 @@
+import argparse
+import hashlib
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# SIGPROC header keywords and their binary types
+INT_KEYS = {'telescope_id', 'machine_id', 'data_type', 'barycentric', 'pulsarcentric', 'nbits', 'nsamples',
+            'nchans', 'nifs', 'nbeams', 'ibeam', 'nbins'}
+DOUBLE_KEYS = {'tstart', 'tsamp', 'fch1', 'foff', 'refdm', 'refrf', 'az_start', 'za_start', 'src_raj', 'src_dej',
+               'period', 'fchannel'}
+STRING_KEYS = {'source_name', 'rawdatafile'}
+CHAR_KEYS = {'signed'}
+# markers without a value (the channel table of multi-frequency files is read as 'fchannel' entries)
+FLAG_KEYS = {'FREQUENCY_START', 'FREQUENCY_END'}
+
+DTYPES = {8: np.uint8, 16: np.uint16, 32: np.float32}
+
+
+def fetch_args():
+    '''
+    Fetches the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description='Inspect a SIGPROC filterbank or requantize it to 8 bits.')
+    parser.add_argument('input', type=str, help='Input filterbank')
+    parser.add_argument('-o', '--output', type=str, help='8-bit output filterbank (default = <input>_8bit.fil)', required=False)
+    parser.add_argument('--header', action='store_true', help='Only print the header')
+    parser.add_argument('-j', '--jobs', type=int, help='Threads used for requantization (default = 8)', default=8)
+    parser.add_argument('--chunk', type=int, help='Samples per chunk (default = 16384)', default=16384)
+
+    return parser.parse_args()
+
+
+def _read_string(f):
+    n = struct.unpack('<i', f.read(4))[0]
+    return f.read(n).decode('ascii', errors='replace')
+
+
+def _skip_unknown(f, key, fname, lookahead=64):
+    """Skip the value of an unknown keyword up to the next known one.
+
+    The size of an unknown value is not recorded in the header, so the
+    following ``lookahead`` bytes are searched for a known keyword.
+    """
+    known = INT_KEYS | DOUBLE_KEYS | STRING_KEYS | CHAR_KEYS | FLAG_KEYS | {'HEADER_END'}
+    start = f.tell()
+    buf = f.read(lookahead)
+    for skip in range(len(buf) - 4):
+        n = struct.unpack('<i', buf[skip:skip + 4])[0]
+        if 0 < n <= 32 and buf[skip + 4:skip + 4 + n].decode('ascii', errors='replace') in known:
+            print(f"Warning: skipped unknown SIGPROC header keyword {key!r} ({skip} bytes) in {fname}")
+            f.seek(start + skip)
+            return
+    raise ValueError(f"Unknown SIGPROC header keyword {key!r} in {fname}")
+
+
+def read_header(fname):
+    """Parse a SIGPROC filterbank header.
+
+    Only the header bytes are read, so this costs microseconds even for
+    multi-GB files. Unknown keywords are skipped with a warning when the
+    next known keyword can be found.
+
+    Returns
+    -------
+    header : dict
+        Header keywords plus ``header_size`` (bytes) and ``nsamples``
+        (from the file size when the header omits it).
+    """
+    header = {}
+    with open(fname, 'rb') as f:
+        if _read_string(f) != 'HEADER_START':
+            raise ValueError(f"{fname} is not a SIGPROC filterbank")
+        while True:
+            key = _read_string(f)
+            if key == 'HEADER_END':
+                break
+            if key in INT_KEYS:
+                header[key] = struct.unpack('<i', f.read(4))[0]
+            elif key in DOUBLE_KEYS:
+                header[key] = struct.unpack('<d', f.read(8))[0]
+            elif key in STRING_KEYS:
+                header[key] = _read_string(f)
+            elif key in CHAR_KEYS:
+                header[key] = struct.unpack('<b', f.read(1))[0]
+            elif key not in FLAG_KEYS:
+                _skip_unknown(f, key, fname)
+        header['header_size'] = f.tell()
+
+    header.setdefault('nifs', 1)
+    nbytes = os.path.getsize(fname) - header['header_size']
+    header['nsamples'] = nbytes * 8 // (header['nbits'] * header['nchans'] * header['nifs'])
+    return header
+
+
+def write_header(f, header):
+    """Write a SIGPROC header (the keys of ``header`` that SIGPROC knows)."""
+    def string(s):
+        f.write(struct.pack('<i', len(s)) + s.encode('ascii'))
+
+    string('HEADER_START')
+    for key, value in header.items():
+        if key in INT_KEYS and key != 'nsamples':
+            string(key); f.write(struct.pack('<i', int(value)))
+        elif key in DOUBLE_KEYS:
+            string(key); f.write(struct.pack('<d', float(value)))
+        elif key in STRING_KEYS:
+            string(key); string(str(value))
+        elif key in CHAR_KEYS:
+            string(key); f.write(struct.pack('<b', int(value)))
+    string('HEADER_END')
+
+
+def quick_hash(fname, nbytes=1 << 20):
+    """SHA-1 of the first ``nbytes`` of a file (the SIGPROC header and first samples) and its size."""
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        h.update(f.read(nbytes))
+    h.update(str(os.path.getsize(fname)).encode())
+    return h.hexdigest()
+
+
+def channel_freqs(header):
+    """Centre frequency of every channel, in MHz, in file order."""
+    return header['fch1'] + header['foff'] * np.arange(header['nchans'])
+
+
+def open_data(fname, header=None):
+    """Memory-map the data block as an array of shape (nsamples, nchans) (first IF)."""
+    header = read_header(fname) if header is None else header
+    if header['nbits'] not in DTYPES:
+        raise ValueError(f"{header['nbits']}-bit filterbanks are not supported")
+    shape = (header['nsamples'], header['nifs'], header['nchans'])
+    data = np.memmap(fname, dtype=DTYPES[header['nbits']], mode='r', offset=header['header_size'], shape=shape)
+    return data[:, 0, :]
+
+
+def sample_index(header, mjd):
+    """Sample number of one or many MJDs."""
+    return np.floor((np.asarray(mjd, dtype=float) - header['tstart']) * 86400.0 / header['tsamp']).astype(np.int64)
+
+
+def extract_windows(fname, mjds, before, after, header=None):
+    """Time windows of the memory-mapped data around candidate MJDs.
+
+    Only the requested samples are read from disk.
+
+    Parameters
+    ----------
+    mjds : float or array_like
+        Candidate arrival MJDs (at the top of the band).
+    before, after : float
+        Window extent before and after each MJD, in s.
+
+    Returns
+    -------
+    windows : array, shape (nmjd, nwin, nchans)
+        Samples outside the file are zero.
+    start_mjd : array
+        MJD of the first sample of every window.
+    """
+    header = read_header(fname) if header is None else header
+    data = open_data(fname, header)
+    n_before = int(round(before / header['tsamp']))
+    nwin = n_before + int(round(after / header['tsamp']))
+    starts = np.atleast_1d(sample_index(header, mjds)) - n_before
+
+    windows = np.zeros((starts.size, nwin, header['nchans']), dtype=data.dtype)
+    for i, start in enumerate(starts):
+        lo, hi = max(start, 0), min(start + nwin, header['nsamples'])
+        if hi > lo:
+            windows[i, lo - start:hi - start] = data[lo:hi]
+    return windows, header['tstart'] + starts * header['tsamp'] / 86400.0
+
+
+def channel_stats(data, chunk=1024, nchunks=32):
+    """Per-channel median and robust rms from ``nchunks`` chunks spread through the file."""
+    nsamples = data.shape[0]
+    starts = np.unique(np.linspace(0, max(nsamples - chunk, 0), nchunks).astype(np.int64))
+    sample = np.concatenate([np.asarray(data[s:s + chunk], dtype=np.float32) for s in starts])
+    med = np.median(sample, axis=0)
+    q1, q3 = np.percentile(sample, [25, 75], axis=0)
+    rms = (q3 - q1) / 1.349
+    rms[rms <= 0] = 1.0
+    return med, rms
+
+
+def requantize(fname, outname, nbits=8, chunk=16384, n_threads=8, target_mean=128.0, target_rms=16.0, max_block_mb=32):
+    """Requantize a filterbank to 8 bits with per-channel scaling.
+
+    Every channel is shifted and scaled so its median maps to
+    ``target_mean`` and its robust rms to ``target_rms`` levels, using
+    statistics from a few chunks spread through the file. The data are
+    then streamed once, chunk by chunk, with ``n_threads`` threads writing
+    into a memory-mapped output (numpy releases the GIL while scaling).
+    Chunks are shortened to at most ``max_block_mb`` of float32 working
+    memory each, so at most ``n_threads`` such blocks are held at a time.
+    The output is written to a temporary file and renamed when complete
+    (and removed if requantisation fails).
+    """
+    if nbits != 8:
+        raise ValueError("Only 8-bit output is supported")
+    header = read_header(fname)
+    data = open_data(fname, header)
+    med, rms = channel_stats(data)
+    scale = (target_rms / rms).astype(np.float32)
+    shift = (target_mean - med * scale).astype(np.float32)
+
+    chunk = max(1, min(chunk, int(max_block_mb * 2**20) // (4 * header['nchans'])))
+
+    out_header = dict(header, nbits=8, nifs=1)
+    part = outname + '.part'
+    try:
+        with open(part, 'wb') as f:
+            write_header(f, out_header)
+            offset = f.tell()
+            f.truncate(offset + header['nsamples'] * header['nchans'])
+        out = np.memmap(part, dtype=np.uint8, mode='r+', offset=offset, shape=(header['nsamples'], header['nchans']))
+
+        def convert(start):
+            block = np.array(data[start:start + chunk], dtype=np.float32)
+            block *= scale
+            block += shift
+            np.clip(block, 0, 255, out=block)
+            np.rint(block, out=block)
+            out[start:start + chunk] = block
+
+        with ThreadPoolExecutor(max_workers=max(1, n_threads)) as pool:
+            list(pool.map(convert, range(0, header['nsamples'], chunk)))
+        out.flush()
+        del out
+        os.replace(part, outname)
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    return outname
+
+
+def main():
+    args = fetch_args()
+    header = read_header(args.input)
+    if args.header:
+        for key, value in header.items():
+            print(f"{key:>14}: {value}")
+        return
+
+    output = args.output or args.input[:-len('.fil')] + '_8bit.fil'
+    requantize(args.input, output, chunk=args.chunk, n_threads=args.jobs)
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
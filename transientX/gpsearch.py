@@ -0,0 +1,331 @@
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import filterbank
+import rfimask
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'TransientX'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'folding'))
+import candstore
+import jbephem
+
+# Dispersion constant in MHz^2 pc^-1 cm^3 s
+K_DM = 4.148808e3
+
+OUTPUT_DIRNAME = 'transientx_output'
+STORE_SUFFIX = '_gpsearch.cands.npy'
+
+
+def fetch_args():
+    '''
+    Fetches the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description='Narrow-DM single-pulse search of filterbanks for Crab giant pulses.')
+    parser.add_argument('input', type=str, nargs='+', help='Filterbank(s)')
+    parser.add_argument('-o', '--output', type=str, help=f'Output directory (default = <fil dir>/{OUTPUT_DIRNAME})', required=False)
+    parser.add_argument('--dm', type=float, help='Centre DM (default = Jodrell Bank DM at the observation)', required=False)
+    parser.add_argument('--dm-range', type=float, help='Half-width of the DM grid (default = 0.2)', default=0.2)
+    parser.add_argument('--ddm', type=float, help='DM step (default = 0.01)', default=0.01)
+    parser.add_argument('--minw', type=float, help='Smallest boxcar width in s (default = 0.003)', default=0.003)
+    parser.add_argument('--maxw', type=float, help='Largest boxcar width in s (default = 0.05)', default=0.05)
+    parser.add_argument('--thre', type=float, help='S/N threshold (default = 7.3)', default=7.3)
+    parser.add_argument('--nsub', type=int, help='Number of subbands (default = 128)', default=128)
+    parser.add_argument('--chunk', type=int, help='Samples read per block (default = 16384)', default=16384)
+    parser.add_argument('--rfi-mask', action='store_true', help='Zap the channels of the cached RFI mask (see rfimask.py)')
+    parser.add_argument('-j', '--jobs', type=int, help='Filterbanks searched in parallel (default = 1)', default=1)
+
+    return parser.parse_args()
+
+
+def dm_grid(dm_centre, dm_range=0.2, ddm=0.01):
+    """Trial DMs centred on ``dm_centre``."""
+    n = int(round(dm_range / ddm))
+    return dm_centre + ddm * np.arange(-n, n + 1)
+
+
+def boxcar_widths(tsamp, minw=0.003, maxw=0.05, nwidth=8):
+    """Boxcar widths in samples, geometrically spaced from ``minw`` to ``maxw`` (s)."""
+    widths = np.geomspace(max(minw / tsamp, 1), max(maxw / tsamp, 1), nwidth)
+    return np.unique(np.round(widths).astype(np.int64))
+
+
+def delays(freqs, dm, f_ref):
+    """Dispersion delay of ``freqs`` relative to ``f_ref``, in s."""
+    return K_DM * dm * (np.asarray(freqs, dtype=float)**-2 - f_ref**-2)
+
+
+class SubbandDedisperser:
+    """Streaming two-stage subband dedispersion over a narrow DM grid.
+
+    Stage one shifts every channel by its integer delay at the central DM
+    and sums channels into ``nsub`` subbands; the blocks of channels are
+    pushed into a ring buffer, so the file is read exactly once. Stage two
+    shifts the subband series by the residual delay of every trial DM.
+    All times are at the top of the band.
+    """
+
+    def __init__(self, freqs, tsamp, dms, nsub=128, weights=None, subband=None):
+        self.freqs = np.asarray(freqs, dtype=float)
+        self.nchan = self.freqs.size
+        self.tsamp = tsamp
+        self.dms = np.asarray(dms, dtype=float)
+        self.weights = np.ones(self.nchan, dtype=np.float32) if weights is None else np.asarray(weights, np.float32)
+
+        f_top = self.freqs.max()
+        dm_c = self.dms[len(self.dms) // 2]
+        if subband is None:
+            self.nsub = min(nsub, self.nchan)
+            self.subband = np.arange(self.nchan) * self.nsub // self.nchan
+        else:
+            # explicit channel -> subband assignment (contiguous, numbered from 0)
+            self.subband = np.asarray(subband, dtype=np.int64)
+            self.nsub = int(self.subband.max()) + 1
+        self.chan_delay = np.round(delays(self.freqs, dm_c, f_top) / tsamp).astype(np.int64)
+        self.max_delay = int(self.chan_delay.max())
+
+        f_sub = np.array([self.freqs[self.subband == s].mean() for s in range(self.nsub)])
+        # residual delay of each subband centre for every trial DM (ndm, nsub)
+        resid = np.round(delays(f_sub[None, :], self.dms[:, None] - dm_c, f_top) / tsamp).astype(np.int64)
+        self.resid_min = int(resid.min())
+        self.resid = resid - self.resid_min
+        self.max_resid = int(self.resid.max())
+
+        self.ring = None
+        self.pos = 0
+
+    def push(self, block):
+        """Add a (nsamp, nchan) block; return the completed subband series (nsub, nsamp).
+
+        The returned samples lag the input by ``max_delay`` samples: the
+        first ``max_delay`` samples returned for a file are incomplete.
+        """
+        nsamp = block.shape[0]
+        length = self.max_delay + nsamp
+        if self.ring is None or self.ring.shape[1] != length:
+            old = self.ring
+            self.ring = np.zeros((self.nsub, length), dtype=np.float32)
+            if old is not None:
+                raise ValueError("All blocks must have the same length")
+        ring = self.ring
+        cols = np.ascontiguousarray(block.T)
+        for c in np.flatnonzero(self.weights):
+            # sample r of this block lands at time (pos + r - delay)
+            start = (self.pos - self.chan_delay[c]) % length
+            stop = start + nsamp
+            sub = ring[self.subband[c]]
+            if stop <= length:
+                sub[start:stop] += cols[c]
+            else:
+                split = length - start
+                sub[start:] += cols[c, :split]
+                sub[:stop - length] += cols[c, split:]
+
+        # times pos - max_delay .. pos - max_delay + nsamp are now complete
+        first = (self.pos - self.max_delay) % length
+        idx = (first + np.arange(nsamp)) % length
+        done = ring[:, idx]
+        ring[:, idx] = 0.0
+        self.pos += nsamp
+        return done
+
+    def trials(self, series):
+        """Dedisperse subband series (nsub, n) to every trial DM: (ndm, n - max_resid).
+
+        Output sample u corresponds to input time u - resid_min.
+        """
+        n = series.shape[1] - self.max_resid
+        out = np.zeros((self.dms.size, max(n, 0)), dtype=np.float32)
+        if n <= 0:
+            return out
+        for s in range(self.nsub):
+            for d, shift in enumerate(self.resid[:, s]):
+                out[d] += series[s, shift:shift + n]
+        return out
+
+
+def boxcar_snr(series, widths):
+    """Best boxcar S/N over ``widths`` for every DM trial and start sample.
+
+    The baseline and noise are estimated robustly (median, 1.4826 MAD) per
+    trial.
+
+    Returns
+    -------
+    snr, width : arrays, shape (ndm, n - widths.max())
+        Best S/N and the boxcar width (samples) achieving it.
+    """
+    med = np.median(series, axis=1, keepdims=True)
+    sigma = 1.4826 * np.median(np.abs(series - med), axis=1, keepdims=True)
+    sigma[sigma == 0] = 1.0
+    x = (series - med) / sigma
+    csum = np.concatenate([np.zeros((x.shape[0], 1)), np.cumsum(x, axis=1, dtype=np.float64)], axis=1)
+
+    n = x.shape[1] - int(widths.max())
+    best = np.full((x.shape[0], max(n, 0)), -np.inf)
+    best_w = np.zeros(best.shape, dtype=np.int64)
+    for w in widths:
+        snr = (csum[:, w:w + n] - csum[:, :n]) / np.sqrt(w)
+        better = snr > best
+        best[better] = snr[better]
+        best_w[better] = w
+    return best, best_w
+
+
+def find_peaks(snr, width, threshold, min_gap):
+    """One candidate per run of samples above ``threshold`` (best over DM trials).
+
+    Returns (sample, dm_index, width, snr) arrays.
+    """
+    dm_idx = np.argmax(snr, axis=0)
+    best = snr[dm_idx, np.arange(snr.shape[1])]
+    above = np.flatnonzero(best > threshold)
+    if above.size == 0:
+        return (np.empty(0, dtype=np.int64),) * 3 + (np.empty(0),)
+    run_start = np.r_[0, np.flatnonzero(np.diff(above) > min_gap) + 1]
+    samples = []
+    for i, start in enumerate(run_start):
+        stop = run_start[i + 1] if i + 1 < run_start.size else above.size
+        run = above[start:stop]
+        samples.append(run[np.argmax(best[run])])
+    samples = np.asarray(samples, dtype=np.int64)
+    return samples, dm_idx[samples], width[dm_idx[samples], samples], best[samples]
+
+
+def merge_candidates(cands, min_gap_days):
+    """Keep the brightest candidate of groups closer than ``min_gap_days`` (from block edges)."""
+    if cands.size < 2:
+        return cands
+    cands = cands[np.argsort(cands['mjd'])]
+    group = np.r_[0, np.cumsum(np.diff(cands['mjd']) > min_gap_days)]
+    order = np.lexsort((-cands['snr'], group))
+    first = np.r_[True, group[order][1:] != group[order][:-1]]
+    return cands[np.sort(order[first])]
+
+
+def search_filterbank(fname, dms=None, dm_range=0.2, ddm=0.01, minw=0.003, maxw=0.05, threshold=7.3,
+                      nsub=128, chunk=16384, weights=None):
+    """Single-pulse search of one filterbank over a narrow DM grid.
+
+    The data are memory-mapped and read once in blocks of ``chunk``
+    samples, decimated in time so the narrowest boxcar spans about four
+    samples, normalised per channel and subband-dedispersed.
+
+    Returns
+    -------
+    cands : structured array (``candstore.cands_dtype``)
+        ``mjd`` at the top of the band and the pulse centre, ``dm``,
+        ``width`` (ms), ``snr``; ``png`` is empty and ``ifile`` is ``fname``.
+    """
+    header = filterbank.read_header(fname)
+    data = filterbank.open_data(fname, header)
+    freqs = filterbank.channel_freqs(header)
+    if dms is None:
+        dm_centre = float(jbephem.load_table()['dm'][jbephem.lookup(header['tstart'])])
+        dms = dm_grid(dm_centre, dm_range, ddm)
+
+    decim = max(1, int(minw / header['tsamp'] // 4))
+    tsamp = header['tsamp'] * decim
+    chunk = max(decim, chunk // decim * decim)
+    widths = boxcar_widths(tsamp, minw, maxw)
+
+    med, rms = filterbank.channel_stats(data)
+    scale = (1.0 / rms).astype(np.float32)
+    if weights is not None:
+        scale *= np.asarray(weights, dtype=np.float32)
+    dd = SubbandDedisperser(freqs, tsamp, dms, nsub, weights=(scale != 0))
+
+    keep = dd.max_resid + int(widths.max())
+    history = np.zeros((dd.nsub, 0), dtype=np.float32)
+    t_hist = 0  # time (decimated samples, top of band) of history[:, 0]
+    skip = dd.max_delay  # the first samples out of the dedisperser are incomplete
+    found = []
+    nblock = header['nsamples'] // decim * decim
+    for start in range(0, nblock + dd.max_delay * decim + chunk, chunk):
+        block = np.zeros((chunk, header['nchans']), dtype=np.float32)
+        rows = data[start:min(start + chunk, nblock)]
+        if len(rows):
+            block[:len(rows)] = (np.asarray(rows, dtype=np.float32) - med) * scale
+        block = block.reshape(chunk // decim, decim, -1).sum(axis=1)
+        done = dd.push(block)
+        if skip:
+            done, skip = done[:, skip:], max(0, skip - done.shape[1])
+        history = np.concatenate([history, done], axis=1)
+        if history.shape[1] <= keep:
+            continue
+
+        series = dd.trials(history)
+        snr, width = boxcar_snr(series, widths)
+        samples, dm_idx, w, peak = find_peaks(snr, width, threshold, int(widths.max()))
+        # trial output sample u is at time t_hist + u - resid_min; times whose
+        # low-frequency samples run past the end of the file are incomplete
+        t = t_hist + samples - dd.resid_min
+        valid = (t + dd.max_delay) * decim < header['nsamples']
+        if valid.any():
+            cands = np.empty(valid.sum(), dtype=candstore.cands_dtype(1, len(fname)))
+            centre = t[valid] + w[valid] / 2
+            cands['mjd'] = header['tstart'] + centre * tsamp / 86400.0
+            cands['dm'] = dms[dm_idx[valid]]
+            cands['width'] = w[valid] * tsamp * 1e3
+            cands['snr'] = peak[valid]
+            cands['png'] = ''
+            cands['ifile'] = fname
+            found.append(cands)
+
+        done = snr.shape[1]
+        history = history[:, done:]
+        t_hist += done
+        if t_hist * decim >= header['nsamples']:
+            break
+
+    cands = np.concatenate(found) if found else np.empty(0, dtype=candstore.cands_dtype(1, len(fname)))
+    cands = merge_candidates(cands, widths.max() * tsamp / 86400.0)
+    if cands.size:
+        cands['time'] = cands['mjd'] - cands['mjd'].min()
+    return cands
+
+
+def output_path(fname, output_dir=None):
+    output_dir = output_dir or os.path.join(os.path.dirname(os.path.abspath(fname)), OUTPUT_DIRNAME)
+    return os.path.join(output_dir, os.path.basename(fname)[:-len('.fil')] + STORE_SUFFIX)
+
+
+def search_to_store(fname, output_dir=None, rfi_mask=False, **kwargs):
+    """Search ``fname`` and save its candidates where ``candstore`` ingests them.
+
+    With ``rfi_mask`` the channels of the filterbank's cached RFI mask are
+    given zero weight.
+    """
+    if rfi_mask:
+        kwargs['weights'] = rfimask.get_mask(fname).weights()
+    cands = search_filterbank(fname, **kwargs)
+    out = output_path(fname, output_dir)
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out + '.tmp', 'wb') as f:
+        np.save(f, cands)
+    os.replace(out + '.tmp', out)
+    return out, cands.size
+
+
+def main():
+    args = fetch_args()
+    kwargs = dict(dm_range=args.dm_range, ddm=args.ddm, minw=args.minw, maxw=args.maxw, threshold=args.thre,
+                  nsub=args.nsub, chunk=args.chunk, rfi_mask=args.rfi_mask)
+    if args.dm is not None:
+        kwargs['dms'] = dm_grid(args.dm, args.dm_range, args.ddm)
+
+    if args.jobs > 1 and len(args.input) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = [pool.submit(search_to_store, f, args.output, **kwargs) for f in args.input]
+            results = [f.result() for f in futures]
+    else:
+        results = [search_to_store(f, args.output, **kwargs) for f in args.input]
+    for out, n in results:
+        print(f"{n} candidates -> {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import argparse
+import json
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import filterbank
+
+MASK_SUFFIX = '_rfimask.npz'
+MASK_VERSION = 2
+
+DEFAULTS = {
+    'block_time': 1.0,   # s per statistics block (rfifind's -time)
+    'sigma': 5.0,        # robust-sigma threshold on block mean/rms
+    'kurt_sigma': 5.0,   # threshold on excess kurtosis, in units of sqrt(24/n)
+    'chan_frac': 0.3,    # blocks flagged before a whole channel is zapped
+    'int_frac': 0.5,     # channels flagged before a whole block is zapped
+}
+
+# Channel ranges (ascending frequency) zapped by default, by number of
+# channels: the band edges of the 3904-channel I-LOFAR filterbanks
+DEFAULT_ZAP = {3904: '0:250,3850:3903'}
+
+
+def fetch_args():
+    '''
+    Fetches the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description='Compute (or reuse) the cached RFI mask of a filterbank and export it.')
+    parser.add_argument('input', type=str, help='Filterbank')
+    parser.add_argument('--zap', type=str, help="Channel ranges (ascending frequency) always zapped, e.g. 0:250,3850:3903 "
+                                                "(default = the band edges of I-LOFAR filterbanks, '' for none)", required=False)
+    parser.add_argument('--time', type=float, help='Statistics block length in s (default = 1.0)', default=DEFAULTS['block_time'])
+    parser.add_argument('--sigma', type=float, help='Threshold on block mean/rms outliers (default = 5)', default=DEFAULTS['sigma'])
+    parser.add_argument('--kurt-sigma', type=float, help='Threshold on excess kurtosis (default = 5)', default=DEFAULTS['kurt_sigma'])
+    parser.add_argument('--chan-frac', type=float, help='Fraction of flagged blocks that zaps a channel (default = 0.3)', default=DEFAULTS['chan_frac'])
+    parser.add_argument('--int-frac', type=float, help='Fraction of flagged channels that zaps a block (default = 0.5)', default=DEFAULTS['int_frac'])
+    parser.add_argument('--rfifind', type=str, help='Write a PRESTO rfifind-compatible .mask file', required=False)
+    parser.add_argument('--paz', action='store_true', help='Print paz arguments zapping the masked channels')
+    parser.add_argument('--channels', action='store_true', help='Print the masked channels (ascending frequency), space separated')
+    parser.add_argument('--refresh', action='store_true', help='Recompute even if a cached mask exists')
+    parser.add_argument('-j', '--jobs', type=int, help='Threads used for the statistics (default = 8)', default=8)
+
+    return parser.parse_args()
+
+
+def parse_ranges(spec):
+    """Channel numbers of a range list such as ``'0:250,3850:3903'`` (inclusive ends)."""
+    chans = []
+    for part in filter(None, (p.strip() for p in str(spec).split(','))):
+        lo, _, hi = part.partition(':')
+        chans.extend(range(int(lo), int(hi or lo) + 1))
+    return np.array(chans, dtype=np.int64)
+
+
+def default_zap(nchans):
+    """Channel ranges zapped when no ``zap`` is given, for ``nchans`` channels."""
+    return DEFAULT_ZAP.get(int(nchans), '')
+
+
+def channel_ranges(chans):
+    """Group sorted channel numbers into (first, last) runs."""
+    chans = np.unique(np.asarray(chans, dtype=np.int64))
+    if chans.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(chans) > 1)
+    firsts = np.r_[chans[0], chans[breaks + 1]]
+    lasts = np.r_[chans[breaks], chans[-1]]
+    return list(zip(firsts.tolist(), lasts.tolist()))
+
+
+def block_stats(data, nsamp, n_threads=8, iqr_rows=256):
+    """Per-channel statistics of consecutive blocks of ``nsamp`` samples.
+
+    The memory-mapped data are read once, a block at a time, with the
+    blocks shared between ``n_threads`` threads. The IQR is taken from at
+    most ``iqr_rows`` evenly strided samples of each block.
+
+    Returns
+    -------
+    stats : dict of arrays, shape (nblock, nchan)
+        ``mean``, ``std``, ``rms`` (IQR / 1.349) and ``kurtosis`` (excess), plus
+        ``n``, the number of samples in each block.
+    """
+    nsamples, nchans = data.shape
+    starts = np.arange(0, nsamples, nsamp)
+    stats = {key: np.zeros((starts.size, nchans), dtype=np.float32) for key in ('mean', 'std', 'rms', 'kurtosis')}
+
+    def measure(i):
+        block = np.array(data[starts[i]:starts[i] + nsamp], dtype=np.float64)
+        mean = block.mean(axis=0)
+        block -= mean
+        var = np.mean(block**2, axis=0)
+        m4 = np.mean(block**4, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            kurt = np.where(var > 0, m4 / var**2 - 3.0, np.inf)
+        q1, q3 = np.percentile(block[::max(1, len(block) // iqr_rows)], [25, 75], axis=0)
+        stats['mean'][i] = mean
+        stats['std'][i] = np.sqrt(var)
+        stats['rms'][i] = (q3 - q1) / 1.349
+        stats['kurtosis'][i] = kurt
+
+    with ThreadPoolExecutor(max_workers=max(1, n_threads)) as pool:
+        list(pool.map(measure, range(starts.size)))
+    stats['n'] = np.minimum(nsamp, nsamples - starts)
+    return stats
+
+
+def _robust_z(x, axis):
+    med = np.median(x, axis=axis, keepdims=True)
+    mad = 1.4826 * np.median(np.abs(x - med), axis=axis, keepdims=True)
+    mad[mad == 0] = np.inf
+    return (x - med) / mad
+
+
+def flag_blocks(stats, sigma=5.0, kurt_sigma=5.0, chan_frac=0.3, int_frac=0.5):
+    """Flag RFI from block statistics.
+
+    A (block, channel) cell is flagged if its mean or standard deviation is a ``sigma``
+    outlier against the same channel's other blocks, its excess kurtosis
+    exceeds ``kurt_sigma`` * sqrt(24 / n) (the Gaussian expectation), or
+    the channel is dead. Channels whose rms is an outlier against the
+    bandpass (median over time, detrended with a running median over 33
+    channels) are zapped outright, as are channels with more than
+    ``chan_frac`` of their blocks flagged; blocks with more than
+    ``int_frac`` of their channels flagged are zapped in full.
+
+    Returns
+    -------
+    cells : array of bool, shape (nblock, nchan)
+    chans : array of bool, shape (nchan,)
+    ints : array of bool, shape (nblock,)
+    """
+    mean, std, rms, kurt = stats['mean'], stats['std'], stats['rms'], stats['kurtosis']
+    cells = (np.abs(_robust_z(mean, 0)) > sigma) | (np.abs(_robust_z(std, 0)) > sigma)
+    cells |= np.abs(kurt) > kurt_sigma * np.sqrt(24.0 / stats['n'])[:, None]
+    cells |= rms <= 0
+
+    band = np.median(rms, axis=0)
+    half = 16
+    padded = np.pad(band, half, mode='edge')
+    trend = np.median(np.lib.stride_tricks.sliding_window_view(padded, 2 * half + 1), axis=1)
+    chans = (np.abs(_robust_z(band - trend, 0)) > sigma) | (band <= 0)
+    chans |= cells.mean(axis=0) > chan_frac
+
+    ints = (cells | chans).mean(axis=1) > int_frac
+    return cells, chans, ints
+
+
+class RFIMask:
+    """Channel and time-block RFI mask of one filterbank.
+
+    Arrays are in file channel order; ``freqs`` gives their frequencies.
+    ``flagged`` holds the channels flagged from the data (what is cached)
+    and ``chans`` adds the ``zap`` ranges to them. Exported channel numbers (``zapped_channels``, ``paz_args``,
+    ``write_rfifind``) count in ascending frequency, as PRESTO does and as
+    the channel lists in foldCrab.sh do.
+    """
+
+    def __init__(self, freqs, cells, chans, ints, dtint, mjd, ptsperint, params=None, zap=''):
+        self.freqs = np.asarray(freqs, dtype=float)
+        self.cells = np.asarray(cells, dtype=bool)
+        self.flagged = np.asarray(chans, dtype=bool)
+        self.zap = zap
+        self.chans = self.flagged.copy()
+        zap = parse_ranges(zap)
+        zap = zap[zap < self.freqs.size]
+        self.chans[np.argsort(self.freqs)[zap]] = True
+        self.ints = np.asarray(ints, dtype=bool)
+        self.dtint = float(dtint)
+        self.mjd = float(mjd)
+        self.ptsperint = int(ptsperint)
+        self.params = params or {}
+
+    def with_zap(self, zap):
+        """The same flags with the channel ranges ``zap`` zapped instead."""
+        return RFIMask(self.freqs, self.cells, self.flagged, self.ints, self.dtint, self.mjd, self.ptsperint,
+                       self.params, zap)
+
+    @property
+    def keep(self):
+        """True for usable channels (file order)."""
+        return ~self.chans
+
+    def weights(self):
+        """Channel weights (1 keep, 0 zap) in file order, for ``gpsearch``."""
+        return self.keep.astype(np.float32)
+
+    def resample(self, freqs):
+        """Keep-mask on another channel grid, from the nearest masked channel."""
+        order = np.argsort(self.freqs)
+        f_sorted = self.freqs[order]
+        freqs = np.asarray(freqs, dtype=float)
+        i = np.clip(np.searchsorted(f_sorted, freqs), 1, f_sorted.size - 1)
+        nearest = np.where(np.abs(freqs - f_sorted[i - 1]) <= np.abs(f_sorted[i] - freqs), i - 1, i)
+        return self.keep[order][nearest]
+
+    def zapped_channels(self):
+        """Masked channel numbers, counted in ascending frequency."""
+        return np.flatnonzero(self.chans[np.argsort(self.freqs)])
+
+    def paz_args(self):
+        """``paz`` arguments (``-z``/``-Z``) zapping the masked channels."""
+        args = []
+        for lo, hi in channel_ranges(self.zapped_channels()):
+            args += ['-z', str(lo)] if lo == hi else ['-Z', f'{lo} {hi}']
+        return args
+
+    def write_rfifind(self, fname, timesigma=None, freqsigma=None):
+        """Write the mask in PRESTO's rfifind ``.mask`` format (for ``-mask``)."""
+        order = np.argsort(self.freqs)
+        cells = self.cells[:, order]
+        zap_chans = np.flatnonzero(self.chans[order]).astype(np.int32)
+        zap_ints = np.flatnonzero(self.ints).astype(np.int32)
+        per_int = [np.flatnonzero(row).astype(np.int32) for row in cells]
+        sigma = self.params.get('sigma', DEFAULTS['sigma'])
+        dfreq = float(np.median(np.diff(self.freqs[order]))) if self.freqs.size > 1 else 0.0
+
+        with open(fname + '.tmp', 'wb') as f:
+            f.write(struct.pack('<6d', timesigma or sigma, freqsigma or sigma, self.mjd, self.dtint,
+                                float(self.freqs.min()), dfreq))
+            f.write(struct.pack('<3i', self.freqs.size, len(per_int), self.ptsperint))
+            f.write(struct.pack('<i', zap_chans.size) + zap_chans.astype('<i4').tobytes())
+            f.write(struct.pack('<i', zap_ints.size) + zap_ints.astype('<i4').tobytes())
+            f.write(np.array([c.size for c in per_int], dtype='<i4').tobytes())
+            for c in per_int:
+                if 0 < c.size < self.freqs.size:
+                    f.write(c.astype('<i4').tobytes())
+        os.replace(fname + '.tmp', fname)
+        return fname
+
+    def save(self, fname, file_hash):
+        tmp = f'{fname}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, freqs=self.freqs, cells=self.cells, chans=self.flagged, ints=self.ints,
+                                info=json.dumps({'version': MASK_VERSION, 'hash': file_hash, 'params': self.params,
+                                                 'dtint': self.dtint, 'mjd': self.mjd, 'ptsperint': self.ptsperint}))
+        os.replace(tmp, fname)
+
+    @classmethod
+    def load(cls, fname):
+        """Mask (without any zap) and its info dict (``hash``, ``params``, ...) from a cache file."""
+        with np.load(fname) as cache:
+            info = json.loads(str(cache['info']))
+            mask = cls(cache['freqs'], cache['cells'], cache['chans'], cache['ints'], info['dtint'], info['mjd'],
+                       info['ptsperint'], info['params'])
+        return mask, info
+
+
+def cache_path(fname):
+    """Cached mask of a filterbank, next to it."""
+    return fname[:-len('.fil')] + MASK_SUFFIX if fname.endswith('.fil') else fname + MASK_SUFFIX
+
+
+def compute_mask(fname, n_threads=8, zap=None, **params):
+    """Compute the RFI mask of a filterbank from its block statistics.
+
+    ``zap`` channel ranges are added to the flagged channels (``None`` for
+    the ``default_zap`` of the file's channel count).
+    """
+    params = dict(DEFAULTS, **params)
+    header = filterbank.read_header(fname)
+    data = filterbank.open_data(fname, header)
+    nsamp = max(1, int(round(params['block_time'] / header['tsamp'])))
+    stats = block_stats(data, nsamp, n_threads)
+    cells, chans, ints = flag_blocks(stats, params['sigma'], params['kurt_sigma'], params['chan_frac'], params['int_frac'])
+
+    zap = default_zap(header['nchans']) if zap is None else zap
+    return RFIMask(filterbank.channel_freqs(header), cells, chans, ints, nsamp * header['tsamp'], header['tstart'],
+                   nsamp, params, zap)
+
+
+def get_mask(fname, refresh=False, n_threads=8, zap=None, **params):
+    """RFI mask of a filterbank, reusing the cached one if it matches.
+
+    The cache (``<stem>_rfimask.npz`` next to the filterbank) holds only
+    the flags derived from the data and is keyed by the file's quick hash
+    and the flagging parameters, so every downstream stage shares one mask
+    and it is only recomputed when either changes. The ``zap`` channel
+    ranges are applied to the returned mask, not cached; the default
+    (``None``) zaps the ``default_zap`` band edges, so all stages agree.
+    """
+    params = dict(DEFAULTS, **params)
+    cache = cache_path(fname)
+    file_hash = filterbank.quick_hash(fname)
+    if not refresh and os.path.exists(cache):
+        mask, info = RFIMask.load(cache)
+        if info.get('version') == MASK_VERSION and info.get('hash') == file_hash and info.get('params') == params:
+            return mask.with_zap(default_zap(mask.freqs.size) if zap is None else zap)
+    mask = compute_mask(fname, n_threads, zap, **params)
+    mask.save(cache, file_hash)
+    return mask
+
+
+def main():
+    args = fetch_args()
+    mask = get_mask(args.input, args.refresh, args.jobs, block_time=args.time, sigma=args.sigma,
+                    kurt_sigma=args.kurt_sigma, chan_frac=args.chan_frac, int_frac=args.int_frac, zap=args.zap)
+    if args.rfifind:
+        mask.write_rfifind(args.rfifind)
+    if args.paz:
+        print(' '.join(f"'{a}'" if ' ' in a else a for a in mask.paz_args()))
+    elif args.channels:
+        print(' '.join(str(c) for c in mask.zapped_channels()))
+    else:
+        print(f"{args.input}: {mask.chans.sum()}/{mask.chans.size} channels and {mask.ints.sum()}/{mask.ints.size} "
+              f"blocks zapped, {mask.cells.mean():.1%} of cells flagged -> {cache_path(args.input)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import argparse
+import glob
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import filterbank
+
+MANIFEST_NAME = 'transientx_manifest.json'
+OUTPUT_DIRNAME = 'transientx_output'
+BASENAME = 'Crab'
+
+DIGIFIL_CMD = ['digifil', '-b', '8', '{input}', '-o', '{output}']
+TRANSIENTX_CMD = ['transientx_fil', '-v', '-t', '{threads}', '--iqr', '-l', '10', '--dms', '56', '--ddm', '0.01',
+                  '--overlap', '0.1', '--ndm', '100', '--minw', '0.003', '--maxw', '0.05', '--thre', '7.3',
+                  '-o', '{prefix}', '-f', '{input}', '-r', '16', '-k', '3']
+
+STAGES = ('eight_bit', 'transientx')
+
+
+def fetch_args():
+    '''
+    Fetches the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description='Requantize and run TransientX over every *P000.fil below a directory.')
+    parser.add_argument('path', type=str, help='Directory to search for *P000.fil files')
+    parser.add_argument('-m', '--manifest', type=str, help=f'Job manifest (default = <path>/{MANIFEST_NAME})', required=False)
+    parser.add_argument('-j', '--jobs', type=int, help='Filterbanks processed concurrently (default = 4)', default=4)
+    parser.add_argument('-t', '--threads', type=int, help='Threads per transientx_fil job (default = 64)', default=64)
+    parser.add_argument('--max-cpu', type=int, help='Total transientx_fil threads allowed at once (default = all cores)', default=os.cpu_count())
+    parser.add_argument('--io-jobs', type=int, help='8-bit conversions allowed at once (default = 2)', default=2)
+    parser.add_argument('--digifil', action='store_true', help='Use digifil instead of the built-in 8-bit requantizer')
+    parser.add_argument('--adopt', action='store_true', help='Mark files that already have .cands from earlier runs as done')
+    parser.add_argument('--dry-run', action='store_true', help='Only print what would be run')
+
+    return parser.parse_args()
+
+
+def file_stamp(fname):
+    st = os.stat(fname)
+    return [st.st_size, st.st_mtime]
+
+
+class Manifest:
+    """Per-filterbank job records, saved atomically after every change.
+
+    Each entry records ``state`` (pending, running, done or failed), the
+    filterbank ``stamp`` and ``hash``, the 8-bit file and .cands outputs,
+    and per-stage ``timings`` in seconds.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.lock = threading.Lock()
+        self.jobs = {}
+        if os.path.exists(fname):
+            with open(fname) as f:
+                self.jobs = json.load(f)
+
+    def save(self):
+        with open(self.fname + '.tmp', 'w') as f:
+            json.dump(self.jobs, f, indent=1)
+        os.replace(self.fname + '.tmp', self.fname)
+
+    def update(self, fil, **fields):
+        with self.lock:
+            self.jobs.setdefault(fil, {}).update(fields)
+            self.save()
+
+    def is_done(self, fil):
+        """O(1) check that ``fil`` finished and has not changed since."""
+        entry = self.jobs.get(fil)
+        if entry is None or entry.get('state') != 'done':
+            return False
+        if entry.get('stamp') == file_stamp(fil):
+            return True
+        return entry.get('hash') == filterbank.quick_hash(fil)
+
+
+def find_filterbanks(path):
+    return sorted(os.path.abspath(f) for f in glob.glob(os.path.join(path, '**', '*P000.fil'), recursive=True))
+
+
+def list_cands(output_dir):
+    """Map .cands file -> mtime in ``output_dir``."""
+    listing = {}
+    for cands in glob.glob(os.path.join(output_dir, '*.cands')):
+        try:
+            listing[cands] = os.stat(cands).st_mtime_ns
+        except FileNotFoundError:
+            pass
+    return listing
+
+
+def cands_owners(cands_files):
+    """Map filterbank -> .cands files, by the ifile column of each file's first line."""
+    owners = {}
+    for cands in cands_files:
+        with open(cands) as f:
+            fields = f.readline().split()
+        if fields:
+            owners.setdefault(fields[-1], []).append(cands)
+    return owners
+
+
+def run_stage(cmd, log):
+    """Run one external command, appending its output to ``log``; return (returncode, seconds)."""
+    t0 = time.time()
+    with open(log, 'a') as f:
+        f.write(f"$ {' '.join(cmd)}\n")
+        f.flush()
+        returncode = subprocess.call(cmd, stdout=f, stderr=subprocess.STDOUT)
+    return returncode, time.time() - t0
+
+
+class Pipeline:
+    """Schedules the 8-bit conversion and transientx_fil over many filterbanks.
+
+    Conversions (``filterbank.requantize`` or digifil) share an I/O
+    semaphore and transientx_fil jobs a CPU semaphore sized so their
+    threads fit in ``max_cpu``. Jobs sharing an output directory run
+    concurrently; each job takes the .cands files created or rewritten in
+    the directory during its transientx_fil run that name its filterbank
+    in the ifile column.
+    """
+
+    def __init__(self, manifest, threads=64, max_cpu=None, io_jobs=2, digifil=False, dry_run=False):
+        self.manifest = manifest
+        self.threads = threads
+        self.digifil = digifil
+        self.dry_run = dry_run
+        self.io = threading.BoundedSemaphore(max(1, io_jobs))
+        self.cpu = threading.BoundedSemaphore(max(1, (max_cpu or os.cpu_count()) // max(1, threads)))
+
+    def eight_bit(self, fil, timings, log):
+        """Path of the 8-bit filterbank, converting it (atomically) if it does not exist yet."""
+        if fil.endswith('_8bit.fil'):
+            return fil
+        outname = fil[:-len('.fil')] + '_8bit.fil'
+        if os.path.exists(outname):
+            return outname
+        if not self.digifil:
+            if self.dry_run:
+                print(f"requantize {fil} -> {outname}")
+                return outname
+            with self.io:
+                t0 = time.time()
+                filterbank.requantize(fil, outname, n_threads=max(1, self.threads // 4))
+                timings['eight_bit'] = time.time() - t0
+            return outname
+
+        part = outname + '.part'
+        cmd = [c.format(input=fil, output=part) for c in DIGIFIL_CMD]
+        if self.dry_run:
+            print(' '.join(cmd))
+            return outname
+        with self.io:
+            returncode, timings['eight_bit'] = run_stage(cmd, log)
+        if returncode != 0:
+            raise RuntimeError(f"digifil failed ({returncode})")
+        os.replace(part, outname)
+        return outname
+
+    def process(self, fil):
+        basepath = os.path.dirname(fil)
+        output_dir = os.path.join(basepath, OUTPUT_DIRNAME)
+        log = os.path.join(output_dir, os.path.basename(fil)[:-len('.fil')] + '_pipeline.log')
+        timings = {}
+        t0 = time.time()
+        if not self.dry_run:
+            os.makedirs(output_dir, exist_ok=True)
+            self.manifest.update(fil, state='running', started=t0, stamp=file_stamp(fil), hash=filterbank.quick_hash(fil),
+                                 output_dir=output_dir, log=log, error=None)
+        try:
+            outname = self.eight_bit(fil, timings, log)
+            prefix = os.path.join(output_dir, BASENAME)
+            cmd = [c.format(threads=self.threads, prefix=prefix, input=outname) for c in TRANSIENTX_CMD]
+            if self.dry_run:
+                print(' '.join(cmd))
+                return fil, 'dry-run', timings
+
+            with self.cpu:
+                before = list_cands(output_dir)
+                returncode, timings['transientx'] = run_stage(cmd, log)
+            if returncode != 0:
+                raise RuntimeError(f"transientx_fil failed ({returncode})")
+            written = [c for c, mtime in list_cands(output_dir).items() if before.get(c) != mtime]
+            cands = sorted(cands_owners(written).get(outname, []))
+        except Exception as err:
+            timings['total'] = time.time() - t0
+            self.manifest.update(fil, state='failed', error=str(err), timings=timings)
+            return fil, 'failed', timings
+
+        timings['total'] = time.time() - t0
+        self.manifest.update(fil, state='done', eight_bit=outname, cands=cands, timings=timings, finished=time.time())
+        return fil, 'done', timings
+
+
+def plan(manifest, fils, adopt=False):
+    """Filterbanks still to process (new, changed, interrupted or failed).
+
+    With ``adopt`` the .cands files of earlier runs of runTransientX.sh are
+    attributed to their filterbanks, which are then marked done.
+    """
+    todo = []
+    legacy = {}
+    for fil in fils:
+        if manifest.is_done(fil):
+            continue
+        if adopt:
+            output_dir = os.path.join(os.path.dirname(fil), OUTPUT_DIRNAME)
+            if output_dir not in legacy:
+                legacy[output_dir] = cands_owners(list_cands(output_dir))
+            owned = legacy[output_dir].get(fil) or legacy[output_dir].get(fil[:-len('.fil')] + '_8bit.fil')
+            if owned:
+                manifest.update(fil, state='done', stamp=file_stamp(fil), hash=filterbank.quick_hash(fil),
+                                output_dir=output_dir, cands=sorted(owned), timings={}, adopted=True)
+                continue
+        todo.append(fil)
+    return todo
+
+
+def summarise(results):
+    totals = {stage: 0.0 for stage in STAGES + ('total',)}
+    for _, state, timings in results:
+        for stage, seconds in timings.items():
+            totals[stage] = totals.get(stage, 0.0) + seconds
+    print(f"Processed {len(results)} filterbanks: "
+          f"{sum(state == 'done' for _, state, _ in results)} done, {sum(state == 'failed' for _, state, _ in results)} failed")
+    for stage, seconds in totals.items():
+        print(f"  {stage:>10}: {seconds:10.1f} s")
+
+
+def main():
+    args = fetch_args()
+    manifest = Manifest(args.manifest or os.path.join(args.path, MANIFEST_NAME))
+    fils = find_filterbanks(args.path)
+    todo = plan(manifest, fils, args.adopt)
+    print(f"{len(fils)} filterbanks, {len(fils) - len(todo)} already done, {len(todo)} to process")
+
+    pipeline = Pipeline(manifest, args.threads, args.max_cpu, args.io_jobs, args.digifil, args.dry_run)
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = [pool.submit(pipeline.process, fil) for fil in todo]
+        for future in as_completed(futures):
+            fil, state, timings = future.result()
+            print(f"{state}: {fil} " + ' '.join(f"{k}={v:.1f}s" for k, v in timings.items()))
+            results.append((fil, state, timings))
+    summarise(results)
+
+
+if __name__ == "__main__":
+    main()